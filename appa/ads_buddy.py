@@ -5,12 +5,15 @@ from html import unescape
 
 import requests
 
+import cancellation
+import tracing
 from local_config import ADS_TOKEN
 from log_buddy import lb
 from names.ads_name import ADSName, InvalidName
 from names.name_aware import NameAwareDict
 from records.author_record import AuthorRecord
 from records.document_record import DocumentRecord
+from single_flight import SingleFlight
 
 FIELDS = ['bibcode', 'title', 'author', 'aff', 'doctype',
           'keyword', 'pub', 'date', 'citation_count', 'read_count',
@@ -30,6 +33,10 @@ FILTERS = [' OR '.join('doctype:'+dt for dt in _allowed_doctypes),
 MAXIMUM_RESPONSE_SIZE = 2000
 ESTIMATED_DOCUMENTS_PER_AUTHOR = 300
 
+# Identical ADS queries made concurrently by different threads are sent once
+_document_queries = SingleFlight("ads_document_queries")
+_author_queries = SingleFlight("ads_author_queries")
+
 
 class ADS_Buddy:
     prefetch_queue: deque
@@ -40,6 +47,12 @@ class ADS_Buddy:
         self.prefetch_set = set()
     
     def get_document(self, bibcode):
+        cancellation.check()
+        with tracing.span("ads_document", bibcode=bibcode):
+            return _document_queries.do(
+                bibcode, self._query_document, bibcode)
+    
+    def _query_document(self, bibcode):
         lb.i("Querying ADS for bibcode " + bibcode)
         t_start = time.time()
         
@@ -54,10 +67,16 @@ class ADS_Buddy:
         rec = self._article_to_record(r.json()['response']['docs'][0])
         return rec
     
-    def get_papers_for_orcid_id(self, orcid_id):
+    def get_papers_for_orcid_id(self, orcid_id, entered_since=None):
+        """Queries ADS for an ORCID ID's papers
+        
+        If `entered_since` is given as a Unix timestamp, only documents
+        entered into ADS since that time are returned."""
         orcid_id = normalize_orcid_id(orcid_id)
         lb.i(f"Querying ADS for orcid id " + orcid_id)
         query = f"orcid:({orcid_id})"
+        if entered_since is not None:
+            query += _entdate_filter(entered_since)
         
         documents = self._inner_query_for_author(query, 1)
         
@@ -81,10 +100,19 @@ class ADS_Buddy:
             author_record.name = intermed[0][-1]
         return author_record, documents
     
-    def get_papers_for_author(self, query_author):
+    def get_papers_for_author(self, query_author, entered_since=None):
+        """Queries ADS for an author's papers, along with prefetched authors
+        
+        If `entered_since` is given as a Unix timestamp, only documents
+        entered into ADS since that time are returned, and no authors are
+        prefetched."""
         query_author = ADSName.parse(query_author)
         
-        query_authors = self._select_authors_to_prefetch()
+        if entered_since is None:
+            query_authors = self._select_authors_to_prefetch()
+        else:
+            # A prefetched author's query would be limited by date as well
+            query_authors = []
         if query_author not in query_authors:
             query_authors.append(query_author)
         
@@ -93,6 +121,27 @@ class ADS_Buddy:
             lb.i(" Also prefetching. Query: " + "; ".join(
                 [a.qualified_full_name for a in query_authors]))
         
+        author_records, documents = self._query_for_authors(
+            query_authors, entered_since)
+        
+        if len(query_authors) == 1:
+            return author_records[query_author], documents
+        else:
+            return author_records, documents
+    
+    def get_papers_for_authors(self, query_authors, entered_since=None):
+        """Queries ADS for several authors' papers in one query
+        
+        Returns a NameAwareDict of AuthorRecords and the list of documents.
+        No authors are prefetched. If `entered_since` is given as a Unix
+        timestamp, only documents entered into ADS since that time are
+        returned."""
+        query_authors = [ADSName.parse(author) for author in query_authors]
+        lb.i("Querying ADS for authors " + "; ".join(
+            [a.qualified_full_name for a in query_authors]))
+        return self._query_for_authors(query_authors, entered_since)
+    
+    def _query_for_authors(self, query_authors, entered_since=None):
         query_strings = []
         for author in query_authors:
             query_string = '"' + author.full_name + '"'
@@ -101,6 +150,8 @@ class ADS_Buddy:
             query_strings.append(query_string)
         query = " OR ".join(query_strings)
         query = f"author:({query})"
+        if entered_since is not None:
+            query += _entdate_filter(entered_since)
         
         documents = self._inner_query_for_author(query, len(query_authors))
         
@@ -111,16 +162,15 @@ class ADS_Buddy:
         # author list. This is critically important if we're pre-fetching
         # authors, but it's also important to support the "<" and ">"
         # specificity selectors for author names
+        records_to_match = author_records.items()
         for document in documents:
             matched = False
-            names = [ADSName.parse(n) for n in document.authors]
-            for name in names:
-                try:
-                    author_records[name].documents.append(
-                        document.bibcode)
+            name_array = document.author_name_array
+            for author, author_record in records_to_match:
+                if len(name_array.find_matching_indices(author)):
+                    author_record.documents.append(document.bibcode)
                     matched = True
-                except KeyError:
-                    pass
+            names = name_array.names
             if (not matched and all(not a.require_more_specific
                                     and not a.require_less_specific
                                     for a in query_authors)):
@@ -158,11 +208,8 @@ class ADS_Buddy:
             # Becomes important for papers with _many_ authors, e.g. LIGO
             # papers, which use only initials and so can have duplicate names
             author_record.documents = sorted(set(author_record.documents))
-
-        if len(query_authors) == 1:
-            return author_records[query_author], documents
-        else:
-            return author_records, documents
+        
+        return author_records, documents
     
     def _inner_query_for_author(self, query, n_authors):
         params = {"q": query,
@@ -172,7 +219,13 @@ class ADS_Buddy:
                   "fl": ",".join(FIELDS),
                   "sort": "date+asc"}
         
-        documents = self._do_query_for_author(params, n_authors)
+        # Checked here rather than inside the query, so that a cancelled
+        # search doesn't pass its cancellation on to searches sharing the
+        # query
+        cancellation.check()
+        with tracing.span("ads_query", query=query, n_authors=n_authors):
+            documents = _author_queries.do(query, self._do_query_for_author,
+                                           params, n_authors)
         lb.on_author_queried_from_ADS(n_authors)
         return documents
     
@@ -291,6 +344,8 @@ class ADS_Buddy:
 
         for i in reversed(bad_indices):
             document.delete_author(i)
+        # We've already parsed every name, so save that work
+        document._author_names = tuple(names)
         
         return document
     
@@ -316,6 +371,14 @@ class ADS_Buddy:
         return prefetches
 
 
+def _entdate_filter(entered_since):
+    # ADS entry dates have a resolution of one day, so back up a day to be
+    # sure nothing is missed
+    date = time.strftime("%Y-%m-%d",
+                         time.gmtime(entered_since - 24 * 60 * 60))
+    return f" AND entdate:[{date} TO *]"
+
+
 def is_bibcode(value):
     return (
         len(value) == 19
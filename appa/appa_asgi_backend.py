@@ -0,0 +1,146 @@
+"""
+An asyncio (ASGI) alternative to the Flask server in appa_web_backend.py
+
+Serves the same endpoints, but a search waiting on ADS or the cache doesn't
+tie up a server worker, so one process can have many searches in flight.
+Run it with any ASGI server, e.g.
+
+    uvicorn appa_asgi_backend:app --port 5000
+
+Path finding itself is synchronous, so each search runs on a thread from a
+dedicated pool, in its own search context, while the event loop keeps
+accepting requests.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from cache import cache_buddy
+
+import backend_common
+import metrics
+from cancellation import CancellationToken
+from job_queue import JobQueue
+from log_buddy import lb
+
+# The number of searches run at once. Searches beyond this wait in line.
+# Searches spend most of their time waiting on ADS and the cache, so this can
+# be well above the number of CPUs.
+MAX_CONCURRENT_SEARCHES = 64
+
+lb.set_log_level(lb.INFO)
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SEARCHES,
+                               thread_name_prefix="appa-search")
+# Runs searches submitted through /submit_route
+job_queue = JobQueue()
+prometheus_exporter = metrics.PrometheusExporter()
+metrics.add_exporter(prometheus_exporter)
+
+
+class _Request:
+    """The parts of a Flask request which backend_common uses"""
+    
+    def __init__(self, query_string: bytes, body: bytes):
+        self.args = {key: values[-1] for key, values in parse_qs(
+            query_string.decode('latin-1'), keep_blank_values=True).items()}
+        self.data = body
+
+
+async def _read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def _send_response(send, data, code, headers):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    headers = {'Content-Type': 'text/html; charset=utf-8', **headers}
+    headers = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+               for k, v in headers.items()]
+    await send({'type': 'http.response.start', 'status': code,
+                'headers': headers})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, fn, *args)
+
+
+def _start_up():
+    clear_start = time.time()
+    cache_buddy.clear_stale_data()
+    lb.i(f"Cleared stale cache data in {time.time() - clear_start:.2f} s")
+    cache_buddy.load_snapshot()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await _run(_start_up)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await _run(cache_buddy.flush_writes)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _find_route(request, receive):
+    """Runs a search, stopping it if the client disconnects"""
+    cancellation_token = CancellationToken(
+        timeout=backend_common.SEARCH_TIME_BUDGET)
+    
+    async def watch_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        lb.i("Client disconnected, cancelling search")
+        cancellation_token.cancel()
+    
+    watcher = asyncio.create_task(watch_for_disconnect())
+    try:
+        data, code, headers, cache_key = await _run(
+            backend_common.find_route, request, True, cancellation_token)
+    finally:
+        watcher.cancel()
+    return data, code, headers
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    
+    request = _Request(scope['query_string'], await _read_body(receive))
+    if scope['path'] == '/find_route':
+        data, code, headers = await _find_route(request, receive)
+    elif scope['path'] == '/get_progress':
+        # Progress checks are quick, so they don't wait behind the searches
+        data, code, headers = await asyncio.to_thread(
+            backend_common.get_progress, request)
+    elif scope['path'] == '/submit_route':
+        data, code, headers = await asyncio.to_thread(
+            backend_common.submit_route, request, job_queue)
+    elif scope['path'] == '/poll_route':
+        data, code, headers = await asyncio.to_thread(
+            backend_common.poll_route, request, job_queue)
+    elif scope['path'] == '/get_trace':
+        data, code, headers = await asyncio.to_thread(
+            backend_common.get_trace, request)
+    elif scope['path'] == '/get_profile':
+        data, code, headers = await asyncio.to_thread(
+            backend_common.get_profile, request)
+    elif scope['path'] == '/metrics':
+        data, code, headers = (prometheus_exporter.render(), 200,
+                               {'Content-Type': 'text/plain; version=0.0.4'})
+    else:
+        data, code, headers = "Not found", 404, {}
+    await _send_response(send, data, code, headers)
@@ -4,10 +4,16 @@ from cache import cache_buddy
 from flask import Flask, request
 
 import backend_common
+import metrics
+from job_queue import JobQueue
 from log_buddy import lb
 
 app = Flask(__name__)
 lb.set_log_level(lb.INFO)
+# Runs searches submitted through /submit_route
+job_queue = JobQueue()
+prometheus_exporter = metrics.PrometheusExporter()
+metrics.add_exporter(prometheus_exporter)
 
 
 @app.before_first_request
@@ -15,6 +21,7 @@ def clear_cache():
     clear_start = time.time()
     cache_buddy.clear_stale_data()
     lb.i(f"Cleared stale cache data in {time.time() - clear_start:.2f} s")
+    cache_buddy.load_snapshot()
 
 
 @app.route('/find_route', methods=['GET', 'POST'])
@@ -26,3 +33,29 @@ def find_route():
 @app.route('/get_progress')
 def get_progress():
     return backend_common.get_progress(request)
+
+
+@app.route('/submit_route', methods=['GET', 'POST'])
+def submit_route():
+    return backend_common.submit_route(request, job_queue)
+
+
+@app.route('/poll_route')
+def poll_route():
+    return backend_common.poll_route(request, job_queue)
+
+
+@app.route('/get_trace')
+def get_trace():
+    return backend_common.get_trace(request)
+
+
+@app.route('/get_profile')
+def get_profile():
+    return backend_common.get_profile(request)
+
+
+@app.route('/metrics')
+def get_metrics():
+    return (prometheus_exporter.render(), 200,
+            {'Content-Type': 'text/plain; version=0.0.4'})
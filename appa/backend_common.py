@@ -1,24 +1,63 @@
 import json
+import random
 
 from cache import cache_buddy
 
+import job_queue
+import local_config
+import metrics
 from ads_buddy import ADSError, ADSRateLimitError
+from cancellation import CancellationToken, SearchCancelled
 from log_buddy import lb
+from names import ads_name
 from path_finder import PathFinder, PathFinderError
+from profiler import SamplingProfiler
 from route_jsonifyer import to_json
+import search_context
+import tracing
 
 HEADERS = {'Access-Control-Allow-Origin': '*'}
+# Searches are stopped after this many seconds. None means no limit.
+SEARCH_TIME_BUDGET = getattr(local_config, 'search_time_budget', None)
+# This fraction of searches is run under the sampling profiler
+PROFILE_SAMPLE_RATE = getattr(local_config, 'profile_sample_rate', 0)
+# A search's trace and profile are stored in the result cache under the
+# result's key with these suffixes
+TRACE_KEY_SUFFIX = "_trace"
+PROFILE_KEY_SUFFIX = "_profile"
 
 
-def find_route(request, load_cached_result=True):
+def find_route(request, load_cached_result=True, cancellation_token=None):
+    """Runs a search and returns the response
+    
+    The search can be stopped early through `cancellation_token`, e.g. if
+    the client disconnects. Otherwise, a token is made which expires after
+    SEARCH_TIME_BUDGET."""
+    if cancellation_token is None:
+        cancellation_token = CancellationToken(timeout=SEARCH_TIME_BUDGET)
+    # Each search's stats, prefetch queue, etc. are kept separate, so several
+    # searches can run at once in one process
+    with search_context.SearchContext():
+        return _find_route(request, load_cached_result, cancellation_token)
+
+
+def _find_route(request, load_cached_result, cancellation_token):
     source, dest, exclude = parse_url_args(request)
     
     result_cache_key = cache_buddy.generate_result_cache_key(
         source, dest, exclude)
+    # When requested, the search's phases are traced, or the search is
+    # profiled. This needs the search to actually run, so any cached result
+    # is ignored.
+    trace = request.args.get('trace') is not None
+    profile = request.args.get('profile') is not None
+    tracer = None
+    profiler = None
     
     try:
         if (cache_buddy.result_is_in_cache(result_cache_key)
-                and request.args.get('no_cache') is None):
+                and request.args.get('no_cache') is None
+                and not trace and not profile):
             if load_cached_result:
                 data = cache_buddy.load_result(result_cache_key)
             else:
@@ -32,11 +71,27 @@ def find_route(request, load_cached_result=True):
              f"excl:{';'.join(sorted(exclude))}, pkey:{progress_key}")
         lb.reset_stats()
         lb.set_progress_key(progress_key)
+        if trace:
+            tracer = tracing.start_trace()
+        if profile or random.random() < PROFILE_SAMPLE_RATE:
+            profiler = SamplingProfiler().start()
         
         pf = PathFinder(source, dest, exclude)
-        pf.find_path()
+        pf.find_path(cancellation_token)
         data = to_json(pf)
         cache_buddy.cache_result(data, result_cache_key)
+    except SearchCancelled as e:
+        lb.i(f"Search stopped: {e}")
+        data = json.dumps({
+            "error_key": e.key,
+            "error_msg": str(e),
+            "src": source,
+            "dest": dest,
+            # How far the search got before stopping
+            "n_iterations": pf.n_iterations,
+            "n_authors_queried": lb.n_authors_queried,
+            "n_docs_queried": lb.n_docs_queried
+        })
     except PathFinderError as e:
         data = json.dumps({
             "error_key": e.key,
@@ -70,9 +125,116 @@ def find_route(request, load_cached_result=True):
             "dest": dest
         })
     
+    # Headers pointing the client to the trace or profile
+    diagnostic_headers = {}
+    if tracer is not None:
+        _store_diagnostic(tracing.export_chrome_trace(tracer),
+                          result_cache_key + TRACE_KEY_SUFFIX,
+                          'X-Appa-Trace-Key', diagnostic_headers)
+    if profiler is not None:
+        profiler.stop()
+        lb.i(f"Profile: {profiler.summary()}")
+        _store_diagnostic(profiler.folded_stacks(),
+                          result_cache_key + PROFILE_KEY_SUFFIX,
+                          'X-Appa-Profile-Key', diagnostic_headers)
+    headers = HEADERS
+    if len(diagnostic_headers):
+        headers = {**HEADERS, **diagnostic_headers,
+                   'Access-Control-Expose-Headers':
+                       ", ".join(diagnostic_headers)}
+    
+    metrics.export_search()
     lb.log_stats()
     lb.reset_stats()
-    return data, 200, HEADERS, result_cache_key
+    ads_name.new_generation()
+    cache_buddy.save_snapshot_if_due()
+    return data, 200, headers, result_cache_key
+
+
+def _store_diagnostic(data, key, header, headers):
+    """Stores a search's trace or profile next to its result, and adds a
+    response header giving its key"""
+    try:
+        cache_buddy.cache_result(data, key)
+    except:
+        lb.log_exception()
+        return
+    lb.i(f"Stored {key}")
+    headers[header] = key
+
+
+def get_trace(request):
+    """Returns a stored trace, in the Chrome trace event format"""
+    return _load_diagnostic(request, TRACE_KEY_SUFFIX)
+
+
+def get_profile(request):
+    """Returns a stored profile, as folded stacks"""
+    return _load_diagnostic(request, PROFILE_KEY_SUFFIX)
+
+
+def _load_diagnostic(request, suffix):
+    key = request.args.get('key')
+    try:
+        # Other kinds of data in the result cache aren't served here
+        if not key.endswith(suffix):
+            raise cache_buddy.CacheMiss(key)
+        response = cache_buddy.load_result(key)
+    except:
+        response = json.dumps({"error": True})
+    return response, 200, HEADERS
+
+
+def submit_route(request, jobs: job_queue.JobQueue):
+    """Queues a search to be run by `jobs`, rather than within the request
+    
+    Identical searches already in progress are not repeated. The response
+    gives the job key to be passed to poll_route. If the result is already
+    cached, nothing is queued and polling returns it immediately."""
+    source, dest, exclude = parse_url_args(request)
+    result_cache_key = cache_buddy.generate_result_cache_key(
+        source, dest, exclude)
+    
+    if (request.args.get('no_cache') is not None
+            or not cache_buddy.result_is_in_cache(result_cache_key)):
+        # The request object won't be valid once we've responded
+        jobs.submit(result_cache_key, find_route, DetachedRequest(request))
+    return (json.dumps({"job_key": result_cache_key}), 200, HEADERS)
+
+
+def poll_route(request, jobs: job_queue.JobQueue):
+    """Returns the result of a search submitted with submit_route
+    
+    While the search is in progress, the response gives the job's status,
+    and progress can be checked through get_progress as usual."""
+    key = request.args.get('key')
+    job = jobs.get(key)
+    if job is None:
+        try:
+            data = cache_buddy.load_result(key)
+        except cache_buddy.CacheMiss:
+            data = json.dumps({
+                "error_key": "unknown_job",
+                "error_msg": "No search is known with that key"})
+        return data, 200, HEADERS
+    if job.status == job_queue.DONE:
+        data, code, headers, _ = job.result
+        return data, code, headers
+    if job.status == job_queue.FAILED:
+        data = json.dumps({
+            "error_key": "unknown",
+            "error_msg": "Unexpected server error"})
+        return data, 200, HEADERS
+    return json.dumps({"job_key": key, "status": job.status}), 200, HEADERS
+
+
+class DetachedRequest:
+    """A copy of the parts of a Flask request used here, which stays valid
+    after the request is finished"""
+    
+    def __init__(self, request):
+        self.args = dict(request.args.items())
+        self.data = request.data
 
 
 def get_progress(request):
@@ -0,0 +1,74 @@
+"""
+Measures ADSName parsing throughput over a corpus of ADS-style author strings
+
+Run from the appa directory with `python -m benchmarks.bench_ads_name`
+"""
+
+import random
+import time
+
+import names.ads_name as ads_name
+from names.ads_name import ADSName
+
+LAST_NAMES = [
+    "Smith", "Wang", "Zhang", "Li", "Kim", "Müller", "García", "Van Kooten",
+    "de la Cruz", "O'Brien", "Smith-Jones", "Nguyễn", "Østergaard",
+    "Schröder", "Rast", "Murray", "Tanaka", "Ibáñez", "van der Berg",
+    "Papadopoulos", "Kowalski", "Dupont", "Ivanov", "Rossi", "Šimek",
+]
+GIVEN_NAMES = [
+    "John", "Mary", "Wei", "Jian-Feng", "José", "Anne-Marie", "Sam", "Mark",
+    "Stephen", "Eva", "Øystein", "Zoë", "Hiroshi", "Maria", "Jürgen",
+]
+
+
+def generate_corpus(n, seed=1):
+    """Generates author strings in the mix of formats seen in ADS records"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n):
+        # A numeric suffix keeps most strings distinct, as in a real author
+        # list, so that most parses miss the cache
+        last = rng.choice(LAST_NAMES) + ("" if i % 4 == 0 else f"x{i}")
+        given = rng.sample(GIVEN_NAMES, rng.choice((0, 1, 1, 2, 2, 3)))
+        style = rng.random()
+        if style < .4:
+            given = [g[0] + "." for g in given]
+        elif style < .6 and len(given) > 1:
+            given = [given[0]] + [g[0] + "." for g in given[1:]]
+        if len(given):
+            corpus.append(f"{last}, {' '.join(given)}")
+        else:
+            corpus.append(last)
+    return corpus
+
+
+def time_parsing(corpus, parse_function):
+    ads_name._name_cache.clear()
+    ads_name._previous_name_cache.clear()
+    t_start = time.perf_counter()
+    parse_function(corpus)
+    t_cold = time.perf_counter() - t_start
+    
+    t_start = time.perf_counter()
+    parse_function(corpus)
+    t_warm = time.perf_counter() - t_start
+    return t_cold, t_warm
+
+
+def main(n=100_000):
+    corpus = generate_corpus(n)
+    n_ascii = sum(name.isascii() for name in corpus)
+    print(f"{n} names, {n_ascii / n:.0%} pure ASCII")
+    
+    benchmarks = [("parse", lambda c: [ADSName.parse(n) for n in c])]
+    if hasattr(ADSName, 'parse_many'):
+        benchmarks.append(("parse_many", ADSName.parse_many))
+    for label, function in benchmarks:
+        t_cold, t_warm = time_parsing(corpus, function)
+        print(f"{label:>10}: cold {n / t_cold:10.0f} names/s,"
+              f" warm {n / t_warm:10.0f} names/s")
+
+
+if __name__ == "__main__":
+    main()
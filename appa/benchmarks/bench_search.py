@@ -0,0 +1,174 @@
+"""
+Times searches and name handling over a synthetic corpus, and checks the
+times against regression thresholds
+
+Run from the appa directory with
+
+    python -m benchmarks.bench_search [--baseline FILE] [--save-baseline FILE]
+
+A synthetic corpus (see synthetic_corpus.py) is generated with a fixed seed,
+and each benchmark is run REPEATS times, keeping the median. Each time is
+checked against its threshold in THRESHOLDS or, with --baseline, against a
+previous run's times saved with --save-baseline, plus BASELINE_TOLERANCE.
+The exit status is 1 if any benchmark is over its threshold.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from statistics import median
+
+import names.ads_name as ads_name
+import search_context
+from benchmarks.synthetic_corpus import SyntheticCorpus, use_corpus, \
+    clear_loaded_records
+from log_buddy import lb
+from names.ads_name import ADSName
+from names.name_aware import NameAwareDict
+from path_finder import PathFinder, PathFinderError
+from route_jsonifyer import to_json
+from route_ranker import AllPathsInvalid
+
+CORPUS_PARAMETERS = dict(n_people=50_000, n_documents=50_000,
+                         n_collaborations=2, collaboration_size=3_000,
+                         papers_per_collaboration=10, seed=1)
+N_SEARCHES = 6
+SEARCH_SEED = 4
+REPEATS = 3
+
+# Median seconds above which a benchmark counts as a regression. These are
+# about three times the times measured when they were set, to allow for
+# slower machines.
+THRESHOLDS = {
+    'ads_name_parse': 2.5,
+    'name_aware_dict': 4.5,
+    'find_path': 6,
+    'process_pathfinder': 18,
+    'to_json': .75,
+}
+# With --baseline, a benchmark regresses if it's this much slower than the
+# baseline
+BASELINE_TOLERANCE = 1.25
+
+
+def bench_ads_name_parse(corpus_names):
+    ads_name._name_cache.clear()
+    ads_name._previous_name_cache.clear()
+    t_start = time.perf_counter()
+    for name in corpus_names:
+        ADSName.parse(name)
+    return time.perf_counter() - t_start
+
+
+def bench_name_aware_dict(names):
+    """Times filing each name, then checking for and looking up each"""
+    t_start = time.perf_counter()
+    nad = NameAwareDict()
+    for i, name in enumerate(names):
+        nad[name] = i
+    for name in names:
+        # A name can become ambiguous as more specific names are filed
+        if name in nad:
+            nad[name]
+    return time.perf_counter() - t_start
+
+
+def bench_search(src, dest):
+    """Times one search, with nothing loaded in memory at the start
+    
+    Returns the times for find_path, for the ranking done by
+    process_pathfinder, and for the rest of to_json"""
+    clear_loaded_records()
+    with search_context.SearchContext():
+        t_start = time.perf_counter()
+        pf = PathFinder(src, dest, [])
+        pf.find_path()
+        t_found = time.perf_counter()
+        to_json(pf)
+        t_stop = time.perf_counter()
+        time_ranking = lb.time_ranking
+    return {'find_path': t_found - t_start,
+            'process_pathfinder': time_ranking,
+            'to_json': t_stop - t_found - time_ranking}
+
+
+def choose_searches(corpus, n_searches=N_SEARCHES, seed=SEARCH_SEED):
+    """Chooses pairs of authors with a path between them"""
+    rng = random.Random(seed)
+    searches = []
+    while len(searches) < n_searches:
+        src, dest = corpus.choose_search_pair(rng)
+        try:
+            bench_search(src, dest)
+        except (PathFinderError, AllPathsInvalid):
+            continue
+        searches.append((src, dest))
+    return searches
+
+
+def run_benchmarks(corpus, repeats=REPEATS):
+    """Returns the median time of each benchmark"""
+    corpus_names = corpus.author_names()
+    parsed_names = [ADSName.parse(name) for name in corpus_names]
+    with use_corpus(corpus):
+        searches = choose_searches(corpus)
+        times = {name: [] for name in THRESHOLDS}
+        for _ in range(repeats):
+            times['ads_name_parse'].append(
+                bench_ads_name_parse(corpus_names))
+            times['name_aware_dict'].append(
+                bench_name_aware_dict(parsed_names))
+            totals = dict.fromkeys(('find_path', 'process_pathfinder',
+                                    'to_json'), 0)
+            for src, dest in searches:
+                for name, value in bench_search(src, dest).items():
+                    totals[name] += value
+            for name, value in totals.items():
+                times[name].append(value)
+    return {name: median(values) for name, values in times.items()}
+
+
+def find_regressions(results, thresholds):
+    """Returns the names of benchmarks over their thresholds"""
+    return [name for name, value in results.items()
+            if name in thresholds and value > thresholds[name]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--baseline",
+                        help="Compare against times saved in this file")
+    parser.add_argument("--save-baseline",
+                        help="Save this run's times to this file")
+    args = parser.parse_args(argv)
+    
+    t_start = time.perf_counter()
+    corpus = SyntheticCorpus(**CORPUS_PARAMETERS)
+    print(f"Generated {len(corpus.documents)} documents by"
+          f" {len(corpus.people)} people"
+          f" in {time.perf_counter() - t_start:.1f} s")
+    
+    results = run_benchmarks(corpus)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            thresholds = {name: value * BASELINE_TOLERANCE
+                          for name, value in json.load(f).items()}
+    else:
+        thresholds = THRESHOLDS
+    
+    regressions = find_regressions(results, thresholds)
+    for name, value in results.items():
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:>20}: {value:7.3f} s"
+              f" (threshold {thresholds.get(name, float('nan')):.3f} s){flag}")
+    
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if len(regressions) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Reports the import cost of an entry point module, for cold-start tuning
+
+Run from the appa directory with `python -m benchmarks.import_time [module]`.
+The module defaults to `main`, the Cloud Functions entry point. Each import
+runs in a fresh interpreter with `-X importtime`, and the report lists the
+slowest modules by cumulative time (including their own imports) along with
+per-package totals of self time.
+"""
+
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def measure_imports(module):
+    """Returns (self_us, cumulative_us, depth, name) for each imported module"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr}")
+    entries = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            # The header line
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append(
+            (int(self_us), int(cumulative_us), depth, name.strip()))
+    return entries
+
+
+def report(entries, module, n_slowest=20):
+    total = sum(self_us for self_us, _, _, _ in entries)
+    print(f"Importing {module}: {total / 1000:.1f} ms,"
+          f" {len(entries)} modules")
+    
+    print("\nSlowest modules by cumulative time (ms):")
+    slowest = sorted(entries, key=lambda e: e[1], reverse=True)[:n_slowest]
+    for self_us, cumulative_us, depth, name in slowest:
+        print(f"  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f} self"
+              f"  {name}")
+    
+    by_package = defaultdict(int)
+    for self_us, _, _, name in entries:
+        by_package[name.split('.')[0]] += self_us
+    print("\nSelf time by top-level package (ms):")
+    packages = sorted(by_package.items(), key=lambda p: p[1], reverse=True)
+    for package, self_us in packages[:n_slowest]:
+        print(f"  {self_us / 1000:8.1f}  {package}")
+
+
+def main(module="main"):
+    report(measure_imports(module), module)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,68 @@
+"""
+Measures search throughput of a running backend under concurrent load
+
+Run from the appa directory with
+
+    python -m benchmarks.load_test URL [concurrency] [n_searches]
+
+where URL is the server's base address, e.g. http://localhost:5000. Run it
+once against the Flask server (appa_web_backend.py) and once against the
+ASGI server (appa_asgi_backend.py) to compare them. Searches are drawn from
+PAIRS and sent with `no_cache` so that every one runs a full search,
+though the servers' record caches will be warm after the first few.
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+PAIRS = [
+    ("Van Kooten, S.", "Weinberg, S."),
+    ("Kurtz, M.", "Accomazzi, A."),
+    ("Rast, M.", "Kochanek, C."),
+    ("Murray, S.", "Van Kooten, S."),
+    ("Cranmer, S.", "Pizzo, V."),
+]
+
+
+def run_search(base_url, source, dest, i):
+    query = urlencode({'src': source, 'dest': dest, 'no_cache': 1})
+    # The request body is the progress key
+    request = Request(f"{base_url}/find_route?{query}",
+                      data=f"load_test_{i}".encode(), method='POST')
+    t_start = time.time()
+    with urlopen(request, timeout=600) as response:
+        response.read()
+    return time.time() - t_start
+
+
+def run(base_url, concurrency=16, n_searches=64):
+    """Returns (wall time, list of per-search latencies)"""
+    t_start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_search, base_url.rstrip('/'),
+                                   *PAIRS[i % len(PAIRS)], i)
+                   for i in range(n_searches)]
+        latencies = [future.result() for future in futures]
+    return time.time() - t_start, latencies
+
+
+def report(wall_time, latencies, concurrency):
+    latencies = sorted(latencies)
+    p95 = latencies[int(.95 * (len(latencies) - 1))]
+    print(f"{len(latencies)} searches, {concurrency} at a time,"
+          f" in {wall_time:.1f} s: {len(latencies) / wall_time:.2f} searches/s")
+    print(f"Latency min/med/p95/max: {latencies[0]:.2f}/"
+          f"{median(latencies):.2f}/{p95:.2f}/{latencies[-1]:.2f} s")
+
+
+def main(base_url, concurrency=16, n_searches=64):
+    concurrency, n_searches = int(concurrency), int(n_searches)
+    report(*run(base_url, concurrency, n_searches), concurrency)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,380 @@
+"""
+Generates synthetic ADS-like corpora for benchmarking, and serves them as a
+backing cache
+
+The corpora are built to exercise the expensive cases of real searches:
+
+- Author productivity follows a power law, so a few authors have hundreds of
+  papers and many coauthors, while most have only a few
+- People mostly publish within their own research community, so that, as in
+  ADS, most pairs of people are several links apart
+- Members of large collaborations co-author papers with thousands of authors
+- Surnames follow a Zipf distribution, so common surnames (and their
+  initials) are shared by many different people
+- People publish under several forms of their names ("Last, First M.",
+  "Last, F. M.", "Last, F."), and some fraction of them have ORCID IDs
+
+A SyntheticBackingCache answers author and document loads for a corpus,
+producing records in the same form as the real backing caches. Use
+`with use_corpus(corpus):` to search a corpus, e.g.
+
+    corpus = SyntheticCorpus(n_people=5_000, n_documents=10_000)
+    with use_corpus(corpus):
+        src, dest = corpus.choose_search_pair()
+        PathFinder(src, dest, []).find_path()
+"""
+
+import contextlib
+import itertools
+import random
+import time
+from collections import defaultdict
+
+import ads_buddy
+from cache import cache_buddy
+from cache.cache_buddy import CacheMiss, AUTHOR_VERSION_NUMBER, \
+    DOCUMENT_VERSION_NUMBER
+from names.ads_name import ADSName
+
+# The most common surnames, in descending order of frequency. Further,
+# rarer surnames are generated.
+COMMON_SURNAMES = [
+    "Wang", "Li", "Zhang", "Liu", "Chen", "Yang", "Kim", "Smith", "Lee",
+    "Huang", "Zhao", "Wu", "Zhou", "Nguyen", "Park", "Sun", "Müller",
+    "Johnson", "Williams", "Brown", "Jones", "García", "Martin", "Schmidt",
+    "Tanaka", "Suzuki", "Rossi", "Ivanov", "Kumar", "Singh", "Sato",
+    "Schneider", "Fischer", "Dupont", "Silva", "Santos", "Van der Berg",
+    "de la Cruz", "O'Brien", "Smith-Jones", "Østergaard", "Kowalski",
+]
+GIVEN_NAMES = [
+    "Wei", "Jing", "Min", "Jian-Feng", "Hui", "Xin", "Yan", "John", "Mary",
+    "Michael", "David", "Sarah", "James", "Anna", "Maria", "José",
+    "Anne-Marie", "Stephen", "Eva", "Øystein", "Zoë", "Hiroshi", "Yuki",
+    "Jürgen", "Sergei", "Olga", "Priya", "Rahul", "Ji-Hoon", "Seo-Yeon",
+    "Thomas", "Laura", "Peter", "Elena", "Marco", "Sofia", "Ahmed", "Fatima",
+]
+_SYLLABLES = ["ka", "ro", "mi", "ten", "bar", "lo", "vich", "sen", "dor",
+              "ha", "ni", "strom", "el", "gu", "ber", "tas", "mon", "ri"]
+
+SURNAME_ZIPF_EXPONENT = 1.0
+PRODUCTIVITY_PARETO_ALPHA = 1.6
+# A person's name appears as "Last, First M.", "Last, F. M." or "Last, F."
+# with these relative frequencies
+NAME_FORM_WEIGHTS = (5, 3, 2)
+# The average number of people in a research community, and the fraction of
+# a paper's coauthors from outside the first author's community
+COMMUNITY_SIZE = 200
+OUTSIDE_COAUTHOR_RATE = .05
+# The fraction of papers by an ORCID holder which carry their ORCID ID
+ORCID_CLAIM_RATE = .7
+
+
+class Person:
+    __slots__ = ("last_name", "given_names", "orcid_id", "affil",
+                 "productivity", "name_forms")
+    
+    def __init__(self, last_name, given_names, orcid_id, affil,
+                 productivity):
+        self.last_name = last_name
+        self.given_names = given_names
+        self.orcid_id = orcid_id
+        self.affil = affil
+        self.productivity = productivity
+        initials = [g[0] + "." for g in given_names]
+        self.name_forms = (
+            f"{last_name}, {given_names[0]} {' '.join(initials[1:])}".strip(),
+            f"{last_name}, {' '.join(initials)}",
+            f"{last_name}, {initials[0]}",
+        )
+
+
+class SyntheticCorpus:
+    def __init__(self, n_people=50_000, n_documents=50_000,
+                 n_collaborations=2, collaboration_size=3_000,
+                 papers_per_collaboration=10, orcid_fraction=.3, seed=1):
+        self.rng = random.Random(seed)
+        self.people = self._generate_people(n_people, orcid_fraction)
+        self.documents = {}
+        
+        self.communities = self._assign_communities()
+        for _ in range(n_documents):
+            self._add_document(self._choose_small_author_list())
+        
+        self.collaborations = []
+        for _ in range(n_collaborations):
+            roster = self.rng.sample(self.people, collaboration_size)
+            self.collaborations.append(roster)
+            for _ in range(papers_per_collaboration):
+                # Members come and go, and collaboration author lists are
+                # alphabetical
+                members = [person for person in roster
+                           if self.rng.random() < .95]
+                members.sort(key=lambda person: person.last_name)
+                self._add_document(members)
+    
+    def _generate_people(self, n_people, orcid_fraction):
+        n_surnames = max(n_people // 8, len(COMMON_SURNAMES))
+        surnames = list(COMMON_SURNAMES)
+        while len(surnames) < n_surnames:
+            surnames.append("".join(
+                self.rng.sample(_SYLLABLES, self.rng.randint(2, 4))
+            ).capitalize())
+        surname_weights = [1 / (rank + 1) ** SURNAME_ZIPF_EXPONENT
+                           for rank in range(len(surnames))]
+        last_names = self.rng.choices(
+            surnames, weights=surname_weights, k=n_people)
+        
+        people = []
+        for i, last_name in enumerate(last_names):
+            given_names = self.rng.sample(
+                GIVEN_NAMES, self.rng.choice((1, 2, 2, 3)))
+            orcid_id = (_make_orcid_id(i)
+                        if self.rng.random() < orcid_fraction else None)
+            affil = f"Institute {self.rng.randrange(n_people // 20 + 1)}"
+            productivity = self.rng.paretovariate(PRODUCTIVITY_PARETO_ALPHA)
+            people.append(Person(last_name, given_names, orcid_id, affil,
+                                 productivity))
+        return people
+    
+    def _assign_communities(self):
+        """Returns (members, cumulative productivities) for each
+        community"""
+        n_communities = max(len(self.people) // COMMUNITY_SIZE, 1)
+        members = [[] for _ in range(n_communities)]
+        for person in self.people:
+            members[self.rng.randrange(n_communities)].append(person)
+        return [(people, list(itertools.accumulate(
+                    person.productivity for person in people)))
+                for people in members if len(people)]
+    
+    def _choose_small_author_list(self):
+        n_authors = min(1 + int(self.rng.expovariate(1 / 3)), 50)
+        community, cum_weights = self.rng.choice(self.communities)
+        people = self.rng.choices(community, cum_weights=cum_weights,
+                                  k=n_authors)
+        for i in range(1, n_authors):
+            if self.rng.random() < OUTSIDE_COAUTHOR_RATE:
+                outside, cum_weights = self.rng.choice(self.communities)
+                people[i] = self.rng.choices(
+                    outside, cum_weights=cum_weights)[0]
+        # A person appears at most once per paper
+        return list(dict.fromkeys(people))
+    
+    def _add_document(self, people):
+        bibcode = (f"{self.rng.randint(1990, 2024)}SYNTH"
+                   f"{len(self.documents):09d}{people[0].last_name[0]}")
+        authors = []
+        orcid_ids = []
+        for person in people:
+            authors.append(self.rng.choices(
+                person.name_forms, weights=NAME_FORM_WEIGHTS)[0])
+            if (person.orcid_id is not None
+                    and self.rng.random() < ORCID_CLAIM_RATE):
+                orcid_ids.append(person.orcid_id)
+            else:
+                orcid_ids.append('')
+        self.documents[bibcode] = {
+            'bibcode': bibcode,
+            'title': f"Synthetic paper {len(self.documents)}",
+            'authors': authors,
+            'affils': [person.affil for person in people],
+            'doctype': 'article', 'keywords': [],
+            'publication': 'Synthetic', 'pubdate': bibcode[:4] + '-00',
+            'citation_count': self.rng.randrange(100),
+            'read_count': self.rng.randrange(1000),
+            'orcid_ids': orcid_ids,
+            'orcid_id_src': ','.join('1' if o else '0' for o in orcid_ids),
+        }
+    
+    def author_names(self):
+        """Returns every distinct author string in the corpus"""
+        return list(dict.fromkeys(
+            author for document in self.documents.values()
+            for author in document['authors']))
+    
+    def choose_search_pair(self, rng=None, min_papers=2):
+        """Chooses two distinct people, each on at least `min_papers`
+        papers, and returns names under which they publish"""
+        rng = rng or self.rng
+        n_papers = defaultdict(int)
+        for document in self.documents.values():
+            for author in document['authors']:
+                n_papers[author] += 1
+        candidates = [name for name, n in n_papers.items()
+                      if n >= min_papers]
+        while True:
+            src, dest = rng.sample(candidates, 2)
+            if ADSName.parse(src) != ADSName.parse(dest):
+                return src, dest
+
+
+def _make_orcid_id(i):
+    """Makes an ORCID ID with a valid ISO 7064 11,2 check digit"""
+    digits = f"{i + 10 ** 13:015d}"
+    total = 0
+    for digit in digits:
+        total = (total + int(digit)) * 2
+    check = (12 - total % 11) % 11
+    digits += "X" if check == 10 else str(check)
+    return "-".join(digits[i:i + 4] for i in range(0, 16, 4))
+
+
+class SyntheticBackingCache:
+    """Serves a SyntheticCorpus through the backing cache interface
+    
+    Author records are built on demand, the way ADS would answer a query for
+    that name, so loading a record costs time in proportion to its size, as
+    with deserializing a record from a real backing cache. Writes are
+    discarded."""
+    
+    def __init__(self, corpus: SyntheticCorpus):
+        self.corpus = corpus
+        self.timestamp = int(time.time())
+        # Each author string's appearances, as (bibcode, position) pairs
+        self._appearances = defaultdict(list)
+        self._orcid_appearances = defaultdict(list)
+        for bibcode, document in corpus.documents.items():
+            for i, (author, orcid_id) in enumerate(
+                    zip(document['authors'], document['orcid_ids'])):
+                self._appearances[author].append((bibcode, i))
+                if orcid_id:
+                    self._orcid_appearances[orcid_id].append((bibcode, i))
+        self._names_by_last_name = defaultdict(list)
+        for author in self._appearances:
+            name = ADSName.parse(author)
+            self._names_by_last_name[name.last_name].append((name, author))
+    
+    def _matching_appearances(self, key):
+        if ads_buddy.is_orcid_id(key):
+            appearances = self._orcid_appearances.get(key, [])
+            # As in ADS, the record is named for the most specific form of
+            # the name seen with the ORCID ID
+            name = None
+            for bibcode, i in appearances:
+                aname = ADSName.parse(
+                    self.corpus.documents[bibcode]['authors'][i])
+                if name is None or aname.is_more_specific_than(name):
+                    name = aname
+            return name, appearances
+        
+        name = ADSName.parse(key)
+        appearances = []
+        for candidate, author in self._names_by_last_name.get(
+                name.last_name, ()):
+            if candidate == name:
+                appearances.extend(self._appearances[author])
+        return name, appearances
+    
+    def load_author(self, key):
+        name, appearances = self._matching_appearances(key)
+        if not len(appearances):
+            raise CacheMiss(key)
+        
+        positions_by_bibcode = defaultdict(set)
+        for bibcode, i in appearances:
+            positions_by_bibcode[bibcode].add(i)
+        documents = sorted(positions_by_bibcode)
+        coauthors = defaultdict(list)
+        appears_as = defaultdict(list)
+        for idx, bibcode in enumerate(documents):
+            idx = str(idx)
+            positions = positions_by_bibcode[bibcode]
+            for i, author in enumerate(
+                    self.corpus.documents[bibcode]['authors']):
+                if i in positions:
+                    appears_as[author].append(idx)
+                else:
+                    coauthors[author].append(idx)
+        return {
+            'name': name.qualified_full_name,
+            'documents': documents,
+            'coauthors': {author: ','.join(indices)
+                          for author, indices in coauthors.items()},
+            'appears_as': {author: ','.join(indices)
+                           for author, indices in appears_as.items()},
+            'timestamp': self.timestamp,
+            'n_delta_refreshes': 0,
+            'version': AUTHOR_VERSION_NUMBER,
+        }
+    
+    def load_authors(self, keys):
+        return [self.load_author(key) for key in keys]
+    
+    def author_is_in_cache(self, key):
+        return len(self._matching_appearances(key)[1]) > 0
+    
+    def authors_are_in_cache(self, keys):
+        return [self.author_is_in_cache(key) for key in keys]
+    
+    def load_document(self, key):
+        try:
+            document = self.corpus.documents[key]
+        except KeyError:
+            raise CacheMiss(key)
+        # cache_buddy consumes the dict it's given
+        return {**document,
+                'authors': list(document['authors']),
+                'affils': list(document['affils']),
+                'orcid_ids': list(document['orcid_ids']),
+                'keywords': [],
+                'timestamp': self.timestamp,
+                'version': DOCUMENT_VERSION_NUMBER}
+    
+    def load_documents(self, keys):
+        return [self.load_document(key) for key in keys]
+    
+    def store_author(self, *args, **kwargs):
+        pass
+    
+    store_authors = store_document = store_documents = store_author
+    touch_document = store_progress_data = store_snapshot = store_author
+    store_result = delete_progress_data = store_author
+    refresh = clear_stale_data = store_author
+    
+    def delete_author(self, key):
+        raise RuntimeError("Should not delete from the synthetic corpus")
+    
+    delete_document = delete_author
+    
+    def load_snapshot(self, key):
+        raise CacheMiss(key)
+    
+    load_progress_data = load_result = load_snapshot
+    
+    def result_is_in_cache(self, key):
+        return False
+    
+    @contextlib.contextmanager
+    def batch(self):
+        yield True
+
+
+class _NoADS:
+    """Stands in for `requests` in ads_buddy, since searches of a synthetic
+    corpus must be answered entirely from the corpus"""
+    
+    def __getattr__(self, name):
+        raise RuntimeError("ADS was queried during a synthetic-corpus search")
+
+
+@contextlib.contextmanager
+def use_corpus(corpus: SyntheticCorpus):
+    """Serves the corpus as the backing cache within the block"""
+    real_backing_cache = cache_buddy.backing_cache
+    real_requests = ads_buddy.requests
+    cache_buddy.backing_cache = SyntheticBackingCache(corpus)
+    ads_buddy.requests = _NoADS()
+    try:
+        yield cache_buddy.backing_cache
+    finally:
+        cache_buddy.backing_cache = real_backing_cache
+        ads_buddy.requests = real_requests
+        clear_loaded_records()
+
+
+def clear_loaded_records():
+    """Empties cache_buddy's in-memory records, so the next search loads
+    everything from the backing cache"""
+    cache_buddy._loaded_authors.clear()
+    cache_buddy._derived_authors.clear()
+    cache_buddy._loaded_documents.clear()
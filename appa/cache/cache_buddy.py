@@ -1,14 +1,24 @@
+import atexit
+import contextlib
 import hashlib
+import json
+import queue
+import random
+import threading
 import time
 import traceback
+import zlib
+from collections import Counter, OrderedDict
 
 import local_config
 # Can't use `from log_buddy import lb` b/c it would be a circular import
 import log_buddy
+from names import ads_name
 from names.ads_name import ADSName
 from records.author_record import AuthorRecord
 from records.document_record import DocumentRecord
 from records.progress_record import ProgressRecord
+import tracing
 
 if local_config.backing_cache == "cache_fs":
     from . import cache_fs as backing_cache
@@ -21,32 +31,157 @@ else:
 MAXIMUM_AGE = 31 * 24 * 60 * 60  # 1 month in seconds
 # Records older than this will be removed by clear_stale_data()
 MAXIMUM_AGE_AUTO = MAXIMUM_AGE - 1.1 * 24 * 60 * 60
+# Each record's maximum age is shortened by a fixed, key-dependent amount of
+# up to this many seconds, so that records cached at the same time don't all
+# expire at the same time. See max_age_for().
+MAXIMUM_AGE_JITTER = 4 * 24 * 60 * 60
+# Within this many seconds of an author record's expiry, each load has a
+# growing chance of triggering a refresh on a background thread, while the
+# current record continues to be served
+EARLY_REFRESH_WINDOW = 3 * 24 * 60 * 60
+EARLY_REFRESH = getattr(local_config, 'cache_early_refresh', True)
+# For this many seconds past an author record's expiry, the expired record is
+# still served while a refresh runs on a background thread
+STALE_GRACE_PERIOD = getattr(local_config, 'cache_stale_grace_period',
+                             3 * 24 * 60 * 60) or 0
+# Author records are kept around for the grace period
+MAXIMUM_AUTHOR_AGE_AUTO = MAXIMUM_AGE_AUTO + STALE_GRACE_PERIOD
+# The longest an author record can be served, counting the grace period
+MAXIMUM_AUTHOR_LIFETIME = MAXIMUM_AGE + STALE_GRACE_PERIOD
+# Documents are only looked up through author records, so a document must
+# outlive every author record cached along with it. Each document's maximum
+# age is at least MAXIMUM_AUTHOR_LIFETIME + DOCUMENT_REWRITE_MARGIN. See
+# document_max_age_for().
+DOCUMENT_REWRITE_MARGIN = 7 * 24 * 60 * 60
+MAXIMUM_DOCUMENT_AGE = (MAXIMUM_AUTHOR_LIFETIME + MAXIMUM_AGE_JITTER
+                        + DOCUMENT_REWRITE_MARGIN)
+MAXIMUM_DOCUMENT_AGE_AUTO = MAXIMUM_DOCUMENT_AGE - 1.1 * 24 * 60 * 60
 MAXIMUM_PROGRESS_AGE = 30 * 60  # 30 min in seconds
 
+# Author and document records are written to the backing cache by a
+# background thread rather than in the request path. A record is placed in
+# _loaded_authors or _loaded_documents before its write is queued, so it's
+# immediately available to this process. Pending writes are coalesced by key
+# and flushed in batches.
+WRITE_BEHIND = getattr(local_config, 'cache_write_behind', True)
+# Seconds to wait for more writes to accumulate before flushing
+WRITE_BEHIND_INTERVAL = 0.5
+# Flush right away once this many writes are pending
+WRITE_BEHIND_MAX_PENDING = 500
+# A write that fails this many flushes in a row is dropped
+WRITE_BEHIND_MAX_ATTEMPTS = 3
+
+_UNHASHED_DOCUMENT_FIELDS = ('timestamp', 'version')
+
+# The most-used author and document records and the most recently used names
+# are periodically saved to the backing cache as a single snapshot, which a
+# new instance loads when it starts. Set cache_snapshot_interval to None to
+# disable saving snapshots.
+SNAPSHOT_INTERVAL = getattr(local_config, 'cache_snapshot_interval', 15 * 60)
+SNAPSHOT_N_AUTHORS = 2000
+SNAPSHOT_N_DOCUMENTS = 20000
+SNAPSHOT_N_NAMES = 20000
+# Request counts are merged across instances into the snapshot, keeping this
+# many of the most-requested authors
+SNAPSHOT_N_AUTHOR_HITS = 20000
+SNAPSHOT_KEY = "instance_snapshot"
+
 # Cache data format version numbers
 AUTHOR_VERSION_NUMBER = 2
 DOCUMENT_VERSION_NUMBER = 2
+SNAPSHOT_VERSION_NUMBER = 1
 
 
 _loaded_documents = dict()
 _loaded_authors = dict()
+# Author records derived from other records, which are held only in memory.
+# Maps cache keys to (derived record, base record).
+_derived_authors = dict()
+# How many times each record has been requested, for choosing what to snapshot
+_document_hits = Counter()
+_author_hits = Counter()
+# The request counts which have already been merged into a saved snapshot
+_saved_author_hits = Counter()
+# The first snapshot waits for a full interval of use, so a new instance
+# doesn't replace a good snapshot with its nearly-empty caches
+_last_snapshot_time = time.time()
+# Snapshots are saved on a background thread, one at a time
+_snapshot_thread = None
+_snapshot_lock = threading.Lock()
+
+# Maps (backing cache, writer function, key) to the record to be stored
+_pending_writes = OrderedDict()
+_pending_writes_cond = threading.Condition()
+# Held while anything is being sent to the backing cache from the background
+# thread, or while the request path is deleting from the backing cache, so
+# that batches aren't interleaved
+_backing_cache_lock = threading.RLock()
+_write_behind_thread = None
+# The number of failed flushes for each pending write that has failed
+_failed_write_attempts = Counter()
+# Maps bibcodes to the content hash and timestamp of the document as stored in
+# the backing cache
+_stored_document_hashes = {}
+_document_write_stats = {
+    'n_stored': 0,
+    'n_skipped': 0,
+    'n_timestamps_refreshed': 0,
+}
+# Called as handler(cache_key, record) on a background thread to bring an
+# author record up to date. Set by the repository module, since the cache
+# can't query ADS itself.
+_early_refresh_handler = None
+_early_refresh_queue = queue.SimpleQueue()
+_early_refresh_thread = None
+_early_refresh_keys = set()
+_early_refresh_lock = threading.Lock()
+_early_refresh_stats = {
+    'n_scheduled': 0,
+    'n_completed': 0,
+    'n_failed': 0,
+}
+_write_behind_stats = {
+    'n_flushes': 0,
+    'n_records_flushed': 0,
+    'max_queue_depth': 0,
+    'n_failed_flushes': 0,
+    'n_writes_dropped': 0,
+    'last_flush_time': 0,
+    'max_flush_time': 0,
+    'total_flush_time': 0,
+}
 
 
 def refresh():
     now = time.time()
     old = [bibcode
            for bibcode, record in _loaded_documents.items()
-           if now - record.timestamp > MAXIMUM_AGE_AUTO]
-    with backing_cache.batch():
-        for bibcode in old:
-            del _loaded_documents[bibcode]
+           if now - record.timestamp > MAXIMUM_DOCUMENT_AGE_AUTO]
+    for bibcode in old:
+        del _loaded_documents[bibcode]
+    
+    old = [bibcode
+           for bibcode, (_, timestamp) in _stored_document_hashes.items()
+           if now - timestamp > MAXIMUM_DOCUMENT_AGE_AUTO]
+    for bibcode in old:
+        del _stored_document_hashes[bibcode]
     
     old = [name
            for name, record in _loaded_authors.items()
-           if now - record.timestamp > MAXIMUM_AGE_AUTO]
-    with backing_cache.batch():
-        for name in old:
-            del _loaded_authors[name]
+           if now - record.timestamp > MAXIMUM_AUTHOR_AGE_AUTO]
+    for name in old:
+        del _loaded_authors[name]
+    
+    old = [key for key, (_, base_record) in _derived_authors.items()
+           if not _base_record_is_current(base_record)]
+    for key in old:
+        del _derived_authors[key]
+    
+    for hits, loaded in ((_document_hits, _loaded_documents),
+                         (_author_hits, _loaded_authors)):
+        old = [key for key in hits if key not in loaded]
+        for key in old:
+            del hits[key]
     
     backing_cache.refresh()
 
@@ -66,38 +201,129 @@ def cache_document(document_record: DocumentRecord):
         raise RuntimeError(
             "Invalid bibcode for caching: " + document_record.bibcode)
     _loaded_documents[document_record.bibcode] = document_record
+    _queue_write(_write_document, document_record, document_record.bibcode)
+
+
+def _write_document(target_cache, document_record: DocumentRecord, key):
+    """Stores a document unless the stored copy has the same content
+    
+    If the content (including the citation and read counts) is unchanged,
+    only the stored timestamp is refreshed, and that only if the stored copy
+    would otherwise expire before an author record cached now. Returns the
+    content hash and timestamp of what was sent, to be recorded once the
+    write has been committed, or None if nothing was sent."""
+    document_record = _serialize_document(document_record)
+    
+    content_hash = _hash_document_data(document_record)
+    timestamp = document_record['timestamp']
+    stats = _document_write_stats
+    try:
+        stored_hash, stored_timestamp = _stored_document_hashes[key]
+    except KeyError:
+        stored_hash = None
+    if stored_hash == content_hash:
+        if (stored_timestamp + document_max_age_for(key)
+                >= timestamp + MAXIMUM_AUTHOR_LIFETIME):
+            stats['n_skipped'] += 1
+            return None
+        # The full record is passed in case the stored copy has been
+        # deleted in the meantime
+        target_cache.touch_document(document_record, key)
+        stats['n_timestamps_refreshed'] += 1
+    else:
+        target_cache.store_document(document_record, key)
+        stats['n_stored'] += 1
+    return content_hash, timestamp
+
+
+def revalidate_documents(bibcodes, until):
+    """Keeps cached documents valid until at least the time `until`
     
+    Used when an author record is refreshed without re-downloading its
+    documents, so `until` is at most MAXIMUM_AUTHOR_LIFETIME from now.
+    Documents that would expire sooner have their stored timestamps
+    refreshed, after which they outlive any author record cached now.
+    Returns False, refreshing nothing, if any of the documents is no longer
+    cached, in which case they must be downloaded again."""
+    bibcodes = set(bibcodes)
+    try:
+        records = load_documents(bibcodes, missing_ok=True)
+    except CacheMiss:
+        # An expired document
+        return False
+    if records is None or len(records) < len(bibcodes):
+        return False
+    
+    now = int(time.time())
+    for record in records:
+        if record.timestamp + document_max_age_for(record.bibcode) >= until:
+            continue
+        record = record.copy()
+        record.timestamp = now
+        _loaded_documents[record.bibcode] = record
+        _queue_write(_touch_document, record, record.bibcode)
+    return True
+
+
+def _touch_document(target_cache, document_record: DocumentRecord, key):
+    document_record = _serialize_document(document_record)
+    target_cache.touch_document(document_record, key)
+    _document_write_stats['n_timestamps_refreshed'] += 1
+    return (_hash_document_data(document_record),
+            document_record['timestamp'])
+
+
+def _serialize_document(document_record: DocumentRecord):
     document_record = document_record.copy()
     document_record.compress()
     document_record = document_record.asdict()
     document_record['version'] = DOCUMENT_VERSION_NUMBER
-    backing_cache.store_document(document_record, document_record['bibcode'])
+    return document_record
+
+
+def _hash_document_data(data: dict):
+    """Hashes the content of a (compressed) document record, apart from its
+    timestamp and version"""
+    content = {k: v for k, v in data.items()
+               if k not in _UNHASHED_DOCUMENT_FIELDS}
+    content = json.dumps(content, sort_keys=True, check_circular=False,
+                         separators=(',', ':'))
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+def document_write_stats():
+    """Returns the numbers of document writes performed and skipped"""
+    return dict(_document_write_stats)
 
 
 def cache_documents(document_records: []):
-    with backing_cache.batch():
+    with _store_batch():
         for document_record in document_records:
             cache_document(document_record)
 
 
 def delete_document(bibcode):
     try:
-        backing_cache.delete_document(bibcode)
+        with _backing_cache_lock:
+            backing_cache.delete_document(bibcode)
     except:
         log_buddy.lb.e(
             f"Error deleting cache data for doc "
             f"{bibcode}\n{traceback.format_exc()}")
     if bibcode in _loaded_documents:
         del _loaded_documents[bibcode]
+    _stored_document_hashes.pop(bibcode, None)
 
 
 def load_document(bibcode):
+    _document_hits[bibcode] += 1
     try:
         data = _loaded_documents[bibcode]
     except KeyError:
         try:
             t_start = time.time()
-            data = backing_cache.load_document(bibcode)
+            with tracing.span("cache_load_document", bibcode=bibcode):
+                data = backing_cache.load_document(bibcode)
             log_buddy.lb.on_doc_load_timed(time.time() - t_start)
         except ValueError as e:
             log_buddy.lb.e(str(e))
@@ -108,6 +334,7 @@ def load_document(bibcode):
 
 def load_documents(bibcodes, missing_ok=False):
     """Note: documents are not guaranteed to be returned in the order given"""
+    _document_hits.update(bibcodes)
     need_to_load = []
     records = []
     for key in bibcodes:
@@ -119,7 +346,9 @@ def load_documents(bibcodes, missing_ok=False):
         try:
             t_start = time.time()
             try:
-                records.extend(backing_cache.load_documents(need_to_load))
+                with tracing.span("cache_load_documents",
+                                  n_documents=len(need_to_load)):
+                    records.extend(backing_cache.load_documents(need_to_load))
             except CacheMiss:
                 if missing_ok:
                     pass
@@ -154,11 +383,14 @@ def _prepare_loaded_document(data):
             del data['version']
         except KeyError:
             version = -1
+        content_hash = _hash_document_data(data)
         record = DocumentRecord(**data)
         record.decompress()
         _loaded_documents[record.bibcode] = record
+        _stored_document_hashes[record.bibcode] = (content_hash,
+                                                   record.timestamp)
     
-    if (time.time() - record.timestamp > MAXIMUM_AGE
+    if (time.time() - record.timestamp > document_max_age_for(record.bibcode)
             or version != DOCUMENT_VERSION_NUMBER):
         delete_document(record.bibcode)
         raise CacheMiss("stale cache data: " + record.bibcode)
@@ -171,17 +403,53 @@ def cache_author(author_record: AuthorRecord, cache_key=None):
     if not key_is_valid(cache_key):
         raise RuntimeError("Invalid key for caching: " + cache_key)
     _loaded_authors[cache_key] = author_record
-    
+    _queue_write(_write_author, author_record, cache_key)
+
+
+def _write_author(target_cache, author_record: AuthorRecord, key):
+    target_cache.store_author(_serialize_author(author_record), key)
+
+
+def _serialize_author(author_record: AuthorRecord):
     author_record = author_record.copy()
     author_record.compress()
     author_record.name = author_record.name.original_name
     author_record = author_record.asdict()
     author_record['version'] = AUTHOR_VERSION_NUMBER
-    backing_cache.store_author(author_record, cache_key)
+    return author_record
+
+
+def remember_derived_author(author_record: AuthorRecord,
+                            base_record: AuthorRecord, cache_key=None):
+    """Holds an author record derived from another in memory, without
+    storing it in the backing cache
+    
+    The derived record is served only until its base record expires. After
+    that, loading it is a cache miss, so that it's derived again from the
+    refreshed base record."""
+    if cache_key is None:
+        cache_key = author_record.name.qualified_full_name
+    _derived_authors[cache_key] = (author_record, base_record)
+
+
+def _load_derived_author(cache_key):
+    try:
+        record, base_record = _derived_authors[cache_key]
+    except KeyError:
+        return None
+    if _base_record_is_current(base_record):
+        return record
+    del _derived_authors[cache_key]
+    return None
+
+
+def _base_record_is_current(base_record: AuthorRecord):
+    return (time.time() - base_record.timestamp
+            <= max_age_for(str(base_record.name)))
 
 
 def cache_authors(author_records: []):
-    with backing_cache.batch():
+    with _store_batch():
         for author_record in author_records:
             cache_author(author_record)
 
@@ -190,7 +458,8 @@ def delete_author(cache_key):
     if type(cache_key) == ADSName:
         cache_key = cache_key.qualified_full_name
     try:
-        backing_cache.delete_author(cache_key)
+        with _backing_cache_lock:
+            backing_cache.delete_author(cache_key)
     except:
         log_buddy.lb.e(
             f"Error deleting cache data for author "
@@ -232,17 +501,22 @@ def authors_are_in_cache(names):
 def load_author(cache_key):
     if type(cache_key) == ADSName:
         cache_key = cache_key.qualified_full_name
+    _author_hits[cache_key] += 1
+    record = _load_derived_author(cache_key)
+    if record is not None:
+        return record
     try:
         record = _loaded_authors[cache_key]
     except KeyError:
         try:
             t_start = time.time()
-            record = backing_cache.load_author(cache_key)
+            with tracing.span("cache_load_author", author=cache_key):
+                record = backing_cache.load_author(cache_key)
             log_buddy.lb.on_author_load_timed(time.time() - t_start)
         except ValueError as e:
             log_buddy.lb.e(str(e))
             return None
-    record = _prepare_loaded_author(record)
+    record = _prepare_loaded_author(record, cache_key)
     
     return record
 
@@ -251,6 +525,7 @@ def load_authors(cache_keys):
     """Note: records are not guaranteed to be returned in the order given"""
     cache_keys = [name.qualified_full_name if type(name) == ADSName else name
                   for name in cache_keys]
+    _author_hits.update(cache_keys)
     need_to_load = []
     records = []
     for key in cache_keys:
@@ -261,7 +536,9 @@ def load_authors(cache_keys):
     if len(need_to_load):
         try:
             t_start = time.time()
-            records.extend(backing_cache.load_authors(need_to_load))
+            with tracing.span("cache_load_authors",
+                              n_authors=len(need_to_load)):
+                records.extend(backing_cache.load_authors(need_to_load))
             log_buddy.lb.on_author_load_timed(time.time() - t_start)
         except ValueError as e:
             log_buddy.lb.e(str(e))
@@ -271,7 +548,13 @@ def load_authors(cache_keys):
     return records
 
 
-def _prepare_loaded_author(data):
+def _prepare_loaded_author(data, cache_key=None):
+    """Validates a loaded author record
+    
+    If the cache key is given and the record is close to expiring, it may be
+    scheduled for an early refresh. If it has expired within the last
+    STALE_GRACE_PERIOD seconds, it is returned anyway and a refresh is
+    scheduled."""
     if type(data) == AuthorRecord:
         record = data
         version = AUTHOR_VERSION_NUMBER
@@ -285,14 +568,437 @@ def _prepare_loaded_author(data):
         record.decompress()
         _loaded_authors[str(record.name)] = record
     
-    if (time.time() - record.timestamp > MAXIMUM_AGE
-            or version != AUTHOR_VERSION_NUMBER):
+    if version != AUTHOR_VERSION_NUMBER:
         delete_author(str(record.name))
         raise CacheMiss("stale cache data: " + str(record.name))
     
+    age = time.time() - record.timestamp
+    max_age = max_age_for(str(record.name))
+    if (age > max_age
+            and cache_key is not None
+            and age < max_age + STALE_GRACE_PERIOD
+            and _schedule_early_refresh(cache_key, record)):
+        log_buddy.lb.on_stale_author_served()
+        return record
+    
+    if age > max_age:
+        # The stale record isn't deleted from the backing cache, since the
+        # caller may be able to bring it up to date and overwrite it
+        _loaded_authors.pop(str(record.name), None)
+        raise StaleCacheData(str(record.name), record)
+    
+    if (cache_key is not None
+            and EARLY_REFRESH
+            and age > max_age - EARLY_REFRESH_WINDOW
+            and random.random() < ((age - max_age + EARLY_REFRESH_WINDOW)
+                                   / EARLY_REFRESH_WINDOW)):
+        _schedule_early_refresh(cache_key, record)
+    
     return record
 
 
+def max_age_for(key):
+    """Returns the age at which the record stored under `key` expires
+    
+    This is between MAXIMUM_AGE - MAXIMUM_AGE_JITTER and MAXIMUM_AGE, and is
+    the same for a given key in every process."""
+    fraction = zlib.crc32(key.encode()) / 2**32
+    return MAXIMUM_AGE - MAXIMUM_AGE_JITTER * fraction
+
+
+def document_max_age_for(bibcode):
+    """Returns the age at which the stored document `bibcode` expires
+    
+    This is between MAXIMUM_DOCUMENT_AGE - MAXIMUM_AGE_JITTER and
+    MAXIMUM_DOCUMENT_AGE, so a document outlives any author record cached at
+    the same time."""
+    return max_age_for(bibcode) + MAXIMUM_DOCUMENT_AGE - MAXIMUM_AGE
+
+
+def set_early_refresh_handler(handler):
+    global _early_refresh_handler
+    _early_refresh_handler = handler
+
+
+def _schedule_early_refresh(cache_key, record):
+    """Queues a background refresh of an author record
+    
+    Returns False if no refresh handler is set, otherwise True, including
+    when a refresh of the record is already in progress."""
+    global _early_refresh_thread
+    if _early_refresh_handler is None:
+        return False
+    with _early_refresh_lock:
+        if cache_key in _early_refresh_keys:
+            return True
+        _early_refresh_keys.add(cache_key)
+        _early_refresh_stats['n_scheduled'] += 1
+        if _early_refresh_thread is None:
+            _early_refresh_thread = threading.Thread(
+                target=_early_refresh_loop, name="cache-early-refresh",
+                daemon=True)
+            _early_refresh_thread.start()
+    _early_refresh_queue.put((cache_key, record))
+    return True
+
+
+def _early_refresh_loop():
+    while True:
+        cache_key, record = _early_refresh_queue.get()
+        try:
+            _early_refresh_handler(cache_key, record)
+            outcome = 'n_completed'
+        except:
+            log_buddy.lb.e(f"Error refreshing author record {cache_key}"
+                           f"\n{traceback.format_exc()}")
+            outcome = 'n_failed'
+        with _early_refresh_lock:
+            _early_refresh_keys.discard(cache_key)
+            _early_refresh_stats[outcome] += 1
+
+
+def early_refresh_stats():
+    with _early_refresh_lock:
+        stats = dict(_early_refresh_stats)
+        stats['n_in_progress'] = len(_early_refresh_keys)
+    return stats
+
+
+# Upper bounds, in days, of the bins used by expiry_histogram()
+EXPIRY_HISTOGRAM_BINS = (1, 3, 7, 14, 21, 31)
+
+
+def expiry_histogram():
+    """Counts the in-memory author records by days until they expire
+    
+    This walks every loaded author record, so it's logged with each snapshot
+    rather than with each search. Returns a dict mapping each bin's upper
+    bound in days (from EXPIRY_HISTOGRAM_BINS) to the number of records
+    expiring within it, counting records not in an earlier bin."""
+    histogram = dict.fromkeys(EXPIRY_HISTOGRAM_BINS, 0)
+    now = time.time()
+    for key, record in list(_loaded_authors.items()):
+        remaining = (max_age_for(key) - (now - record.timestamp)) / 86400
+        for upper_bound in EXPIRY_HISTOGRAM_BINS:
+            if remaining < upper_bound:
+                histogram[upper_bound] += 1
+                break
+    return histogram
+
+
+def _queue_write(writer, record, key):
+    """Queues a record to be written to the backing cache
+    
+    `writer` is called as writer(backing_cache, record, key). The backing
+    cache is captured now, so the write goes to the backing cache that was
+    active when the record was cached. If a write for the same key is already
+    pending, it is replaced. A writer which stores a document returns the
+    document's content hash and timestamp, which are recorded in
+    _stored_document_hashes once the write has been sent."""
+    target_cache = backing_cache
+    if not WRITE_BEHIND:
+        stored_hash = writer(target_cache, record, key)
+        if stored_hash is not None:
+            _stored_document_hashes[key] = stored_hash
+        return
+    
+    global _write_behind_thread
+    with _pending_writes_cond:
+        _pending_writes.pop((target_cache, writer, key), None)
+        _pending_writes[(target_cache, writer, key)] = record
+        _write_behind_stats['max_queue_depth'] = max(
+            _write_behind_stats['max_queue_depth'], len(_pending_writes))
+        
+        if _write_behind_thread is None:
+            _write_behind_thread = threading.Thread(
+                target=_write_behind_loop, name="cache-write-behind",
+                daemon=True)
+            _write_behind_thread.start()
+        if len(_pending_writes) >= WRITE_BEHIND_MAX_PENDING:
+            _pending_writes_cond.notify()
+
+
+def _store_batch():
+    """Batches direct writes. With write-behind enabled, batching is instead
+    done when the queue is flushed."""
+    if WRITE_BEHIND:
+        return contextlib.nullcontext()
+    return backing_cache.batch()
+
+
+def _write_behind_loop():
+    while True:
+        with _pending_writes_cond:
+            _pending_writes_cond.wait_for(lambda: len(_pending_writes))
+            # Give more writes a chance to accumulate so they can be batched
+            _pending_writes_cond.wait_for(
+                lambda: len(_pending_writes) >= WRITE_BEHIND_MAX_PENDING,
+                timeout=WRITE_BEHIND_INTERVAL)
+        try:
+            flush_writes()
+        except:
+            log_buddy.lb.e(
+                f"Error flushing cache writes\n{traceback.format_exc()}")
+
+
+def flush_writes():
+    """Sends all pending record writes to the backing cache
+    
+    Called periodically by the write-behind thread and at exit. Can also be
+    called directly when the writes must be known to be complete. If the
+    flush fails, its writes are queued again (unless newer writes for the
+    same keys have been queued since) and the exception is re-raised."""
+    with _backing_cache_lock:
+        with _pending_writes_cond:
+            writes = list(_pending_writes.items())
+            _pending_writes.clear()
+        if len(writes) == 0:
+            return
+        
+        # Each write goes to the backing cache that was active when it was
+        # queued, so each backing cache gets its own batch
+        writes_by_cache = {}
+        for write in writes:
+            target_cache = write[0][0]
+            writes_by_cache.setdefault(target_cache, []).append(write)
+        
+        t_start = time.time()
+        committed_caches = set()
+        for target_cache, cache_writes in writes_by_cache.items():
+            # Document hashes are only recorded once the batch is committed,
+            # so that a retried write isn't skipped as already stored
+            stored_hashes = {}
+            try:
+                with target_cache.batch():
+                    for (_, writer, key), record in cache_writes:
+                        stored_hash = writer(target_cache, record, key)
+                        if stored_hash is not None:
+                            stored_hashes[key] = stored_hash
+            except:
+                # Batches which were committed aren't retried
+                _requeue_writes([write for write in writes
+                                 if write[0][0] not in committed_caches])
+                raise
+            committed_caches.add(target_cache)
+            _stored_document_hashes.update(stored_hashes)
+            for write_key, _ in cache_writes:
+                _failed_write_attempts.pop(write_key, None)
+        t_elapsed = time.time() - t_start
+    
+    stats = _write_behind_stats
+    stats['n_flushes'] += 1
+    stats['n_records_flushed'] += len(writes)
+    stats['last_flush_time'] = t_elapsed
+    stats['max_flush_time'] = max(stats['max_flush_time'], t_elapsed)
+    stats['total_flush_time'] += t_elapsed
+
+
+def _requeue_writes(writes):
+    """Puts the writes of a failed flush back at the front of the queue
+    
+    A batch that fails may have been written in part or not at all, and
+    re-sending a record is harmless, so every write is retried."""
+    _write_behind_stats['n_failed_flushes'] += 1
+    with _pending_writes_cond:
+        for write_key, record in reversed(writes):
+            _failed_write_attempts[write_key] += 1
+            if _failed_write_attempts[write_key] >= WRITE_BEHIND_MAX_ATTEMPTS:
+                del _failed_write_attempts[write_key]
+                _write_behind_stats['n_writes_dropped'] += 1
+                log_buddy.lb.e(f"Dropping write of {write_key[2]} after"
+                               f" {WRITE_BEHIND_MAX_ATTEMPTS} failures")
+                continue
+            if write_key in _pending_writes:
+                # A newer version of this record has been queued
+                continue
+            _pending_writes[write_key] = record
+            _pending_writes.move_to_end(write_key, last=False)
+
+
+def pending_write_count():
+    with _pending_writes_cond:
+        return len(_pending_writes)
+
+
+def write_behind_stats():
+    """Returns the write queue depth and flush counts and latencies"""
+    stats = dict(_write_behind_stats)
+    stats['queue_depth'] = pending_write_count()
+    return stats
+
+
+atexit.register(flush_writes)
+
+
+def build_snapshot(author_hits=None):
+    """Serializes the most-used records and recently-used names
+    
+    `author_hits` maps author cache keys to request counts, and defaults to
+    this instance's counts. Returns the compressed snapshot as bytes."""
+    now = time.time()
+    authors = {}
+    for key, hits in _author_hits.most_common():
+        if len(authors) >= SNAPSHOT_N_AUTHORS:
+            break
+        record = _loaded_authors.get(key)
+        if record is not None and now - record.timestamp < MAXIMUM_AGE:
+            authors[key] = _serialize_author(record)
+    if author_hits is None:
+        author_hits = dict(_author_hits.most_common(SNAPSHOT_N_AUTHOR_HITS))
+    
+    documents = []
+    for bibcode, _ in _document_hits.most_common():
+        if len(documents) >= SNAPSHOT_N_DOCUMENTS:
+            break
+        record = _loaded_documents.get(bibcode)
+        if (record is not None
+                and now - record.timestamp < MAXIMUM_DOCUMENT_AGE):
+            documents.append(_serialize_document(record))
+    
+    snapshot = {
+        'version': SNAPSHOT_VERSION_NUMBER,
+        'timestamp': int(now),
+        'authors': authors,
+        'author_hits': author_hits,
+        'documents': documents,
+        'names': ads_name.recently_used_names(SNAPSHOT_N_NAMES),
+    }
+    return zlib.compress(
+        json.dumps(snapshot, check_circular=False,
+                   separators=(',', ':')).encode(),
+        level=6)
+
+
+def _merge_author_hits():
+    """Adds the requests counted since this instance's last snapshot to the
+    counts in the saved snapshot
+    
+    Each instance adds only its new requests, so the saved counts cover every
+    instance. An instance's requests can be lost if two instances save at
+    the same time. Returns the merged counts and this instance's counts."""
+    current_hits = _author_hits.copy()
+    merged_hits = Counter()
+    snapshot = _read_snapshot()
+    if snapshot is not None:
+        merged_hits.update(snapshot.get('author_hits', {}))
+    merged_hits.update(current_hits - _saved_author_hits)
+    return (dict(merged_hits.most_common(SNAPSHOT_N_AUTHOR_HITS)),
+            current_hits)
+
+
+def save_snapshot():
+    global _saved_author_hits
+    t_start = time.time()
+    author_hits, current_hits = _merge_author_hits()
+    data = build_snapshot(author_hits)
+    backing_cache.store_snapshot(data, SNAPSHOT_KEY)
+    _saved_author_hits = current_hits
+    log_buddy.lb.i(f"Saved {len(data) / 1e6:.1f} MB cache snapshot in"
+                   f" {time.time() - t_start:.2f} s")
+    histogram = expiry_histogram()
+    log_buddy.lb.i("Loaded authors expiring within "
+                   + ", ".join(f"{days}d: {n}"
+                               for days, n in histogram.items()))
+
+
+def _save_snapshot_in_background():
+    try:
+        save_snapshot()
+    except:
+        log_buddy.lb.e(
+            f"Error saving cache snapshot\n{traceback.format_exc()}")
+
+
+def save_snapshot_if_due():
+    """Starts saving a snapshot on a background thread if SNAPSHOT_INTERVAL
+    has passed since the last one
+    
+    Returns the thread if one was started, otherwise None."""
+    global _last_snapshot_time, _snapshot_thread
+    if (SNAPSHOT_INTERVAL is None
+            or time.time() - _last_snapshot_time < SNAPSHOT_INTERVAL):
+        return None
+    with _snapshot_lock:
+        if _snapshot_thread is not None and _snapshot_thread.is_alive():
+            return None
+        _last_snapshot_time = time.time()
+        _snapshot_thread = threading.Thread(
+            target=_save_snapshot_in_background, name="cache-snapshot",
+            daemon=True)
+        _snapshot_thread.start()
+    return _snapshot_thread
+
+
+def _read_snapshot():
+    try:
+        data = backing_cache.load_snapshot(SNAPSHOT_KEY)
+        snapshot = json.loads(zlib.decompress(data))
+    except CacheMiss:
+        return None
+    except (ValueError, zlib.error):
+        log_buddy.lb.e(
+            f"Error loading cache snapshot\n{traceback.format_exc()}")
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION_NUMBER:
+        return None
+    return snapshot
+
+
+def popular_authors():
+    """Returns the request counts of the most-requested authors, as merged
+    across instances in the last snapshot"""
+    snapshot = _read_snapshot()
+    if snapshot is None:
+        return {}
+    return snapshot.get('author_hits', {})
+
+
+def load_snapshot():
+    """Fills the in-memory caches from the last saved snapshot
+    
+    Records already in memory and records which have expired since the
+    snapshot was saved are skipped. Returns the numbers of author records,
+    document records and names loaded."""
+    t_start = time.time()
+    snapshot = _read_snapshot()
+    if snapshot is None:
+        return 0, 0, 0
+    
+    now = time.time()
+    n_authors = 0
+    for key, data in snapshot['authors'].items():
+        if key in _loaded_authors:
+            continue
+        if data.pop('version', -1) != AUTHOR_VERSION_NUMBER:
+            continue
+        record = AuthorRecord(**data)
+        if now - record.timestamp > MAXIMUM_AGE:
+            continue
+        record.decompress()
+        _loaded_authors[key] = record
+        n_authors += 1
+    
+    n_documents = 0
+    for data in snapshot['documents']:
+        if data['bibcode'] in _loaded_documents:
+            continue
+        if data.pop('version', -1) != DOCUMENT_VERSION_NUMBER:
+            continue
+        record = DocumentRecord(**data)
+        if now - record.timestamp > MAXIMUM_DOCUMENT_AGE:
+            continue
+        record.decompress()
+        _loaded_documents[record.bibcode] = record
+        n_documents += 1
+    
+    names = ADSName.parse_many(snapshot['names'])
+    
+    log_buddy.lb.i(f"Loaded cache snapshot with {n_authors} authors,"
+                   f" {n_documents} documents and {len(names)} names in"
+                   f" {time.time() - t_start:.2f} s")
+    return n_authors, n_documents, len(names)
+
+
 def cache_progress_data(progress_record: ProgressRecord, key: str):
     backing_cache.store_progress_data(progress_record.asdict(), key)
 
@@ -341,10 +1047,21 @@ def load_result(key):
 
 
 def clear_stale_data(**kwargs):
-    backing_cache.clear_stale_data(**kwargs)
+    flush_writes()
+    with _backing_cache_lock:
+        backing_cache.clear_stale_data(**kwargs)
     refresh()
 
 
 class CacheMiss(Exception):
     def __init__(self, key):
         log_buddy.lb.d("Cache miss for " + key)
+
+
+class StaleCacheData(CacheMiss):
+    """Raised when an author record is found but has expired
+    
+    The expired record is available as the `record` attribute."""
+    def __init__(self, key, record):
+        super().__init__("stale cache data: " + key)
+        self.record = record
@@ -11,7 +11,8 @@ DOC_CACHE_SUBDIR = os.path.join(local_config.cache_fs_dir, "documents")
 AUTHOR_CACHE_SUBDIR = os.path.join(local_config.cache_fs_dir, "authors")
 PROGRESS_CACHE_SUBDIR = os.path.join(local_config.cache_fs_dir, "progress")
 RESULT_CACHE_SUBDIR = os.path.join(local_config.cache_fs_dir, "results")
-_author_cache_contents = set()
+# Filled in on first use, which also creates the cache directories
+_author_cache_contents = None
 
 
 def refresh():
@@ -23,7 +24,10 @@ def refresh():
     _author_cache_contents = set(os.listdir(AUTHOR_CACHE_SUBDIR))
 
 
-refresh()
+def _get_author_cache_contents():
+    if _author_cache_contents is None:
+        refresh()
+    return _author_cache_contents
 
 
 def store_document(data: dict, key: str):
@@ -38,6 +42,18 @@ def store_document(data: dict, key: str):
     cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
 
 
+def touch_document(data: dict, key: str):
+    """Refreshes the stored document's timestamp, or stores the given
+    document if there's no stored copy"""
+    try:
+        stored_data = load_document(key)
+    except cache_buddy.CacheMiss:
+        store_document(data, key)
+        return
+    stored_data['timestamp'] = data['timestamp']
+    store_document(stored_data, key)
+
+
 def delete_document(key: str):
     fname = os.path.join(DOC_CACHE_SUBDIR, key)
     start = time.time()
@@ -69,7 +85,7 @@ def store_author(data: dict, key: str):
         refresh()
         open(fname, "w").write(data)
     cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
-    _author_cache_contents.add(key)
+    _get_author_cache_contents().add(key)
 
 
 def delete_author(key: str):
@@ -77,12 +93,11 @@ def delete_author(key: str):
     start = time.time()
     os.remove(fname)
     cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
-    if key in _author_cache_contents:
-        _author_cache_contents.remove(key)
+    _get_author_cache_contents().discard(key)
 
 
 def author_is_in_cache(key):
-    return key in _author_cache_contents
+    return key in _get_author_cache_contents()
 
 
 def authors_are_in_cache(keys):
@@ -94,7 +109,7 @@ def load_author(key: str):
     try:
         return json.load(open(fname))
     except FileNotFoundError:
-        if key in _author_cache_contents:
+        if key in _get_author_cache_contents():
             refresh()
         raise cache_buddy.CacheMiss(key)
     except json.decoder.JSONDecodeError:
@@ -153,22 +168,38 @@ def load_result(key):
         raise cache_buddy.CacheMiss(key)
 
 
+def store_snapshot(data: bytes, key):
+    os.makedirs(local_config.cache_fs_dir, exist_ok=True)
+    with open(os.path.join(local_config.cache_fs_dir, key), "wb") as f:
+        f.write(data)
+
+
+def load_snapshot(key):
+    try:
+        with open(os.path.join(local_config.cache_fs_dir, key), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        raise cache_buddy.CacheMiss(key)
+
+
 def clear_stale_data(authors=True, documents=True,
                      progress=True, results=True):
+    # Ensure the directories exist
+    _get_author_cache_contents()
     now = time.time()
     
     if authors:
         for key in os.listdir(AUTHOR_CACHE_SUBDIR):
             fname = os.path.join(AUTHOR_CACHE_SUBDIR, key)
             tstamp = os.path.getmtime(fname)
-            if now - tstamp > cache_buddy.MAXIMUM_AGE_AUTO:
+            if now - tstamp > cache_buddy.MAXIMUM_AUTHOR_AGE_AUTO:
                 os.remove(fname)
     
     if documents:
         for key in os.listdir(DOC_CACHE_SUBDIR):
             fname = os.path.join(DOC_CACHE_SUBDIR, key)
             tstamp = os.path.getmtime(fname)
-            if now - tstamp > cache_buddy.MAXIMUM_AGE_AUTO:
+            if now - tstamp > cache_buddy.MAXIMUM_DOCUMENT_AGE_AUTO:
                 os.remove(fname)
     
     if progress:
@@ -5,20 +5,19 @@ import zlib
 
 import requests
 from cache import cache_buddy
-from google.cloud import exceptions, firestore, storage
 
 import local_config
+import search_context
 
 DOC_CACHE_COLLECTION = "documents"
 AUTHOR_CACHE_COLLECTION = "authors"
 
 SHARDS = [chr(i) for i in range(65, 75)]
 
-storage_client = storage.Client()
-db = firestore.Client()
-_batch = None
-_batch_size = 0
-_batch_bytes = 0
+# The Google Cloud client libraries are slow to import and the clients are
+# slow to create, so both are put off until first use to speed up cold starts
+_storage_client = None
+_db = None
 
 # When we check if an author exists, that involves retrieving the entire
 # record. So here we'll store those record contents for any later reads.
@@ -31,6 +30,22 @@ MAX_OPS = 500
 MAX_API_CALL_SIZE = 7 * 1024 * 1024
 
 
+def _get_db():
+    global _db
+    if _db is None:
+        from google.cloud import firestore
+        _db = firestore.Client()
+    return _db
+
+
+def _get_storage_client():
+    global _storage_client
+    if _storage_client is None:
+        from google.cloud import storage
+        _storage_client = storage.Client()
+    return _storage_client
+
+
 def refresh():
     global _author_data_cache
     _author_data_cache = {}
@@ -63,18 +78,25 @@ def _decompress_record(record):
 
 
 def store_document(data: dict, key: str):
-    doc_ref = db.collection(DOC_CACHE_COLLECTION).document(key)
+    doc_ref = _get_db().collection(DOC_CACHE_COLLECTION).document(key)
     data['shard'] = random.choice(SHARDS)
     _set(doc_ref, data)
 
 
+def touch_document(data: dict, key: str):
+    # An update of only the timestamp would fail the whole batch if another
+    # instance has deleted the document, and Firestore charges the same for
+    # either kind of write, so the full document is stored
+    store_document(data, key)
+
+
 def delete_document(key: str):
-    doc_ref = db.collection(DOC_CACHE_COLLECTION).document(key)
+    doc_ref = _get_db().collection(DOC_CACHE_COLLECTION).document(key)
     _delete(doc_ref)
 
 
 def load_document(key: str):
-    doc_ref = db.collection(DOC_CACHE_COLLECTION).document(key)
+    doc_ref = _get_db().collection(DOC_CACHE_COLLECTION).document(key)
     data = doc_ref.get()
     if data.exists:
         data = data.to_dict()
@@ -87,6 +109,7 @@ def load_document(key: str):
 
 
 def load_documents(keys: []):
+    db = _get_db()
     docs = db.get_all(
         [db.collection(DOC_CACHE_COLLECTION).document(key) for key in keys]
     )
@@ -101,19 +124,19 @@ def load_documents(keys: []):
 
 
 def store_author(data: dict, key: str):
-    doc_ref = db.collection(AUTHOR_CACHE_COLLECTION).document(key)
+    doc_ref = _get_db().collection(AUTHOR_CACHE_COLLECTION).document(key)
     data = _compress_record(data)
     data['shard'] = random.choice(SHARDS)
     _set(doc_ref, data)
 
 
 def delete_author(key: str):
-    doc_ref = db.collection(AUTHOR_CACHE_COLLECTION).document(key)
+    doc_ref = _get_db().collection(AUTHOR_CACHE_COLLECTION).document(key)
     _delete(doc_ref)
 
 
 def author_is_in_cache(key):
-    data = db.collection(AUTHOR_CACHE_COLLECTION).document(key).get()
+    data = _get_db().collection(AUTHOR_CACHE_COLLECTION).document(key).get()
     if data.exists:
         _author_data_cache[data.id] = data
         return True
@@ -122,6 +145,7 @@ def author_is_in_cache(key):
 
 
 def authors_are_in_cache(keys):
+    db = _get_db()
     doc_refs = [db.collection(AUTHOR_CACHE_COLLECTION).document(key)
                 for key in keys]
     # get_all does not promise to return documents in the order they were given
@@ -144,7 +168,7 @@ def load_author(key: str):
         return _decompress_record(data.to_dict())
     except KeyError:
         pass
-    doc_ref = db.collection(AUTHOR_CACHE_COLLECTION).document(key)
+    doc_ref = _get_db().collection(AUTHOR_CACHE_COLLECTION).document(key)
     data = doc_ref.get()
     if data.exists:
         return _decompress_record(data.to_dict())
@@ -164,6 +188,7 @@ def load_authors(keys: [str]):
             not_in_local_cache.append(key)
     
     if len(not_in_local_cache):
+        db = _get_db()
         doc_refs = [db.collection(AUTHOR_CACHE_COLLECTION).document(key)
                     for key in keys]
         data = db.get_all(doc_refs)
@@ -205,23 +230,43 @@ def load_progress_data(key: str):
 
 
 def store_result(data, key):
-    bucket = storage_client.bucket(local_config.CLOUD_STORAGE_BUCKET_NAME)
+    bucket = _get_storage_client().bucket(
+        local_config.CLOUD_STORAGE_BUCKET_NAME)
     blob = bucket.blob(key)
     blob.upload_from_string(data)
 
 
 def result_is_in_cache(key):
-    bucket = storage_client.bucket(local_config.CLOUD_STORAGE_BUCKET_NAME)
-    return storage.Blob(bucket=bucket, name=key).exists(storage_client)
+    bucket = _get_storage_client().bucket(
+        local_config.CLOUD_STORAGE_BUCKET_NAME)
+    return bucket.blob(key).exists()
 
 
 def load_result(key):
-    bucket = storage_client.bucket(local_config.CLOUD_STORAGE_BUCKET_NAME)
+    from google.cloud import exceptions
+    bucket = _get_storage_client().bucket(
+        local_config.CLOUD_STORAGE_BUCKET_NAME)
     blob = bucket.blob(key)
     try:
         return blob.download_as_string().decode()
     except exceptions.NotFound:
-        return cache_buddy.CacheMiss(key)
+        raise cache_buddy.CacheMiss(key)
+
+
+def store_snapshot(data: bytes, key):
+    bucket = _get_storage_client().bucket(
+        local_config.CLOUD_STORAGE_BUCKET_NAME)
+    bucket.blob(key).upload_from_string(data)
+
+
+def load_snapshot(key):
+    from google.cloud import exceptions
+    bucket = _get_storage_client().bucket(
+        local_config.CLOUD_STORAGE_BUCKET_NAME)
+    try:
+        return bucket.blob(key).download_as_bytes()
+    except exceptions.NotFound:
+        raise cache_buddy.CacheMiss(key)
 
 
 def clear_stale_data(authors=True, documents=True,
@@ -235,17 +280,19 @@ def clear_stale_data(authors=True, documents=True,
 
 def _do_clear_data(mode):
     if mode == 'author':
-        collection = db.collection(AUTHOR_CACHE_COLLECTION)
+        collection = _get_db().collection(AUTHOR_CACHE_COLLECTION)
         version = cache_buddy.AUTHOR_VERSION_NUMBER
+        max_age = cache_buddy.MAXIMUM_AUTHOR_AGE_AUTO
         msg = "Cleared {} authors"
     elif mode == 'document':
-        collection = db.collection(DOC_CACHE_COLLECTION)
+        collection = _get_db().collection(DOC_CACHE_COLLECTION)
         version = cache_buddy.DOCUMENT_VERSION_NUMBER
+        max_age = cache_buddy.MAXIMUM_DOCUMENT_AGE_AUTO
         msg = "Cleared {} documents"
     else:
         return
     
-    author_thresh = time.time() - cache_buddy.MAXIMUM_AGE_AUTO
+    author_thresh = time.time() - max_age
     i = 0
     with batch():
         for shard_val in SHARDS:
@@ -264,74 +311,88 @@ def _do_clear_data(mode):
     cache_buddy.log_buddy.lb.i(msg.format(i))
 
 
+class _Batch:
+    """The current search's pending Firestore writes"""
+    
+    def __init__(self):
+        self.batch = None
+        self.size = 0
+        self.bytes = 0
+    
+    def add(self, n_bytes):
+        self.size += 1
+        self.bytes += n_bytes
+        if self.size >= MAX_OPS or self.bytes > MAX_API_CALL_SIZE:
+            start = time.time()
+            self.batch.commit()
+            cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
+            
+            self.batch = _get_db().batch()
+            self.size = 0
+            self.bytes = 0
+
+
+def _current_batch() -> _Batch:
+    return search_context.current().get('gcp_batch', _Batch)
+
+
 def _set(doc_ref, data):
-    global _batch, _batch_size, _batch_bytes
-    if _batch is None:
+    batch = _current_batch()
+    if batch.batch is None:
         start = time.time()
         doc_ref.set(data)
         cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
     else:
-        _batch.set(doc_ref, data)
-        _batch_size += 1
+        batch.batch.set(doc_ref, data)
         if 'zlib_data' in data:
             # We neglect the 'timestamp' field in the size calculation, but
             # the maximum size is set conservatively
-            _batch_bytes += len(data['zlib_data'])
+            n_bytes = len(data['zlib_data'])
         else:
-            _batch_bytes += len(
+            n_bytes = len(
                 json.dumps(data, check_circular=False).encode('utf-8'))
-        if _batch_size >= MAX_OPS or _batch_bytes > MAX_API_CALL_SIZE:
-            start = time.time()
-            _batch.commit()
-            cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
-            
-            _batch = db.batch()
-            _batch_size = 0
-            _batch_bytes = 0
+        batch.add(n_bytes)
 
 
 def _delete(doc_ref):
-    global _batch, _batch_size, _batch_bytes
-    if _batch is None:
+    batch = _current_batch()
+    if batch.batch is None:
         start = time.time()
         doc_ref.delete()
         cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
     else:
-        _batch.delete(doc_ref)
-        _batch_size += 1
-        _batch_bytes += 400  # NO idea what to put here
-        if _batch_size >= MAX_OPS or _batch_bytes > MAX_API_CALL_SIZE:
-            start = time.time()
-            _batch.commit()
-            cache_buddy.log_buddy.lb.on_cache_store_timed(time.time() - start)
-            
-            _batch = db.batch()
-            _batch_size = 0
-            _batch_bytes = 0
+        batch.batch.delete(doc_ref)
+        batch.add(400)  # NO idea what to put here
 
 
 class BatchManager:
     def __enter__(self):
-        global _batch, _batch_size, _batch_bytes
-        self.is_managing = _batch is None
+        self.batch = _current_batch()
+        self.is_managing = self.batch.batch is None
         if self.is_managing:
-            _batch = db.batch()
-            _batch_size = 0
-            _batch_bytes = 0
+            self.batch.batch = _get_db().batch()
+            self.batch.size = 0
+            self.batch.bytes = 0
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        global _batch, _batch_size, _batch_bytes
-        if exc_type is not None:
+        if not self.is_managing:
             return False
-        if self.is_managing:
-            if _batch is not None and _batch_size > 0:
+        try:
+            # If the block failed, its batch is abandoned
+            if (exc_type is None
+                    and self.batch.batch is not None
+                    and self.batch.size > 0):
                 start = time.time()
-                _batch.commit()
+                self.batch.batch.commit()
                 cache_buddy.log_buddy.lb.on_cache_store_timed(
                     time.time() - start)
-            _batch = None
-            _batch_size = 0
-            _batch_bytes = 0
+        finally:
+            # Even if the commit fails, so that later writes from this
+            # thread start a new batch
+            self.batch.batch = None
+            self.batch.size = 0
+            self.batch.bytes = 0
+        return False
 
 
 def batch():
@@ -0,0 +1,61 @@
+"""
+Cancellation of searches which are no longer wanted or are taking too long
+
+A CancellationToken is passed to PathFinder.find_path, which puts it in the
+search context. It's checked between author expansions and before each ADS
+query, so a cancelled search stops before spending more ADS quota. Once a
+path has been found, the token's deadline no longer applies, so a found
+result isn't discarded while it's being ranked.
+"""
+import threading
+import time
+
+import search_context
+
+
+class CancellationToken:
+    def __init__(self, timeout=None):
+        """If `timeout` is given, the token expires after that many
+        seconds"""
+        self.deadline = None if timeout is None else time.time() + timeout
+        self._cancelled = threading.Event()
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def is_cancelled(self):
+        return self._cancelled.is_set() or self.is_past_deadline()
+    
+    def is_past_deadline(self):
+        return self.deadline is not None and time.time() > self.deadline
+    
+    def without_deadline(self):
+        """Returns a token which is cancelled along with this one, but
+        never expires"""
+        token = CancellationToken()
+        token._cancelled = self._cancelled
+        return token
+    
+    def check(self):
+        """Raises SearchCancelled if the search should stop"""
+        if self._cancelled.is_set():
+            raise SearchCancelled("search_cancelled",
+                                  "The search was cancelled.")
+        if self.is_past_deadline():
+            raise SearchCancelled("search_timeout",
+                                  "The search ran out of time.")
+
+
+def current() -> CancellationToken:
+    """Returns the current search's token, which by default never expires"""
+    return search_context.current().get('cancellation', CancellationToken)
+
+
+def check():
+    current().check()
+
+
+class SearchCancelled(RuntimeError):
+    def __init__(self, key, message):
+        super().__init__(message)
+        self.key = key
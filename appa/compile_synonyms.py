@@ -0,0 +1,8 @@
+"""
+Compiles the name synonym lists into the index loaded by names.ads_name
+"""
+import local_config
+from names import ads_name
+
+if __name__ == "__main__":
+    ads_name.write_synonym_index(local_config.name_synonym_index)
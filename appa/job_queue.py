@@ -0,0 +1,105 @@
+"""
+An in-process queue of long-running jobs, run by a pool of worker threads
+
+Jobs are keyed (searches by their result cache key), and submitting a job
+whose key is already queued or running returns the existing job rather than
+running it twice. Finished jobs are kept for RETENTION_TIME so that clients
+can poll for their results.
+"""
+import queue
+import threading
+import time
+import traceback
+
+from log_buddy import lb
+
+# The number of jobs run at once
+N_WORKERS = 4
+# Finished jobs are forgotten after this many seconds
+RETENTION_TIME = 10 * 60
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    def __init__(self, key, fn, args):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.status = QUEUED
+        self.result = None
+        self.submit_time = time.time()
+        self.finish_time = None
+        self.done = threading.Event()
+    
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+
+class JobQueue:
+    def __init__(self, n_workers=N_WORKERS, retention_time=RETENTION_TIME):
+        self.n_workers = n_workers
+        self.retention_time = retention_time
+        self._jobs = {}
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self.n_submitted = 0
+        self.n_deduplicated = 0
+    
+    def submit(self, key, fn, *args) -> Job:
+        """Queues fn(*args) to be run, unless a job with this key is already
+        queued or running, and returns the job"""
+        with self._lock:
+            self._forget_old_jobs()
+            job = self._jobs.get(key)
+            if job is not None and not job.is_finished():
+                self.n_deduplicated += 1
+                return job
+            job = Job(key, fn, args)
+            self._jobs[key] = job
+            self.n_submitted += 1
+            if len(self._workers) < self.n_workers:
+                worker = threading.Thread(
+                    target=self._work, name="appa-job-worker", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        self._queue.put(job)
+        return job
+    
+    def get(self, key):
+        """Returns the job with this key, or None if there is none"""
+        with self._lock:
+            return self._jobs.get(key)
+    
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            return {'n_submitted': self.n_submitted,
+                    'n_deduplicated': self.n_deduplicated,
+                    'n_queued': statuses.count(QUEUED),
+                    'n_running': statuses.count(RUNNING)}
+    
+    def _forget_old_jobs(self):
+        threshold = time.time() - self.retention_time
+        old = [key for key, job in self._jobs.items()
+               if job.is_finished() and job.finish_time < threshold]
+        for key in old:
+            del self._jobs[key]
+    
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = RUNNING
+            try:
+                job.result = job.fn(*job.args)
+                status = DONE
+            except:
+                lb.e(f"Job {job.key} failed\n{traceback.format_exc()}")
+                status = FAILED
+            job.finish_time = time.time()
+            job.status = status
+            job.done.set()
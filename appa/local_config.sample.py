@@ -1,10 +1,43 @@
 import os
+import tempfile
 # The module whose name is in this string will be imported and used
 # as the cache back-end
 backing_cache = "cache_fs"
 # When using the cache_fs backend, this path will be used for the cache
 cache_fs_dir = "../cache"
 
+# Author and document records are written to the backing cache in batches
+# by a background thread, so that searches don't wait on those writes. Set
+# this to False to write records synchronously instead.
+cache_write_behind = True
+
+# Every this many seconds, the most-used cached records are saved as a single
+# snapshot, which new instances load at startup. Set to None to disable.
+cache_snapshot_interval = 15 * 60
+
+# Author records close to expiring are sometimes refreshed from ADS on a
+# background thread while the cached copy is still served, so that popular
+# records don't all expire at once. Set to False to disable.
+cache_early_refresh = True
+
+# For this many seconds after an author record expires, the expired record is
+# still used for searches while it's refreshed in the background, rather than
+# making the search wait on ADS. Set to 0 to disable.
+cache_stale_grace_period = 3 * 24 * 60 * 60
+
+# Searches running longer than this many seconds are stopped, to limit the ADS
+# queries spent on any one search. Set to None for no limit.
+search_time_budget = None
+
+# If set, the metrics of each search are appended to this file as a line of
+# JSON
+metrics_jsonl_path = None
+
+# This fraction of searches is run under a sampling profiler, and the profile
+# is stored next to the result. A single search can also be profiled by adding
+# `profile` to its request.
+profile_sample_rate = 0
+
 # For running in GCP:
 # backing_cache = "cache_gcp"
 # relay_token = "token_here"
@@ -29,6 +62,13 @@ if os.path.exists(name_synonym_dir):
 else:
     name_synonym_lists = []
 
+# The synonym lists are compiled into an index, which is loaded on first use.
+# If the index is missing or older than the lists, it is rebuilt and written
+# here (which can also be done ahead of time by running compile_synonyms.py).
+# Set to None to always compile the lists in memory.
+name_synonym_index = os.path.join(tempfile.gettempdir(), "appa",
+                                  "name_synonyms.index.json")
+
 # Bucket name used for storing cached outputs when running in GCP
 # CLOUD_STORAGE_BUCKET_NAME = ""
 
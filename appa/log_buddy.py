@@ -1,28 +1,44 @@
+import dataclasses
 import logging
+import queue
+import threading
 import time
+import traceback
+import weakref
 from statistics import median
 
 from cache import cache_buddy
 
+from names import ads_name
 from local_config import logging_handler, log_error_extra, log_exception_extra
 from records.progress_record import ProgressRecord
+import search_context
+import single_flight
+
+_logger = logging.getLogger("LogBuddy")
+_logger.addHandler(logging_handler)
+
+# Progress data is published at most this often, in seconds
+PROGRESS_INTERVAL = .25
 
 
 # noinspection PyUnresolvedReferences
 class LogBuddy:
+    """Logging, plus the stats and progress reporting of one search
+    
+    Use the module-level `lb`, which forwards to the LogBuddy of the current
+    search context."""
     from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
     
     progress_key: str
-    last_cache_update: float
     
     def __init__(self):
         self.reset_stats()
-        self.logger = logging.getLogger("LogBuddy")
-        self.logger.addHandler(logging_handler)
+        self.logger = _logger
     
     def set_progress_key(self, key):
         self.progress_key = key
-        self.update_progress_cache(force=True)
+        _progress_publisher.watch(self)
     
     def reset_stats(self):
         self.n_docs_loaded = 0
@@ -32,6 +48,7 @@ class LogBuddy:
         self.n_docs_queried = 0
         self.n_network_queries = 0
         self.n_authors_from_ADS = 0
+        self.n_stale_authors_served = 0
         
         self.n_coauthors_seen = 0
         
@@ -41,6 +58,11 @@ class LogBuddy:
         self.time_waiting_network = []
         self.time_waiting_cached_author = 0
         self.time_waiting_cached_doc = 0
+        # Each load of author or document records from the backing cache
+        self.cache_load_times = []
+        # The number of authors expanded at each step of the search
+        self.frontier_sizes = []
+        self.time_ranking = -1
         self.time_storing_to_cache = 0
         self.time_preparing_response = -1
         self.start_time = None
@@ -48,7 +70,6 @@ class LogBuddy:
         self.path_finding_complete = False
         
         self.progress_key = None
-        self.last_cache_update = 0
     
     def d(self, msg, **kwargs):
         self.logger.debug(msg, **kwargs)
@@ -77,28 +98,26 @@ class LogBuddy:
     
     def on_doc_queried(self, n=1):
         self.n_docs_queried += n
-        self.update_progress_cache()
     
     def on_doc_loaded(self, n=1):
         self.n_docs_loaded += n
-        self.update_progress_cache()
     
     def set_n_docs_relevant(self, n):
         self.n_docs_relevant = n
-        self.update_progress_cache()
     
     def on_doc_load_timed(self, time):
         self.time_waiting_cached_doc += time
+        self.cache_load_times.append(time)
     
     def on_author_load_timed(self, time):
         self.time_waiting_cached_author += time
+        self.cache_load_times.append(time)
     
     def on_cache_store_timed(self, time):
         self.time_storing_to_cache += time
     
     def on_author_queried(self, n=1):
         self.n_authors_queried += n
-        self.update_progress_cache()
     
     def on_coauthor_seen(self, n=1):
         self.n_coauthors_seen += n
@@ -106,19 +125,26 @@ class LogBuddy:
     def on_network_complete(self, time):
         self.n_network_queries += 1
         self.time_waiting_network.append(time)
-        self.update_progress_cache()
     
     def on_author_queried_from_ADS(self, n=1):
         self.n_authors_from_ADS += n
     
+    def on_stale_author_served(self, n=1):
+        self.n_stale_authors_served += n
+    
     def on_start_path_finding(self):
         self.start_time = time.time()
-        self.update_progress_cache()
     
     def on_stop_path_finding(self):
         self.stop_time = time.time()
         self.path_finding_complete = True
-        self.update_progress_cache(force=True)
+        self.publish_progress()
+    
+    def on_frontier_expanded(self, n_authors):
+        self.frontier_sizes.append(n_authors)
+    
+    def on_ranking_timed(self, time):
+        self.time_ranking = time
     
     def on_result_prepared(self, time):
         self.time_preparing_response = time
@@ -157,6 +183,24 @@ class LogBuddy:
                f" {self.time_waiting_cached_doc:.2f} s loading docs,"
                f" and {self.time_storing_to_cache:.2f} s storing data"
                " to/from backing cache")
+        # Writes are flushed in the background, for all searches together
+        write_stats = cache_buddy.write_behind_stats()
+        self.i(f"{write_stats['queue_depth']} writes pending to the backing"
+               f" cache, {write_stats['n_records_flushed']} flushed since"
+               f" startup")
+        name_stats = ads_name.name_cache_stats()
+        self.i(f"{name_stats['n_names']}"
+               f"+{name_stats['n_names_previous_generation']} names interned,"
+               f" {name_stats['n_equality_entries']} equality results cached"
+               f" (~{name_stats['equality_bytes'] / 1e6:.1f} MB)")
+        coalesced = ", ".join(
+            f"{name} {stats['n_coalesced']}/{stats['n_calls']}"
+            for name, stats in single_flight.coalescing_stats().items())
+        self.i(f"Coalesced fetches: {coalesced}")
+        refresh_stats = cache_buddy.early_refresh_stats()
+        self.i(f"{self.n_stale_authors_served} expired author records served;"
+               f" {refresh_stats['n_scheduled']} early author refreshes"
+               f" scheduled, {refresh_stats['n_in_progress']} in progress")
         self.i(f"Search took {self.get_search_time():.2f} s")
         self.i(f"Response prepared in {self.time_preparing_response:.2f} s")
         
@@ -168,22 +212,115 @@ class LogBuddy:
                         - self.time_storing_to_cache)
             self.i(f"Total compute time: {own_time:.2f} s")
     
-    def update_progress_cache(self, force=False):
-        now = time.time()
-        if (self.progress_key is not None
-                and (now - self.last_cache_update > .25
-                     or force)):
-            self.last_cache_update = now
-            cache_buddy.cache_progress_data(
-                ProgressRecord(n_ads_queries=self.n_authors_from_ADS,
-                               n_authors_queried=self.n_authors_queried,
-                               n_docs_queried=self.n_docs_queried,
-                               n_docs_relevant=self.n_docs_relevant,
-                               n_docs_loaded=self.n_docs_loaded,
-                               path_finding_complete=self.path_finding_complete),
-                self.progress_key
-            )
+    def progress_record(self) -> ProgressRecord:
+        return ProgressRecord(n_ads_queries=self.n_authors_from_ADS,
+                              n_authors_queried=self.n_authors_queried,
+                              n_docs_queried=self.n_docs_queried,
+                              n_docs_relevant=self.n_docs_relevant,
+                              n_docs_loaded=self.n_docs_loaded,
+                              path_finding_complete=self.path_finding_complete)
+    
+    def publish_progress(self):
+        """Publishes the current progress without waiting for the next
+        interval, e.g. at milestones the client shouldn't miss"""
+        if self.progress_key is not None:
+            _progress_publisher.publish(self.progress_key,
+                                        self.progress_record())
+
+
+class ProgressPublisher:
+    """Publishes the progress of running searches from a background thread
+    
+    Counting progress is then just incrementing counters, with no I/O. Every
+    PROGRESS_INTERVAL, each watched LogBuddy with a progress key is sampled,
+    and its progress is stored if it has changed. A LogBuddy stops being
+    watched when its progress key is cleared or it's garbage collected."""
+    
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self._watched = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._explicit = queue.SimpleQueue()
+        self._last_published = {}
+        self._thread = None
+    
+    def watch(self, log_buddy: LogBuddy):
+        with self._lock:
+            self._watched.add(log_buddy)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="progress-publisher", daemon=True)
+                self._thread.start()
+        log_buddy.publish_progress()
+    
+    def publish(self, key, record: ProgressRecord):
+        """Queues a progress record to be stored right away"""
+        self._explicit.put((key, record))
+    
+    def _run(self):
+        next_sample = time.monotonic() + self.interval
+        while True:
+            # Explicit publishes are stored as they arrive, but don't delay
+            # the next sample
+            timeout = next_sample - time.monotonic()
+            if timeout > 0:
+                try:
+                    key, record = self._explicit.get(timeout=timeout)
+                except queue.Empty:
+                    pass
+                else:
+                    self._store(key, record)
+                    continue
+            self._sample()
+            next_sample = time.monotonic() + self.interval
+    
+    def _sample(self):
+        with self._lock:
+            watched = list(self._watched)
+        for log_buddy in watched:
+            key = log_buddy.progress_key
+            if key is None:
+                with self._lock:
+                    self._watched.discard(log_buddy)
+                continue
+            self._store(key, log_buddy.progress_record())
+        with self._lock:
+            keys = {log_buddy.progress_key for log_buddy in self._watched}
+        for key in list(self._last_published):
+            if key not in keys:
+                del self._last_published[key]
+    
+    def _store(self, key, record: ProgressRecord):
+        values = dataclasses.replace(record, timestamp=0)
+        if self._last_published.get(key) == values:
+            return
+        self._last_published[key] = values
+        try:
+            cache_buddy.cache_progress_data(record, key)
+        except:
+            _logger.error(f"Error publishing progress for {key}\n"
+                          f"{traceback.format_exc()}")
+
+
+_progress_publisher = ProgressPublisher()
+
+
+class _CurrentLogBuddy:
+    """Forwards everything to the current search context's LogBuddy"""
+    
+    def __getattr__(self, name):
+        return getattr(_current_log_buddy(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(_current_log_buddy(), name, value)
+    
+    def __delattr__(self, name):
+        delattr(_current_log_buddy(), name)
+
+
+def _current_log_buddy() -> LogBuddy:
+    return search_context.current().get('log_buddy', LogBuddy)
 
 
 logging.captureWarnings(True)
-lb = LogBuddy()
+lb = _CurrentLogBuddy()
@@ -7,6 +7,7 @@ import json
 from cache import cache_buddy
 
 import backend_common
+import prewarm_cache as prewarmer
 from log_buddy import lb
 
 # Cloud Function responses cannot be larger than 10 MiB. If our response
@@ -18,12 +19,16 @@ CLOUD_STORAGE_URL_FORMAT = "https://storage.googleapis.com/storage/v1/b/{}/o/{}?
 
 lb.set_log_level(lb.INFO)
 lb.i("Instance cold start")
+cache_buddy.load_snapshot()
 
 
 def find_route(request):
     try:
         data, code, headers, cache_key = backend_common.find_route(
             request, load_cached_result=False)
+        # Cloud Functions may throttle or freeze the instance once we
+        # respond, so don't leave writes sitting in the write-behind queue
+        cache_buddy.flush_writes()
         
         if data is None:
             # The result is already cached---refer the user to the cache file
@@ -45,6 +50,11 @@ def clean_cache(request):
     cache_buddy.clear_stale_data()
 
 
+# Meant to be triggered on a schedule, e.g. daily
+def prewarm_cache(request):
+    prewarmer.prewarm()
+
+
 # When we clear stale data in the cache, it's always possible that a
 # path-finding that's in-progress could have already read stale author records
 # and has not yet but will read corresponding stale document records. If we
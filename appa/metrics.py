@@ -0,0 +1,182 @@
+"""
+Structured metrics for each search, passed to pluggable exporters
+
+At the end of each search, backend_common calls export_search(), which
+collects the search's metrics from its LogBuddy into a SearchMetrics and
+hands it to every registered exporter. Two exporters are provided:
+
+- PrometheusExporter accumulates counters and histograms across searches
+  and renders them in the Prometheus text format (served at /metrics by the
+  Flask and ASGI backends)
+- JSONLinesExporter appends each search's metrics as one line of JSON to a
+  file, set with `metrics_jsonl_path` in local_config.py
+
+Other exporters need only an `export(search_metrics)` method.
+"""
+import bisect
+import json
+import threading
+import time
+import traceback
+from typing import Dict, List
+
+import local_config
+from log_buddy import lb, LogBuddy
+
+# Upper bounds of the histogram buckets for each kind of observation
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+HISTOGRAM_BUCKETS = {
+    'network_latency_seconds': SECONDS_BUCKETS,
+    'cache_load_seconds': SECONDS_BUCKETS,
+    'search_seconds': SECONDS_BUCKETS,
+    'ranking_seconds': SECONDS_BUCKETS,
+    'response_seconds': SECONDS_BUCKETS,
+    'frontier_size': COUNT_BUCKETS,
+}
+
+_exporters = []
+
+
+class SearchMetrics:
+    """The metrics of one search
+    
+    `counters` are totals for the search, and `observations` are lists of
+    values to be put in histograms."""
+    
+    def __init__(self, counters: Dict[str, float],
+                 observations: Dict[str, List[float]]):
+        self.timestamp = time.time()
+        self.counters = counters
+        self.observations = observations
+    
+    @classmethod
+    def from_log_buddy(cls, log_buddy: LogBuddy):
+        counters = {
+            'searches': 1,
+            'ads_queries': log_buddy.n_network_queries,
+            'authors_from_ads': log_buddy.n_authors_from_ADS,
+            'authors_queried': log_buddy.n_authors_queried,
+            'docs_queried': log_buddy.n_docs_queried,
+            'docs_returned': max(log_buddy.n_docs_relevant, 0),
+            'coauthors_seen': log_buddy.n_coauthors_seen,
+            'connections_found': max(log_buddy.n_connections, 0),
+            'stale_authors_served': log_buddy.n_stale_authors_served,
+        }
+        observations = {
+            'network_latency_seconds': list(log_buddy.time_waiting_network),
+            'cache_load_seconds': list(log_buddy.cache_load_times),
+            'frontier_size': list(log_buddy.frontier_sizes),
+        }
+        # Stages the search didn't reach are left out
+        for name, value in (
+                ('search_seconds', log_buddy.get_search_time()),
+                ('ranking_seconds', log_buddy.time_ranking),
+                ('response_seconds', log_buddy.time_preparing_response)):
+            observations[name] = [value] if value >= 0 else []
+        return cls(counters, observations)
+    
+    def asdict(self):
+        return {'timestamp': self.timestamp,
+                'counters': self.counters,
+                'observations': self.observations}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Estimates a quantile as the upper bound of the bucket holding it"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+class PrometheusExporter:
+    def __init__(self, prefix="appa_"):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {name: Histogram(buckets)
+                           for name, buckets in HISTOGRAM_BUCKETS.items()}
+        self._lock = threading.Lock()
+    
+    def export(self, search_metrics: SearchMetrics):
+        with self._lock:
+            for name, value in search_metrics.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, values in search_metrics.observations.items():
+                histogram = self.histograms[name]
+                for value in values:
+                    histogram.observe(value)
+    
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                name = f"{self.prefix}{name}_total"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                name = self.prefix + name
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum {histogram.sum}")
+                lines.append(f"{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class JSONLinesExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+    
+    def export(self, search_metrics: SearchMetrics):
+        line = json.dumps(search_metrics.asdict())
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + "\n")
+
+
+def add_exporter(exporter):
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    _exporters.remove(exporter)
+
+
+def export_search(log_buddy=lb):
+    """Passes the metrics of the current search to each exporter"""
+    if not len(_exporters):
+        return
+    search_metrics = SearchMetrics.from_log_buddy(log_buddy)
+    for exporter in _exporters:
+        try:
+            exporter.export(search_metrics)
+        except:
+            lb.e(f"Error exporting metrics with {type(exporter).__name__}"
+                 f"\n{traceback.format_exc()}")
+
+
+_jsonl_path = getattr(local_config, 'metrics_jsonl_path', None)
+if _jsonl_path is not None:
+    add_exporter(JSONLinesExporter(_jsonl_path))
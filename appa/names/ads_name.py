@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 import itertools
+import json
+import os
 import re
 import string
+import sys
+import threading
 from typing import Tuple
 
 from unidecode import unidecode_expect_ascii as unidecode
@@ -10,23 +14,66 @@ from unidecode import unidecode_expect_ascii as unidecode
 import local_config
 from . import name_aware
 
+# The intern table, mapping input strings to ADSName instances. Names that
+# haven't been parsed since the last generation change are held in
+# _previous_name_cache, and are moved back into _name_cache when they're next
+# parsed. When the table grows too large, new_generation() drops the previous
+# generation.
 _name_cache = {}
-# Translation table to remove all characters that aren't lower-case ascii
-# letters or a space. (A space is allowable inside a last name, and will be
-# removed as part of a given name during splitting.)
+_previous_name_cache = {}
+_generation = 0
+MAXIMUM_INTERNED_NAMES = 200_000
+
+# Results of equality checks, keyed by the pair of names' integer IDs packed
+# into a single int (smaller ID in the high bits). Cleared when it fills up.
+_equality_cache = {}
+MAXIMUM_EQUALITY_CACHE_ENTRIES = 1_000_000
+_next_id = itertools.count()
+# Bytes to remove to leave only lower-case ascii letters and spaces. (A space
+# is allowable inside a last name, and will be removed as part of a given name
+# during splitting.) Names are converted to ASCII before this is applied, and
+# bytes.translate is much faster than str.translate.
 ok_chars = string.ascii_lowercase + ' '
-_char_filter = str.maketrans('', '', ''.join(c for c in map(chr, range(256))
-                                             if c not in ok_chars))
-# Translation table to replace with spaces characters that should be allowed
-# to split names into pieces. The period is included here so we can gracefully
-# handle a type like "Last, F.M."
-_char_prefilter = str.maketrans("-.", "  ")
+_chars_to_delete = bytes(c for c in range(128) if chr(c) not in ok_chars)
+# Name modifiers and the flags they set, in the order (require_more_specific,
+# allow_same_specific, require_less_specific, require_exact, allow_synonym).
+# Two-character modifiers are checked first.
+_modifier_flags = {
+    ">=": (True, True, False, False, True),
+    "=>": (True, True, False, False, True),
+    "<=": (False, True, True, False, True),
+    "=<": (False, True, True, False, True),
+    ">": (True, False, False, False, True),
+    "<": (False, False, True, False, True),
+    "=": (False, False, False, True, True),
+    "@": (False, True, False, False, False),
+}
+_no_modifier_flags = (False, True, False, False, True)
 
 # Collapses multiple, sequential spaces into one. Used on the last name for
 # internal spaces, not needed for given names which are split at white space.
 _multiple_spaces_pattern = re.compile(" +")
 
-_name_synonyms = name_aware.NameAwareDict()
+# The compiled synonym lists, mapping a variant's last name to a list of
+# (variant, canonical name) pairs. Loaded on first use.
+_synonym_entries = None
+# Synonyms parsed from _synonym_entries, mapping a last name to a
+# NameAwareDict of variant -> canonical name. Filled in as last names are seen.
+_name_synonyms = {}
+# Both of the above are built in full before being published, and only
+# replaced while holding this lock. Lookups read them without locking.
+_synonym_lock = threading.RLock()
+# The NameAwareDicts being built by _resolve_synonyms, which is reentered
+# (on the same thread, holding _synonym_lock) when a canonical name shares
+# the last name being resolved
+_resolving_synonyms = {}
+SYNONYM_INDEX_VERSION = 1
+
+
+def _filter_chars(text):
+    """Removes everything but lower-case letters and spaces from ASCII text"""
+    return text.encode('ascii', 'ignore').translate(
+        None, _chars_to_delete).decode('ascii')
 
 
 class ADSName:
@@ -62,8 +109,8 @@ class ADSName:
     __slots__ = ['_last_name', '_given_names', '_require_exact',
                  '_require_less_specific', '_require_more_specific',
                  '_allow_same_specific', '_original_name',
-                 '_qualified_full_name', '_equality_cache', '_synonym',
-                 '_allow_synonym']
+                 '_qualified_full_name', '_id', '_hash', '_match_key',
+                 '_synonym', '_allow_synonym']
     _last_name: str
     _given_names: Tuple[str]
     
@@ -77,7 +124,9 @@ class ADSName:
     _qualified_full_name: str
     _synonym: ADSName
     
-    _equality_cache: {}
+    _id: int
+    _hash: int
+    _match_key: Tuple[str, str]
     
     @classmethod
     def parse(cls, last_name, *given_names, preserve=False):
@@ -104,14 +153,41 @@ class ADSName:
         if type(last_name) == ADSName:
             return last_name
         
-        key = (last_name, *given_names)
+        # Most names arrive as a single string, so avoid building a tuple
+        # in that case
+        key = (last_name, *given_names) if len(given_names) else last_name
         try:
             return _name_cache[key]
         except KeyError:
-            instance = ADSName(last_name, *given_names)
+            instance = _previous_name_cache.pop(key, None)
+            if instance is None:
+                instance = ADSName(last_name, *given_names)
             _name_cache[key] = instance
             return instance
     
+    @classmethod
+    def parse_many(cls, names) -> [ADSName]:
+        """Parses each of a sequence of single-string names
+        
+        Equivalent to [ADSName.parse(name) for name in names], but faster for
+        long lists like a document's author list."""
+        cache = _name_cache
+        result = []
+        append = result.append
+        for name in names:
+            try:
+                append(cache[name])
+            except KeyError:
+                if type(name) is ADSName:
+                    append(name)
+                else:
+                    instance = _previous_name_cache.pop(name, None)
+                    if instance is None:
+                        instance = ADSName(name)
+                    cache[name] = instance
+                    append(instance)
+        return result
+    
     def __init__(self, last_name, *given_names, preserve=False):
         """Do not call this method directly. Instead, use ADSName.parse()."""
         for name in (last_name, *given_names):
@@ -119,108 +195,78 @@ class ADSName:
                 raise TypeError(f"Invalid type: {name} is {type(name)},"
                                 " expected str")
         
-        self._equality_cache = {}
+        self._id = next(_next_id)
+        self._hash = None
         self._qualified_full_name = None
         self._synonym = None
         
         if len(given_names):
             self._original_name = f"{last_name}, {' '.join(given_names)}"
-            self._last_name = last_name
-            self._given_names = given_names
+            given = given_names
         else:
             # A complete name has been passed as a single string.
             self._original_name = last_name
             
             if not preserve:
-                last_name = last_name.translate(_char_prefilter)
+                # Hyphens and periods are replaced with spaces to allow them
+                # to split names into pieces. The period is included here so
+                # we can gracefully handle a type like "Last, F.M."
+                last_name = last_name.replace('-', ' ').replace('.', ' ')
             
             # Let's break it into components
-            parts = last_name.split(",", maxsplit=1)
-            self._last_name = parts[0]
+            last_name, comma, given = last_name.partition(",")
             
             # Check whether we only have a last name
-            if len(parts) > 1 and len(parts[1]) > 0:
-                self._given_names = parts[1].split()
-            else:
-                self._given_names = tuple()
-
-        self._last_name = _multiple_spaces_pattern.sub(' ', self._last_name)
-
-        if not preserve:
-            self._last_name = unidecode(self._last_name).lower()
-            self._given_names = tuple(unidecode(n).lower()
-                                      for n in self._given_names)
+            given = given.split() if len(given) else ()
         
-        self._last_name = self._last_name.strip()
-        self._given_names = tuple(n.strip() for n in self._given_names)
+        last = _multiple_spaces_pattern.sub(' ', last_name)
         
-        if len(self._last_name) and self._last_name[0] in '<>=@':
-            if self._last_name[0:2] in (">=", "=>"):
-                self._require_more_specific = True
-                self._allow_same_specific = True
-                self._require_less_specific = False
-                self._require_exact = False
-                self._allow_synonym = True
-            
-            elif self._last_name[0:2] in ("<=", "=<"):
-                self._require_more_specific = False
-                self._allow_same_specific = True
-                self._require_less_specific = True
-                self._require_exact = False
-                self._allow_synonym = True
-            
-            elif self._last_name[0] == ">":
-                self._require_more_specific = True
-                self._allow_same_specific = False
-                self._require_less_specific = False
-                self._require_exact = False
-                self._allow_synonym = True
-            
-            elif self._last_name[0] == "<":
-                self._require_more_specific = False
-                self._allow_same_specific = False
-                self._require_less_specific = True
-                self._require_exact = False
-                self._allow_synonym = True
-            
-            elif self._last_name[0] == "=":
-                self._require_more_specific = False
-                self._allow_same_specific = False
-                self._require_less_specific = False
-                self._require_exact = True
-                self._allow_synonym = True
-            
-            elif self._last_name[0] == "@":
-                self._require_more_specific = False
-                self._allow_same_specific = True
-                self._require_less_specific = False
-                self._require_exact = False
-                self._allow_synonym = False
+        if not preserve:
+            # Most names are pure ASCII, and unidecode would return them
+            # unchanged
+            if last.isascii() and all(gn.isascii() for gn in given):
+                last = last.lower()
+                given = [gn.lower() for gn in given]
             else:
-                raise InvalidName("Unexpected modifiers")
+                last = unidecode(last).lower()
+                given = [unidecode(gn).lower() for gn in given]
+        
+        last = last.strip()
+        
+        if len(last) and last[0] in '<>=@':
+            try:
+                modifiers = _modifier_flags[last[0:2]]
+            except KeyError:
+                try:
+                    modifiers = _modifier_flags[last[0]]
+                except KeyError:
+                    raise InvalidName("Unexpected modifiers")
         else:
-            self._require_more_specific = False
-            self._allow_same_specific = True
-            self._require_less_specific = False
-            self._require_exact = False
-            self._allow_synonym = True
+            modifiers = _no_modifier_flags
+        (self._require_more_specific,
+         self._allow_same_specific,
+         self._require_less_specific,
+         self._require_exact,
+         self._allow_synonym) = modifiers
         
         # Remove any non-letter characters
         if not preserve:
-            self._last_name = self._last_name.translate(_char_filter).strip()
-            self._given_names = tuple(name.translate(_char_filter).strip()
-                                      for name in self._given_names)
-        self._given_names = tuple(gn for gn in self._given_names
-                                  if gn != '')
+            last = _filter_chars(last).strip()
+            given = [_filter_chars(gn) for gn in given]
+        given = [gn.strip() for gn in given]
+        self._last_name = last
+        self._given_names = tuple(gn for gn in given if gn != '')
 
-        if self.last_name == '':
+        if last == '':
             raise InvalidName("Computed last name is empty")
         
+        if len(self._given_names):
+            self._match_key = (last, self._given_names[0][0])
+        else:
+            self._match_key = (last, '')
+        
         if not preserve and self._allow_synonym:
-            try:
-                self._synonym = _name_synonyms[self]
-            except KeyError:
-                pass
+            self._synonym = _find_synonym(self)
     
     def __eq__(self, other):
         """Checks equality by my understanding of ADS's name-matching rules.
@@ -235,8 +281,12 @@ class ADSName:
         if self is other and self._allow_same_specific:
             return True
         
+        if self._id < other._id:
+            key = (self._id << 32) | other._id
+        else:
+            key = (other._id << 32) | self._id
         try:
-            return self._equality_cache[other.qualified_full_name]
+            return _equality_cache[key]
         except KeyError:
             pass
         
@@ -272,8 +322,9 @@ class ADSName:
             if not equal and other._synonym is not None:
                 equal = other._synonym == self
             
-        self._equality_cache[other.qualified_full_name] = equal
-        other._equality_cache[self.qualified_full_name] = equal
+        if len(_equality_cache) >= MAXIMUM_EQUALITY_CACHE_ENTRIES:
+            _equality_cache.clear()
+        _equality_cache[key] = equal
         return equal
     
     @classmethod
@@ -340,7 +391,20 @@ class ADSName:
         return self.__str__()
     
     def __hash__(self):
-        return hash(repr(self))
+        # The repr is fixed once the instance is constructed
+        if self._hash is None:
+            self._hash = hash(repr(self))
+        return self._hash
+    
+    def _estimate_size(self):
+        """Estimates the memory used by this instance and its strings"""
+        size = sys.getsizeof(self) + sys.getsizeof(self._original_name)
+        size += sys.getsizeof(self._last_name)
+        size += sys.getsizeof(self._given_names)
+        size += sum(sys.getsizeof(gn) for gn in self._given_names)
+        if self._qualified_full_name is not None:
+            size += sys.getsizeof(self._qualified_full_name)
+        return size
     
     @property
     def level_of_detail(self):
@@ -417,6 +481,17 @@ class ADSName:
         return ((self._require_less_specific or self._require_more_specific)
                 and not self._allow_same_specific)
     
+    @property
+    def match_key(self):
+        """A (last name, first initial) tuple for finding candidate matches.
+        
+        Any two names which are equal (not counting equality through
+        synonyms) have the same match key, unless one of them has no given
+        names, in which case its initial is the empty string. Match keys can
+        therefore be used as dict keys to narrow down candidates, which must
+        then be confirmed with a full equality check."""
+        return self._match_key
+    
     @property
     def synonym(self):
         return self._synonym
@@ -490,7 +565,93 @@ class ADSName:
                 or not self._allow_synonym)
 
 
-def _parse_name_synonyms(synonym_list):
+class NameArray:
+    """A list of names, stored with precomputed columns of name data
+    
+    Used to search a long author list for every position matching a name. The
+    last-name columns are scanned with C-level iteration (itertools.compress
+    over a map of str.__eq__), and only the names sharing a last name with
+    the query (directly or through a synonym) get a full equality check."""
+    __slots__ = ('names', 'last_names', 'initials', 'synonym_last_names')
+    
+    def __init__(self, names):
+        self.names = tuple(ADSName.parse_many(names))
+        self.last_names = tuple(name._last_name for name in self.names)
+        self.initials = tuple(name._match_key[1] for name in self.names)
+        if any(name._synonym is not None for name in self.names):
+            # Last names are never empty, so '' marks a missing synonym
+            self.synonym_last_names = tuple(
+                name._synonym._last_name if name._synonym is not None
+                else ''
+                for name in self.names)
+        else:
+            self.synonym_last_names = None
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def _positions_of(self, column, last_name):
+        return itertools.compress(itertools.count(),
+                                  map(last_name.__eq__, column))
+    
+    def find_matching_indices(self, query: ADSName, excluded_names=None):
+        """Returns the indices of all names equal to `query`, in order
+        
+        Names found in `excluded_names` are skipped."""
+        query_last_names = [query._last_name]
+        if query._synonym is not None:
+            query_last_names.append(query._synonym._last_name)
+        columns = [self.last_names]
+        if self.synonym_last_names is not None:
+            columns.append(self.synonym_last_names)
+        
+        if len(query_last_names) == 1 and len(columns) == 1:
+            positions = self._positions_of(self.last_names, query._last_name)
+        else:
+            positions = set()
+            for column in columns:
+                for last_name in query_last_names:
+                    positions.update(self._positions_of(column, last_name))
+            positions = sorted(positions)
+        
+        query_initial = query._match_key[1]
+        check_initials = query._synonym is None and query_initial != ''
+        indices = []
+        for i in positions:
+            name = self.names[i]
+            # A cheap rejection of names which can't be consistent. This
+            # doesn't apply to names which might match through a synonym.
+            if (check_initials
+                    and self.initials[i] != query_initial
+                    and self.initials[i] != ''
+                    and name._synonym is None):
+                continue
+            if excluded_names is not None and name in excluded_names:
+                continue
+            if query == name:
+                indices.append(i)
+        return indices
+
+
+def find_matching_indices(query, names, excluded_names=None):
+    """Returns the indices of all names in `names` equal to `query`
+    
+    `names` may be a NameArray, which should be reused when searching the same
+    list repeatedly, or a list of strings or ADSNames."""
+    if type(query) is not ADSName:
+        query = ADSName.parse(query)
+    if type(names) is not NameArray:
+        names = NameArray(names)
+    return names.find_matching_indices(query, excluded_names)
+
+
+def _compile_synonyms(synonym_list, index=None):
+    """Converts lines of synonyms into a last name -> variants index
+    
+    Each entry in the index is a [variant, canonical name] pair, in the order
+    they should be inserted into a NameAwareDict."""
+    if index is None:
+        index = {}
     for synonym in synonym_list:
         synonym.strip()
         if len(synonym) == 0 or synonym[0] == '#' or ';' not in synonym:
@@ -510,26 +671,201 @@ def _parse_name_synonyms(synonym_list):
                      name)
                     for name in names]
         intermed.sort(reverse=True)
-        canonical = intermed[0][-1]
-        canonical = canonical.without_modifiers()
+        canonical = intermed[0][-1].full_name
         variants = [i[-1] for i in intermed[1:]]
         # Our variants are sorted with the most detailed forms first. Our
-        # NameAwareDict will end up with the less-detailed forms as keys.
+        # NameAwareDicts will end up with the less-detailed forms as keys.
         for variant in variants:
-            _name_synonyms[variant] = canonical
-    # Names in _name_synonyms now have invalid equality caches.
-    keys = _name_synonyms.keys()
-    values = _name_synonyms.values()
-    for name in itertools.chain(keys, values):
-        name._equality_cache.clear()
+            index.setdefault(variant.last_name, []).append(
+                [variant.full_name, canonical])
+    return index
 
 
-def _load_synonyms():
+def _parse_name_synonyms(synonym_list):
+    """Adds synonyms to those loaded from the synonym lists"""
+    global _synonym_entries, _name_synonyms
+    with _synonym_lock:
+        if _synonym_entries is None:
+            _load_synonyms()
+        entries = dict(_synonym_entries)
+        name_synonyms = dict(_name_synonyms)
+        for last_name, new_entries in _compile_synonyms(synonym_list).items():
+            entries[last_name] = entries.get(last_name, []) + new_entries
+            name_synonyms.pop(last_name, None)
+        _synonym_entries = entries
+        _name_synonyms = name_synonyms
+        # Cached equality results involving these names are now invalid.
+        _equality_cache.clear()
+
+
+def _find_synonym(name: ADSName):
+    if _synonym_entries is None:
+        with _synonym_lock:
+            if _synonym_entries is None:
+                _load_synonyms()
+    if name._last_name not in _synonym_entries:
+        return None
+    try:
+        variants = _name_synonyms[name._last_name]
+    except KeyError:
+        variants = _resolve_synonyms(name._last_name)
+    try:
+        return variants[name]
+    except KeyError:
+        return None
+
+
+def _resolve_synonyms(last_name):
+    """Parses the synonym entries for one last name"""
+    with _synonym_lock:
+        if last_name in _resolving_synonyms:
+            # A canonical name with this last name is looking up its own
+            # synonym among the variants parsed so far
+            return _resolving_synonyms[last_name]
+        if last_name in _name_synonyms:
+            # Another thread resolved it while we waited for the lock
+            return _name_synonyms[last_name]
+        variants = name_aware.NameAwareDict()
+        _resolving_synonyms[last_name] = variants
+        try:
+            for variant, canonical in _synonym_entries[last_name]:
+                variants['@' + variant] = ADSName.parse(canonical)
+        finally:
+            del _resolving_synonyms[last_name]
+        _name_synonyms[last_name] = variants
+        return variants
+
+
+def _synonym_sources():
+    sources = []
     for fname in local_config.name_synonym_lists:
-        _parse_name_synonyms(open(fname).readlines())
+        stat = os.stat(fname)
+        sources.append([fname, stat.st_size, stat.st_mtime_ns])
+    return sources
+
+
+def compile_synonym_index(sources=None):
+    """Compiles the synonym lists into a serializable index"""
+    if sources is None:
+        sources = _synonym_sources()
+    index = {}
+    for fname, _, _ in sources:
+        with open(fname) as f:
+            _compile_synonyms(f.readlines(), index)
+    return {
+        'version': SYNONYM_INDEX_VERSION,
+        'sources': sources,
+        'index': index,
+    }
+
+
+def write_synonym_index(path, compiled_index=None):
+    if compiled_index is None:
+        compiled_index = compile_synonym_index()
+    directory = os.path.dirname(path)
+    if directory != '':
+        os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file and move it into place, so that other
+    # processes never read a partial index
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(compiled_index, f)
+    os.replace(tmp_path, path)
+
+
+def _read_synonym_index(path, sources):
+    """Returns the index stored at `path`, or None if it's missing or stale"""
+    try:
+        with open(path) as f:
+            compiled_index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (compiled_index.get('version') != SYNONYM_INDEX_VERSION
+            or compiled_index.get('sources') != sources):
+        return None
+    return compiled_index['index']
+
 
+def new_generation():
+    """Marks the boundary between requests for the purposes of cache eviction
+    
+    If the intern table has grown beyond MAXIMUM_INTERNED_NAMES, names that
+    haven't been parsed since the last generation change are dropped. (Any
+    instances still referenced elsewhere remain valid, but a re-parse of the
+    same string will produce a new instance.)"""
+    global _name_cache, _previous_name_cache, _generation
+    if len(_name_cache) + len(_previous_name_cache) > MAXIMUM_INTERNED_NAMES:
+        _previous_name_cache = _name_cache
+        _name_cache = {}
+        _generation += 1
 
-_load_synonyms()
+
+def recently_used_names(n):
+    """Returns up to `n` interned name strings, most recently interned first
+    
+    Only names that were parsed from a single string are included. This can
+    be called while other threads are parsing names."""
+    names = []
+    for cache in (_name_cache, _previous_name_cache):
+        # Copying the keys is atomic, whereas iterating over the table would
+        # fail if another thread interned a name
+        for key in reversed(list(cache)):
+            if len(names) >= n:
+                return names
+            if type(key) is str:
+                names.append(key)
+    return names
+
+
+def name_cache_stats(include_names_bytes=False):
+    """Reports the sizes of the intern table and equality cache
+    
+    Byte counts are estimates of the memory held by the caches. Estimating
+    the intern table's size requires walking the whole table, which takes a
+    noticeable fraction of a second when it's full, so it's only done when
+    `include_names_bytes` is set."""
+    stats = {
+        'generation': _generation,
+        'n_names': len(_name_cache),
+        'n_names_previous_generation': len(_previous_name_cache),
+        'n_equality_entries': len(_equality_cache),
+        # Keys are ints of up to 64 bits, and the values are shared bools
+        'equality_bytes': (sys.getsizeof(_equality_cache)
+                           + len(_equality_cache) * sys.getsizeof(2**63)),
+    }
+    if include_names_bytes:
+        names_bytes = 0
+        for cache in (_name_cache, _previous_name_cache):
+            names_bytes += sys.getsizeof(cache)
+            for key, name in cache.items():
+                names_bytes += sys.getsizeof(key) + name._estimate_size()
+        stats['names_bytes'] = names_bytes
+    return stats
+
+
+def _load_synonyms():
+    """Loads the compiled synonym index, compiling it if it's out of date
+    
+    If the index file can't be written (e.g. on a read-only deployment), the
+    compiled index is only kept in memory."""
+    global _synonym_entries, _name_synonyms
+    index_path = getattr(local_config, 'name_synonym_index', None)
+    sources = _synonym_sources()
+    entries = None
+    if index_path is not None:
+        entries = _read_synonym_index(index_path, sources)
+    if entries is None:
+        compiled_index = compile_synonym_index(sources)
+        entries = compiled_index['index']
+        if index_path is not None:
+            try:
+                write_synonym_index(index_path, compiled_index)
+            except OSError:
+                pass
+    with _synonym_lock:
+        _synonym_entries = entries
+        _name_synonyms = {}
+        _equality_cache.clear()
 
 
 class InvalidName(RuntimeError):
@@ -1,18 +1,17 @@
 from __future__ import annotations
 
-from collections import defaultdict
 from typing import Dict, List, Union
 
 from . import ads_name
 
 
 class ContainerWithName:
-    __slots__ = ("value", "name", "last_names_used")
+    __slots__ = ("value", "name", "match_keys_used")
     
     def __init__(self, name: ads_name.ADSName, value):
         self.name = name
         self.value = value
-        self.last_names_used = [name.last_name]
+        self.match_keys_used = []
     
     def __hash__(self):
         return hash(self.name)
@@ -22,11 +21,45 @@ Name = Union[str, "ads_name.ADSName"]
 
 
 class NameAwareDict:
-    items_by_last_name: Dict[str, List[ContainerWithName]]
+    """A dict-like container using ADSName equality rules for its keys
+    
+    Containers are filed by their names' match keys, first by last name and
+    then by first initial. A lookup only has to check the containers filed
+    under its own initial and those filed under names with no given names
+    (which are consistent with any initial). A lookup for a name with no
+    given names checks everything filed under its last name."""
+    items_by_match_key: Dict[str, Dict[str, List[ContainerWithName]]]
     
     def __init__(self):
         self.clear()
     
+    def _candidates(self, key: ads_name.ADSName):
+        """Yields containers whose names may be equal to the given name"""
+        last_name, initial = key.match_key
+        items_by_initial = self.items_by_match_key.get(last_name)
+        if items_by_initial is None:
+            return
+        if initial == '':
+            for items in items_by_initial.values():
+                yield from items
+        else:
+            yield from items_by_initial.get(initial, ())
+            yield from items_by_initial.get('', ())
+    
+    def _find(self, key: ads_name.ADSName):
+        for item in self._candidates(key):
+            if item.name == key:
+                return item
+        return None
+    
+    def _file_container(self, container: ContainerWithName, match_key):
+        if match_key in container.match_keys_used:
+            return
+        last_name, initial = match_key
+        items_by_initial = self.items_by_match_key.setdefault(last_name, {})
+        items_by_initial.setdefault(initial, []).append(container)
+        container.match_keys_used.append(match_key)
+    
     def __getitem__(self, key: Name, return_container=False):
         """
         Attempts to find a record under the given name. If not found,
@@ -34,14 +67,10 @@ class NameAwareDict:
         """
         if type(key) is str:
             key = ads_name.ADSName.parse(key)
-        items = self.items_by_last_name[key.last_name]
-        for item in items:
-            if item.name == key:
-                container = item
-                break
-        else:
+        container = self._find(key)
+        if container is None:
             if (key.synonym is not None
-                    and key.synonym.last_name != key.last_name):
+                    and key.synonym.match_key != key.match_key):
                 container = self.__getitem__(key.synonym, True)
                 if container.name != key:
                     raise KeyError(key)
@@ -56,10 +85,10 @@ class NameAwareDict:
     def __setitem__(self, key: Name, value):
         """
         Stores data under the given name. If the name has a synonym with a
-        different last name, the same container is stored under the synonym's
-        last name. The container only ever stores the name that was last used
-        to store data, but remains in all items_by_last_name lists it has been
-        added to.
+        different match key, the same container is filed under the synonym's
+        match key. The container only ever stores the name that was last used
+        to store data, but remains filed under every match key it has been
+        filed under.
         Cases:
          - Store and look up using same name. Easy.
          - Store under alt or canonical name which have the exact same last
@@ -72,39 +101,26 @@ class NameAwareDict:
          - As above, but look up under a different alt name. Lookup attempts
            with the canonical name and succeeds.
          - Store under canonical name. Update using alt name. The container is
-           found using the canonical name and is entered under the alt name.
+           found using the canonical name and is filed under the alt name.
            Lookups succeed as above.
          - Store under alt name. Update using canonical name. The container is
            found using the canonical name and updated.
            Lookups succeed as above.
          - Store under alt name. Update using a different alt name. The
-           container is found using the shared canonical name and entered under
+           container is found using the shared canonical name and filed under
            the new alt name. Lookups succeed as above.
         """
         if type(key) is str:
             key = ads_name.ADSName.parse(key)
         
-        container = None
-        container_filed_under_self = False
-        container_filed_under_synonym = False
-
         # Search for an existing container under the given name
-        items = self.items_by_last_name[key.last_name]
-        for item in items:
-            if item.name == key:
-                container = item
-                container_filed_under_self = True
-                break
-
+        container = self._find(key)
+        
         # Search for an existing container under a synonym
         handle_synonym = (key.synonym is not None
-                          and key.synonym.last_name != key.last_name)
+                          and key.synonym.match_key != key.match_key)
         if container is None and handle_synonym:
-            for item in self.items_by_last_name[key.synonym.last_name]:
-                if item.name == key.synonym:
-                    container = item
-                    container_filed_under_synonym = True
-                    break
+            container = self._find(key.synonym)
         
         if container is None:
             # Create a new container if none was found
@@ -114,64 +130,61 @@ class NameAwareDict:
             container.name = key
             container.value = value
         
-        if not container_filed_under_self:
-            items.append(container)
-            if handle_synonym:
-                # If we're here, this container was found under a synonym
-                # with a different last name
-                container.last_names_used.append(key.last_name)
-        
-        if not container_filed_under_synonym and handle_synonym:
-            self.items_by_last_name[key.synonym.last_name].append(container)
-            container.last_names_used.append(key.synonym.last_name)
+        self._file_container(container, key.match_key)
+        if handle_synonym:
+            self._file_container(container, key.synonym.match_key)
     
     def __delitem__(self, key):
         if type(key) is str:
             key = ads_name.ADSName.parse(key)
         
         container = self.__getitem__(key, True)
-        for last_name in container.last_names_used:
-            items = self.items_by_last_name[last_name]
+        for last_name, initial in container.match_keys_used:
+            items_by_initial = self.items_by_match_key[last_name]
+            items = items_by_initial[initial]
             for i, item in enumerate(items):
                 if item is container:
                     if len(items) == 1:
-                        del self.items_by_last_name[last_name]
+                        del items_by_initial[initial]
+                        if len(items_by_initial) == 0:
+                            del self.items_by_match_key[last_name]
                     else:
                         items.pop(i)
                     break
     
     def __len__(self):
         containers = set()
-        for items in self.items_by_last_name.values():
-            containers.update(items)
+        for items_by_initial in self.items_by_match_key.values():
+            for items in items_by_initial.values():
+                containers.update(items)
         return len(containers)
     
     def __contains__(self, key: Name):
         if type(key) is str:
             key = ads_name.ADSName.parse(key)
         
-        for item in self.items_by_last_name[key.last_name]:
-            if item.name == key:
-                return True
-
-        if key.synonym is not None and key.synonym.last_name != key.last_name:
+        if self._find(key) is not None:
+            return True
+        
+        if key.synonym is not None and key.synonym.match_key != key.match_key:
             return key.synonym in self
         
         return False
     
     def __str__(self):
-        return str(self.items_by_last_name)
+        return str(self.items_by_match_key)
     
     def __repr__(self):
-        return repr(self.items_by_last_name)
+        return repr(self.items_by_match_key)
     
     def _iter_all(self):
         items_seen = set()
-        for items in self.items_by_last_name.values():
-            for item in items:
-                if item not in items_seen:
-                    items_seen.add(item)
-                    yield item.name, item.value
+        for items_by_initial in self.items_by_match_key.values():
+            for items in items_by_initial.values():
+                for item in items:
+                    if item not in items_seen:
+                        items_seen.add(item)
+                        yield item.name, item.value
     
     def __iter__(self):
         for key, value in self._iter_all():
@@ -188,7 +201,7 @@ class NameAwareDict:
         return tuple(self._iter_all())
     
     def clear(self):
-        self.items_by_last_name = defaultdict(list)
+        self.items_by_match_key = {}
 
 
 class NameAwareSet:
@@ -1,6 +1,9 @@
 from collections import deque
 from typing import List, Set
 
+import cancellation
+import search_context
+import tracing
 from ads_buddy import is_bibcode, is_orcid_id, normalize_orcid_id
 from cache.cache_buddy import key_is_valid
 from log_buddy import lb
@@ -116,7 +119,23 @@ class PathFinder:
         self.orig_src = src
         self.orig_dest = dest
     
-    def find_path(self):
+    def find_path(self, cancellation_token=None):
+        """Searches for the shortest chains connecting src and dest
+        
+        If a CancellationToken is given, it's checked between author
+        expansions and before ADS queries, and SearchCancelled is raised if
+        it's been cancelled or its deadline has passed. Once a path is
+        found, the deadline no longer applies, so that ranking and
+        serializing the result can't throw it away, but the search can
+        still be cancelled."""
+        if cancellation_token is not None:
+            search_context.current().set('cancellation', cancellation_token)
+        with tracing.span("search", src=self.orig_src, dest=self.orig_dest):
+            self._find_path()
+        search_context.current().set(
+            'cancellation', cancellation.current().without_deadline())
+    
+    def _find_path(self):
         lb.on_start_path_finding()
         self.n_iterations = 0
         
@@ -202,109 +221,22 @@ class PathFinder:
             authors.clear()
             authors.extend(authors_next)
             authors_next.clear()
+            lb.on_frontier_expanded(len(authors))
             
-            # There's no point pre-fetching for only one author, and this
-            # ensures we don't re-fetch the src and dest authors if they
-            # were provided by ORCID ID
-            if len(authors) > 1:
-                self.repository.notify_of_upcoming_author_request(*authors)
-            for expand_author in authors:
-                lb.d(f"Expanding author {expand_author}")
-                expand_node = self.nodes[expand_author]
-                expand_node_dist = expand_node.dist(expanding_from_src)
-                
-                # We already have src and dest records handy, and this special
-                # handling is required if either was provided by ORCID ID
-                if expand_node is self.src:
-                    record = src_rec
-                elif expand_node is self.dest:
-                    record = dest_rec
-                else:
-                    record = self.repository.get_author_record(expand_author)
-
-                # Here's a tricky one. If "<=Last, F" is in the exclude
-                # list, and if we previously came across "Last, First" and
-                # we're now expanding that node, we're ok using papers
-                # written under "Last, First" but we're _not_ ok using
-                # papers written under "Last, F.". So we need to ensure
-                # we're allowed to use each paper by ensuring Last, First's
-                # name appears on it in a way that's not excluded.
-                ok_aliases = [
-                    name for name in record.appears_as
-                    if name not in self.excluded_names]
-                if (len(self.excluded_bibcodes)
-                        or len(ok_aliases) != len(record.appears_as)):
-                    ok_bibcodes = {
-                        bibcode
-                        for alias in ok_aliases
-                        for bibcode in record.appears_as[alias]
-                        if bibcode not in self.excluded_bibcodes
-                    }
-                else:
-                    ok_bibcodes = None
-                
-                for coauthor, bibcodes in record.coauthors.items():
-                    # lb.d(f"  Checking coauthor {coauthor}")
-                    if ok_bibcodes is not None:
-                        bibcodes = [bibcode for bibcode in bibcodes
-                                    if bibcode in ok_bibcodes]
-                    if len(bibcodes) == 0:
-                        continue
-                    
-                    coauthor = ADSName.parse(coauthor)
-                    if coauthor in self.excluded_names:
-                        # lb.d("   Author is excluded")
-                        continue
-                    
-                    try:
-                        node = self.nodes[coauthor]
-                        # lb.d(f"   Author exists in graph")
-                    except KeyError:
-                        # lb.d(f"   New author added to graph")
-                        lb.on_coauthor_seen()
-                        node = PathNode(name=coauthor)
-                        self.nodes[coauthor] = node
-                        node.set_dist(expand_node_dist + 1, expanding_from_src)
-                        node.neighbors(expanding_from_src).add(expand_node)
-                        links = node.links(expanding_from_src)[expand_node]
-                        links.update(bibcodes)
-                        authors_next.append(coauthor)
-                        continue
-                    
-                    # if (node.dist(expanding_from_src)
-                    #         <= expand_node_dist):
-                        # This node is closer to the src/dest than we are
-                        # and must have been encountered in a
-                        # previous expansion cycle. Ignore it.
-                        # pass
-                    if (node.dist(expanding_from_src)
-                            > expand_node_dist):
-                        # We provide an equal-or-better route from the
-                        # src/dest than the route (if any) that this node
-                        # is aware of, meaning this node is a viable next
-                        # step along the chain from the src/dest through
-                        # us. That it already exists suggests it has
-                        # multiple chains of equal length connecting it to
-                        # the src or dest.
-                        # If the src or dest was given via ORCID ID, we need
-                        # to make sure we have a valid connection. (E.g. if
-                        # the given ID is for one J Doe and our expand_author
-                        # is connected to a different J Doe, we need to
-                        # exclude that.
-                        if len(node.legal_bibcodes):
-                            legal_bibcodes = set(bibcodes) & node.legal_bibcodes
-                        else:
-                            legal_bibcodes = bibcodes
-                        if len(legal_bibcodes):
-                            links = node.links(expanding_from_src)[expand_node]
-                            links.update(legal_bibcodes)
-                            node.set_dist(expand_node_dist + 1,
-                                          expanding_from_src)
-                            node.neighbors(expanding_from_src).add(expand_node)
-                            # lb.d(f"   Added viable step")
-                            if self.node_connects(node, expanding_from_src):
-                                self.connecting_nodes.add(node)
-                                lb.d(f"   Connecting author found!")
+            with tracing.span("level", level=self.n_iterations,
+                              from_src=expanding_from_src,
+                              n_authors=len(authors)):
+                # There's no point pre-fetching for only one author, and this
+                # ensures we don't re-fetch the src and dest authors if they
+                # were provided by ORCID ID
+                if len(authors) > 1:
+                    self.repository.notify_of_upcoming_author_request(*authors)
+                for expand_author in authors:
+                    cancellation.check()
+                    with tracing.span("expand_author", author=expand_author):
+                        self._expand_author(
+                            expand_author, expanding_from_src,
+                            authors_next, src_rec, dest_rec)
             lb.d("All expansions complete")
             self.n_iterations += 1
             if len(self.connecting_nodes) > 0:
@@ -320,6 +252,106 @@ class PathFinder:
         lb.set_distance(self.src.dist_from_dest)
         lb.on_stop_path_finding()
     
+    def _expand_author(self, expand_author, expanding_from_src,
+                       authors_next, src_rec, dest_rec):
+        """Adds the coauthors of one author to the graph"""
+        lb.d(f"Expanding author {expand_author}")
+        expand_node = self.nodes[expand_author]
+        expand_node_dist = expand_node.dist(expanding_from_src)
+        
+        # We already have src and dest records handy, and this special
+        # handling is required if either was provided by ORCID ID
+        if expand_node is self.src:
+            record = src_rec
+        elif expand_node is self.dest:
+            record = dest_rec
+        else:
+            record = self.repository.get_author_record(expand_author)
+        
+        # Here's a tricky one. If "<=Last, F" is in the exclude
+        # list, and if we previously came across "Last, First" and
+        # we're now expanding that node, we're ok using papers
+        # written under "Last, First" but we're _not_ ok using
+        # papers written under "Last, F.". So we need to ensure
+        # we're allowed to use each paper by ensuring Last, First's
+        # name appears on it in a way that's not excluded.
+        ok_aliases = [
+            name for name in record.appears_as
+            if name not in self.excluded_names]
+        if (len(self.excluded_bibcodes)
+                or len(ok_aliases) != len(record.appears_as)):
+            ok_bibcodes = {
+                bibcode
+                for alias in ok_aliases
+                for bibcode in record.appears_as[alias]
+                if bibcode not in self.excluded_bibcodes
+            }
+        else:
+            ok_bibcodes = None
+        
+        for coauthor, bibcodes in record.coauthors.items():
+            # lb.d(f"  Checking coauthor {coauthor}")
+            if ok_bibcodes is not None:
+                bibcodes = [bibcode for bibcode in bibcodes
+                            if bibcode in ok_bibcodes]
+            if len(bibcodes) == 0:
+                continue
+            
+            coauthor = ADSName.parse(coauthor)
+            if coauthor in self.excluded_names:
+                # lb.d("   Author is excluded")
+                continue
+            
+            try:
+                node = self.nodes[coauthor]
+                # lb.d(f"   Author exists in graph")
+            except KeyError:
+                # lb.d(f"   New author added to graph")
+                lb.on_coauthor_seen()
+                node = PathNode(name=coauthor)
+                self.nodes[coauthor] = node
+                node.set_dist(expand_node_dist + 1, expanding_from_src)
+                node.neighbors(expanding_from_src).add(expand_node)
+                links = node.links(expanding_from_src)[expand_node]
+                links.update(bibcodes)
+                authors_next.append(coauthor)
+                continue
+            
+            # if (node.dist(expanding_from_src)
+            #         <= expand_node_dist):
+                # This node is closer to the src/dest than we are
+                # and must have been encountered in a
+                # previous expansion cycle. Ignore it.
+                # pass
+            if (node.dist(expanding_from_src)
+                    > expand_node_dist):
+                # We provide an equal-or-better route from the
+                # src/dest than the route (if any) that this node
+                # is aware of, meaning this node is a viable next
+                # step along the chain from the src/dest through
+                # us. That it already exists suggests it has
+                # multiple chains of equal length connecting it to
+                # the src or dest.
+                # If the src or dest was given via ORCID ID, we need
+                # to make sure we have a valid connection. (E.g. if
+                # the given ID is for one J Doe and our expand_author
+                # is connected to a different J Doe, we need to
+                # exclude that.
+                if len(node.legal_bibcodes):
+                    legal_bibcodes = set(bibcodes) & node.legal_bibcodes
+                else:
+                    legal_bibcodes = bibcodes
+                if len(legal_bibcodes):
+                    links = node.links(expanding_from_src)[expand_node]
+                    links.update(legal_bibcodes)
+                    node.set_dist(expand_node_dist + 1,
+                                  expanding_from_src)
+                    node.neighbors(expanding_from_src).add(expand_node)
+                    # lb.d(f"   Added viable step")
+                    if self.node_connects(node, expanding_from_src):
+                        self.connecting_nodes.add(node)
+                        lb.d(f"   Connecting author found!")
+    
     def node_connects(self, node: PathNode, expanding_from_src: bool):
         if (len(node.neighbors_toward_src) > 0
                 and len(node.neighbors_toward_dest) > 0):
@@ -0,0 +1,80 @@
+"""
+Refreshes the cached records of popular authors before they expire, so that
+searches don't wait on ADS for them
+
+Popularity is taken from the request counts saved in the latest cache
+snapshot, plus the source and destination authors of the searches recorded in
+any log files given on the command line, e.g.
+
+    python prewarm_cache.py [appa.log ...]
+"""
+import re
+import sys
+import time
+from collections import Counter
+
+from cache import cache_buddy
+
+from ads_buddy import ADSRateLimitError, is_orcid_id, normalize_orcid_id
+from log_buddy import lb
+from names.ads_name import ADSName, InvalidName
+from repository import Repository
+
+# How many of the most popular authors to keep warm
+N_AUTHORS = 3000
+# Records expiring within this many seconds are refreshed
+REFRESH_MARGIN = 3 * 24 * 60 * 60
+
+_search_pattern = re.compile(
+    r"find_route invoked for src:(.*?), dest:(.*?), excl:")
+
+
+def count_searched_authors(log_lines):
+    """Counts how often each author appears as a search endpoint in the logs
+    
+    Returns a Counter keyed by author cache key."""
+    counts = Counter()
+    for line in log_lines:
+        match = _search_pattern.search(line)
+        if match is None:
+            continue
+        for author in match.groups():
+            try:
+                if is_orcid_id(author):
+                    key = normalize_orcid_id(author)
+                else:
+                    key = ADSName.parse(author).qualified_full_name
+            except InvalidName:
+                continue
+            counts[key] += 1
+    return counts
+
+
+def find_popular_authors(log_files=(), n=N_AUTHORS):
+    counts = Counter(cache_buddy.popular_authors())
+    for fname in log_files:
+        with open(fname) as f:
+            counts.update(count_searched_authors(f))
+    return [key for key, _ in counts.most_common(n)]
+
+
+def prewarm(log_files=(), n=N_AUTHORS, refresh_margin=REFRESH_MARGIN):
+    t_start = time.time()
+    authors = find_popular_authors(log_files, n)
+    repo = Repository()
+    try:
+        n_refreshed = repo.prewarm_author_records(authors, refresh_margin)
+    except ADSRateLimitError:
+        lb.log_exception()
+        return None
+    finally:
+        cache_buddy.flush_writes()
+    lb.i(f"Pre-warmed the cache for {len(authors)} popular authors,"
+         f" {n_refreshed} records refreshed, in"
+         f" {time.time() - t_start:.2f} s")
+    return n_refreshed
+
+
+if __name__ == "__main__":
+    lb.set_log_level(lb.INFO)
+    prewarm(sys.argv[1:])
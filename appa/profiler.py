@@ -0,0 +1,104 @@
+"""
+A low-overhead sampling profiler for individual searches
+
+While running, a background thread samples the profiled thread's call stack
+every SAMPLE_INTERVAL seconds. The samples are reported as folded stacks
+(one line per distinct stack, `frame;frame;frame count`), which flamegraph.pl
+and https://www.speedscope.app read directly, and summarized as the time
+spent in each part of APPA, attributing each sample to the innermost APPA
+frame on the stack (so time waiting on ADS counts toward ads_buddy).
+"""
+import os
+import sys
+import threading
+from collections import Counter
+
+SAMPLE_INTERVAL = .005
+
+_appa_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    if filename.startswith(_appa_dir):
+        filename = os.path.relpath(filename, _appa_dir)
+    else:
+        # Keep the package name for library code
+        filename = "/".join(filename.split(os.sep)[-2:])
+    return f"{filename}:{code.co_name}"
+
+
+def _component(code):
+    """Returns the part of APPA a frame belongs to, or None for frames
+    outside APPA"""
+    filename = code.co_filename
+    if not filename.startswith(_appa_dir):
+        return None
+    relpath = os.path.relpath(filename, _appa_dir)
+    # Packages (names, cache, records) are reported as a whole
+    return relpath.split(os.sep)[0].removesuffix(".py")
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        """Profiles the thread with the given ID, by default the thread
+        creating the profiler"""
+        self.thread_id = (threading.get_ident() if thread_id is None
+                          else thread_id)
+        self.interval = interval
+        self.stacks = Counter()
+        self.components = Counter()
+        self.n_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self._sample(frame)
+    
+    def _sample(self, frame):
+        labels = []
+        component = None
+        while frame is not None:
+            code = frame.f_code
+            labels.append(_frame_label(code))
+            if component is None:
+                component = _component(code)
+            frame = frame.f_back
+        self.stacks[";".join(reversed(labels))] += 1
+        self.components[component or "other"] += 1
+        self.n_samples += 1
+    
+    def folded_stacks(self):
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in self.stacks.most_common())
+    
+    def component_times(self):
+        """Returns the estimated seconds spent in each part of APPA"""
+        return {component: count * self.interval
+                for component, count in self.components.most_common()}
+    
+    def summary(self):
+        return ", ".join(f"{component} {seconds:.2f} s"
+                         for component, seconds
+                         in self.component_times().items())
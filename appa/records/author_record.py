@@ -12,6 +12,9 @@ class AuthorRecord:
     appears_as: Dict[str, List[str]] = dataclasses.field(default_factory=dict)
     coauthors: Dict[str, List[str]] = dataclasses.field(default_factory=dict)
     timestamp: int = -1
+    # The number of times this record has been brought up to date by adding
+    # only newly-entered documents, since the last full query
+    n_delta_refreshes: int = 0
     
     def __post_init__(self):
         if self.name is not None:
@@ -40,6 +43,7 @@ class AuthorRecord:
             'coauthors': {k: (list(v) if type(v) is list else v)
                           for k, v in self.coauthors.items()},
             'timestamp': self.timestamp,
+            'n_delta_refreshes': self.n_delta_refreshes,
         }
         
     def compress(self):
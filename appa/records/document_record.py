@@ -1,6 +1,8 @@
 import dataclasses
 import time
-from typing import List
+from typing import List, Tuple
+
+from names.ads_name import ADSName, NameArray
 
 
 @dataclasses.dataclass()
@@ -18,12 +20,36 @@ class DocumentRecord:
     orcid_ids: List[str]
     orcid_id_src: List[int]
     timestamp: int = -1
+    # Parsed forms of `authors`. Not stored in the cache.
+    _author_names: Tuple[ADSName] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False)
+    _author_name_array: NameArray = dataclasses.field(
+        default=None, init=False, repr=False, compare=False)
     
     def __post_init__(self):
         if self.timestamp == -1:
             self.timestamp = int(time.time())
     
+    @property
+    def author_names(self):
+        """The parsed forms of the names in `authors`
+        
+        Parsing is done once per record and shared by everything that
+        matches names against this document's author list."""
+        if self._author_names is None:
+            self._author_names = tuple(ADSName.parse_many(self.authors))
+        return self._author_names
+    
+    @property
+    def author_name_array(self):
+        """`author_names` as a NameArray, for batch name matching"""
+        if self._author_name_array is None:
+            self._author_name_array = NameArray(self.author_names)
+        return self._author_name_array
+    
     def delete_author(self, i):
+        self._author_names = None
+        self._author_name_array = None
         del self.authors[i]
         del self.affils[i]
         del self.orcid_ids[i]
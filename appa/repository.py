@@ -1,64 +1,246 @@
+import time
 from collections import defaultdict
 from typing import Union
 
 from cache import cache_buddy
 
-from ads_buddy import ADS_Buddy
-from cache.cache_buddy import CacheMiss
+import cancellation
+from ads_buddy import ADS_Buddy, is_orcid_id
+from cache.cache_buddy import CacheMiss, StaleCacheData
+from cancellation import SearchCancelled
 from log_buddy import lb
 from names.ads_name import ADSName
 from records.author_record import AuthorRecord
 from records.document_record import DocumentRecord
+import search_context
+from single_flight import SingleFlight
+import tracing
 
 Name = Union[str, ADSName]
 
+# An expired author record is normally brought up to date by querying ADS
+# for only the documents entered since the record was made. After this many
+# such refreshes, the author's full publication list is re-downloaded
+# instead, to pick up changes to older documents (e.g. merged e-prints).
+MAXIMUM_DELTA_REFRESHES = 3
+# The number of authors whose records are brought up to date in each ADS query
+# when pre-warming the cache. Delta refreshes return few documents, so more
+# authors can be combined than for full queries.
+PREWARM_BATCH_SIZE = 20
+
+# Concurrent fetches of the same uncached author record are done once. The
+# fetch checks the leading search's cancellation token, so if that search is
+# cancelled, a waiting search takes over the fetch.
+_author_fetches = SingleFlight("author_records", retry_on=(SearchCancelled,))
+
 
 class Repository:
-    ads_buddy = ADS_Buddy()
-    
     def __init__(self, can_skip_refresh=False):
         if not can_skip_refresh:
             cache_buddy.refresh()
     
+    @property
+    def ads_buddy(self) -> ADS_Buddy:
+        # Each search has its own prefetch queue
+        return search_context.current().get('ads_buddy', ADS_Buddy)
+    
     def get_author_record(self, author: Name) -> AuthorRecord:
         author = ADSName.parse(author)
         try:
             author_record = cache_buddy.load_author(author)
-        except CacheMiss:
-            author_record = self._try_generating_author_record(author)
-            if author_record is None:
-                author_record, documents = \
-                    self.ads_buddy.get_papers_for_author(author)
-                cache_buddy.cache_documents(documents)
-                if type(author_record) == AuthorRecord:
-                    self._fill_in_coauthors(author_record)
-                    if len(author_record.documents):
-                        cache_buddy.cache_author(author_record)
-                else:
-                    for rec in author_record.values():
-                        self._fill_in_coauthors(rec)
-                    cache_buddy.cache_authors(
-                        [ar for ar in author_record.values()
-                            if len(ar.documents)])
-                    author_record = author_record[author]
+        except CacheMiss as e:
+            cancellation.check()
+            # If another thread is already fetching this record, wait for
+            # its result rather than fetching it again
+            with tracing.span("fetch_author", author=author):
+                author_record = _author_fetches.do(
+                    author.qualified_full_name,
+                    self._fetch_author_record, author, e)
         lb.on_author_queried()
         lb.on_doc_queried(len(author_record.documents))
         return author_record
     
+    def _fetch_author_record(self, author: ADSName,
+                             miss: CacheMiss) -> AuthorRecord:
+        if isinstance(miss, StaleCacheData):
+            author_record = self._refresh_author_record(miss.record, author)
+            if author_record is None:
+                author_record = self._query_author_record(author)
+        else:
+            author_record = self._try_generating_author_record(author)
+            if author_record is None:
+                author_record = self._query_author_record(author)
+        return author_record
+    
+    def _query_author_record(self, author: ADSName) -> AuthorRecord:
+        author_record, documents = \
+            self.ads_buddy.get_papers_for_author(author)
+        cache_buddy.cache_documents(documents)
+        if type(author_record) == AuthorRecord:
+            self._fill_in_coauthors(author_record)
+            if len(author_record.documents):
+                cache_buddy.cache_author(author_record)
+        else:
+            self._fill_in_coauthors(*author_record.values())
+            cache_buddy.cache_authors(
+                [ar for ar in author_record.values()
+                    if len(ar.documents)])
+            author_record = author_record[author]
+        return author_record
+    
     def get_author_record_by_orcid_id(self, orcid_id: str) -> AuthorRecord:
         try:
             author_record = cache_buddy.load_author(orcid_id)
-        except CacheMiss:
-            author_record, documents = \
-                self.ads_buddy.get_papers_for_orcid_id(orcid_id)
-            cache_buddy.cache_documents(documents)
-            self._fill_in_coauthors(author_record)
-            if len(author_record.documents):
-                cache_buddy.cache_author(author_record, cache_key=orcid_id)
+        except CacheMiss as e:
+            cancellation.check()
+            with tracing.span("fetch_author", orcid_id=orcid_id):
+                author_record = _author_fetches.do(
+                    orcid_id, self._fetch_orcid_id_record, orcid_id, e)
         lb.on_author_queried()
         lb.on_doc_queried(len(author_record.documents))
         return author_record
     
+    def _fetch_orcid_id_record(self, orcid_id: str,
+                               miss: CacheMiss) -> AuthorRecord:
+        if isinstance(miss, StaleCacheData):
+            author_record = self._refresh_author_record(
+                miss.record, orcid_id=orcid_id)
+            if author_record is None:
+                author_record = self._query_orcid_id_record(orcid_id)
+        else:
+            author_record = self._query_orcid_id_record(orcid_id)
+        return author_record
+    
+    def _query_orcid_id_record(self, orcid_id: str) -> AuthorRecord:
+        author_record, documents = \
+            self.ads_buddy.get_papers_for_orcid_id(orcid_id)
+        cache_buddy.cache_documents(documents)
+        self._fill_in_coauthors(author_record)
+        if len(author_record.documents):
+            cache_buddy.cache_author(author_record, cache_key=orcid_id)
+        return author_record
+    
+    def _refresh_author_record(self, stale_record: AuthorRecord,
+                               author: ADSName = None,
+                               orcid_id: str = None):
+        """Brings an expired author record up to date
+        
+        Rather than re-downloading the author's full publication list, ADS is
+        asked only for documents entered since the record was made. Those
+        are merged into the record. Returns None if a full query should be
+        done instead."""
+        if (stale_record.n_delta_refreshes >= MAXIMUM_DELTA_REFRESHES
+                or not self._revalidate_documents(stale_record)):
+            return None
+        
+        if orcid_id is None:
+            new_record, documents = self.ads_buddy.get_papers_for_author(
+                author, entered_since=stale_record.timestamp)
+        else:
+            new_record, documents = self.ads_buddy.get_papers_for_orcid_id(
+                orcid_id, entered_since=stale_record.timestamp)
+        cache_buddy.cache_documents(documents)
+        
+        if orcid_id is None:
+            cache_key = author.qualified_full_name
+        else:
+            cache_key = orcid_id
+        return self._merge_new_documents(
+            stale_record, new_record.documents, cache_key)
+    
+    @staticmethod
+    def _revalidate_documents(stale_record: AuthorRecord):
+        """Keeps the record's documents cached for as long as the refreshed
+        record can be served, including the stale grace period
+        
+        Returns False if any have already left the cache, since downloading
+        them one at a time would cost more than a full query."""
+        until = (time.time() + cache_buddy.max_age_for(str(stale_record.name))
+                 + cache_buddy.STALE_GRACE_PERIOD)
+        return cache_buddy.revalidate_documents(stale_record.documents, until)
+    
+    def _merge_new_documents(self, stale_record: AuthorRecord,
+                             bibcodes, cache_key):
+        """Adds newly-entered documents to a copy of an author record and
+        caches it. The new documents must already be cached, and the old
+        ones revalidated."""
+        author_record = stale_record.copy()
+        old_documents = set(author_record.documents)
+        new_bibcodes = [bibcode for bibcode in bibcodes
+                        if bibcode not in old_documents]
+        author_record.documents = sorted(old_documents.union(new_bibcodes))
+        self._fill_in_coauthors(author_record, bibcodes=new_bibcodes)
+        author_record.timestamp = int(time.time())
+        author_record.n_delta_refreshes += 1
+        
+        lb.i(f"Author record for {str(author_record.name)} refreshed with "
+             f"{len(new_bibcodes)} new documents")
+        cache_buddy.cache_author(author_record, cache_key=cache_key)
+        return author_record
+    
+    def prewarm_author_records(self, cache_keys, refresh_margin):
+        """Brings author records up to date before they expire
+        
+        Records which are missing, expired, or will expire within
+        `refresh_margin` seconds are refreshed. Delta refreshes of
+        name-keyed records are done PREWARM_BATCH_SIZE authors to an ADS
+        query, and full queries go through the prefetch queue so they're
+        batched as well. Returns the number of records refreshed."""
+        t_start = time.time()
+        delta_by_name = []
+        delta_by_orcid_id = []
+        full = []
+        for key in cache_keys:
+            try:
+                record = cache_buddy.load_author(key)
+            except StaleCacheData as e:
+                record = e.record
+            except CacheMiss:
+                full.append(key)
+                continue
+            expires = (record.timestamp
+                       + cache_buddy.max_age_for(str(record.name)))
+            if expires > t_start + refresh_margin:
+                continue
+            if (record.n_delta_refreshes >= MAXIMUM_DELTA_REFRESHES
+                    or not self._revalidate_documents(record)):
+                full.append(key)
+            elif is_orcid_id(key):
+                delta_by_orcid_id.append((key, record))
+            else:
+                delta_by_name.append((key, record))
+        
+        for i in range(0, len(delta_by_name), PREWARM_BATCH_SIZE):
+            batch = delta_by_name[i:i + PREWARM_BATCH_SIZE]
+            new_records, documents = self.ads_buddy.get_papers_for_authors(
+                [key for key, _ in batch],
+                entered_since=min(record.timestamp for _, record in batch))
+            cache_buddy.cache_documents(documents)
+            for key, record in batch:
+                self._merge_new_documents(
+                    record, new_records[key].documents, key)
+        
+        for key, record in delta_by_orcid_id:
+            self._refresh_author_record(record, orcid_id=key)
+        
+        self.ads_buddy.add_authors_to_prefetch_queue(
+            *[ADSName.parse(key) for key in full if not is_orcid_id(key)])
+        n_refreshed = len(delta_by_name) + len(delta_by_orcid_id)
+        for key in full:
+            # The record may have been refreshed as another author's prefetch
+            try:
+                if cache_buddy.load_author(key).timestamp >= t_start:
+                    n_refreshed += 1
+                    continue
+            except CacheMiss:
+                pass
+            if is_orcid_id(key):
+                self._query_orcid_id_record(key)
+            else:
+                self._query_author_record(ADSName.parse(key))
+            n_refreshed += 1
+        return n_refreshed
+    
     def get_document(self, bibcode) -> DocumentRecord:
         try:
             document_record = cache_buddy.load_document(bibcode)
@@ -88,24 +270,51 @@ class Repository:
         except cache_buddy.CacheMiss:
             pass
     
-    def _fill_in_coauthors(self, author_record: AuthorRecord):
-        coauthors = defaultdict(set)
-        appears_as = defaultdict(set)
-        for document in cache_buddy.load_documents(author_record.documents):
-            for coauthor in document.authors:
-                if coauthor == author_record.name:
-                    appears_as[coauthor].add(document.bibcode)
-                else:
-                    coauthors[coauthor].add(document.bibcode)
+    def _fill_in_coauthors(self, *author_records: AuthorRecord,
+                           bibcodes=None):
+        """Builds records' coauthor and alias lists from their documents
+        
+        The documents of all the given records are loaded together, and each
+        document is scanned once using its pre-parsed author names, no matter
+        how many of the records include it. If `bibcodes` is given, only
+        those documents are scanned, and the results are merged into the
+        records' existing lists."""
+        coauthors = []
+        appears_as = []
+        records_by_bibcode = defaultdict(list)
+        for i, author_record in enumerate(author_records):
+            if bibcodes is None:
+                coauthors.append(defaultdict(set))
+                appears_as.append(defaultdict(set))
+            else:
+                coauthors.append(defaultdict(set, {
+                    k: set(v) for k, v in author_record.coauthors.items()}))
+                appears_as.append(defaultdict(set, {
+                    k: set(v) for k, v in author_record.appears_as.items()}))
+            for bibcode in (author_record.documents
+                            if bibcodes is None
+                            else bibcodes):
+                records_by_bibcode[bibcode].append(i)
+        
+        for document in cache_buddy.load_documents(list(records_by_bibcode)):
+            for i in records_by_bibcode[document.bibcode]:
+                name = author_records[i].name
+                for coauthor, coauthor_name in zip(document.authors,
+                                                   document.author_names):
+                    if name == coauthor_name:
+                        appears_as[i][coauthor].add(document.bibcode)
+                    else:
+                        coauthors[i][coauthor].add(document.bibcode)
         
         # defaultdict doesn't play nicely with dataclasses' asdict(),
         # so convert to normal dicts. Also convert sets to (sorted) lists
-        author_record.coauthors = {
-            k: sorted(v) for k, v in coauthors.items()
-        }
-        author_record.appears_as = {
-            k: sorted(v) for k, v in appears_as.items()
-        }
+        for i, author_record in enumerate(author_records):
+            author_record.coauthors = {
+                k: sorted(v) for k, v in coauthors[i].items()
+            }
+            author_record.appears_as = {
+                k: sorted(v) for k, v in appears_as[i].items()
+            }
     
     def _try_generating_author_record(self, author: ADSName):
         """Generate a requested record from existing cache data
@@ -119,28 +328,20 @@ class Repository:
             # This author does not have a modifier character in front
             return None
         
-        selected_documents = []
         try:
-            author_record = cache_buddy.load_author(author.full_name)
+            base_record = cache_buddy.load_author(author.full_name)
+        except StaleCacheData:
+            # Refreshing the base record and deriving from it is cheaper
+            # than querying ADS for the modified name
+            base_record = self.get_author_record(author.full_name)
         except CacheMiss:
             return None
         
-        try:
-            documents = cache_buddy.load_documents(author_record.documents)
-        except CacheMiss:
-            return None
-        # TODO: This can be done with author_record.appears_as
-        for doc in documents:
-            for coauthor in doc.authors:
-                if coauthor == author:
-                    selected_documents.append(doc.bibcode)
-                    break
-
-        new_author_record = AuthorRecord(name=author,
-                                         documents=selected_documents)
-        self._fill_in_coauthors(new_author_record)
-        
-        cache_buddy.cache_author(new_author_record)
+        new_author_record = derive_author_record(base_record, author)
+        # Deriving is cheap, so the record is kept only in memory rather
+        # than spending a backing-cache write on it, and is derived again
+        # once the base record expires
+        cache_buddy.remember_derived_author(new_author_record, base_record)
         
         lb.i(f"Author record for {str(author)} constructed from cache")
         return new_author_record
@@ -157,3 +358,56 @@ class Repository:
                  or author.require_less_specific)
             for in_cache, author in zip(cache_eligibility, authors)
         ]
+
+
+def _refresh_early(cache_key, record: AuthorRecord):
+    """Refreshes an author record that is about to expire
+    
+    Runs on the cache's background refresh thread, in a search context of
+    its own."""
+    with search_context.SearchContext():
+        repository = Repository(can_skip_refresh=True)
+        if is_orcid_id(cache_key):
+            if repository._refresh_author_record(
+                    record, orcid_id=cache_key) is None:
+                repository._query_orcid_id_record(cache_key)
+        else:
+            author = ADSName.parse(cache_key)
+            if repository._refresh_author_record(record, author) is None:
+                repository._query_author_record(author)
+
+
+cache_buddy.set_early_refresh_handler(_refresh_early)
+
+
+def derive_author_record(base_record: AuthorRecord,
+                         author: ADSName) -> AuthorRecord:
+    """Builds the record for a modified name from the unmodified name's record
+    
+    E.g. the record for "=Doe, J." or ">Doe, J." can be built from the record
+    for "Doe, J.", since every document of the former is a document of the
+    latter. Each form in which the base author appears is checked against
+    the modified name, and the documents and coauthor lists are filtered
+    accordingly. No documents need to be loaded."""
+    appears_as = {}
+    documents = set()
+    for alias, bibcodes in base_record.appears_as.items():
+        if author == alias:
+            appears_as[alias] = list(bibcodes)
+            documents.update(bibcodes)
+    
+    coauthors = defaultdict(set)
+    # Forms of the base author's name that don't match the modified name
+    # are coauthors on any selected documents in which they appear
+    for alias, bibcodes in base_record.appears_as.items():
+        if alias not in appears_as:
+            coauthors[alias].update(b for b in bibcodes if b in documents)
+    for coauthor, bibcodes in base_record.coauthors.items():
+        coauthors[coauthor].update(b for b in bibcodes if b in documents)
+    
+    return AuthorRecord(
+        name=author,
+        documents=sorted(documents),
+        appears_as=appears_as,
+        coauthors={k: sorted(v) for k, v in coauthors.items() if len(v)},
+        timestamp=base_record.timestamp)
@@ -4,12 +4,13 @@ Handles preparing data to send to the user's browser
 
 import json
 import time
+from collections import defaultdict
 
 import route_ranker
+import tracing
 from ads_buddy import is_orcid_id
 from log_buddy import lb
 from names.ads_name import ADSName
-from names.name_aware import NameAwareDict
 from path_finder import PathFinder
 from repository import Repository
 
@@ -17,8 +18,15 @@ from repository import Repository
 def to_json(path_finder: PathFinder):
     t_start = time.time()
     
-    scored_chains, doc_data = route_ranker.process_pathfinder(path_finder)
+    with tracing.span("ranking"):
+        scored_chains, doc_data = route_ranker.process_pathfinder(path_finder)
+    lb.on_ranking_timed(time.time() - t_start)
     
+    with tracing.span("jsonify"):
+        return _to_json(path_finder, scored_chains, doc_data, t_start)
+
+
+def _to_json(path_finder: PathFinder, scored_chains, doc_data, t_start):
     # scored_chains is a list. Each item is a tuple containing:
     # 1) The name-match confidence score for a unique authorship chain
     # 2) The chain itself (a list of names)
@@ -79,6 +87,7 @@ def to_json(path_finder: PathFinder):
             'n_names_seen': lb.n_coauthors_seen,
             'n_network_queries': lb.n_network_queries,
             'n_authors_from_ads': lb.n_authors_from_ADS,
+            'n_stale_authors_served': lb.n_stale_authors_served,
             'time_waiting_network': sum(lb.time_waiting_network),
             'total_time': lb.get_search_time() + lb.get_result_prep_time()
         }
@@ -147,6 +156,40 @@ def get_name_as_in_ADS(target_name, names_in_result: []):
     return final_name.full_name
 
 
+def _group_equal_names(names):
+    """Splits names into groups whose members are all equal to each other
+    
+    Name equality isn't transitive (e.g. "Last, Fname" equals both
+    "Last, F. A." and "Last, F. B.", which don't equal each other), so each
+    name joins the first group in which it equals every member. Returns the
+    group of each name."""
+    groups = []
+    # Names can only be equal if they share a last name, directly or through
+    # a synonym, so groups are indexed by their members' last names
+    group_indices_by_last_name = defaultdict(list)
+    names_groups = []
+    for name in names:
+        last_names = {name.last_name}
+        if name.synonym is not None:
+            last_names.add(name.synonym.last_name)
+        candidates = sorted(set(
+            index for last_name in last_names
+            for index in group_indices_by_last_name[last_name]))
+        for index in candidates:
+            if all(name == member for member in groups[index]):
+                break
+        else:
+            index = len(groups)
+            groups.append([])
+        groups[index].append(name)
+        for last_name in last_names:
+            indices = group_indices_by_last_name[last_name]
+            if index not in indices:
+                indices.append(index)
+        names_groups.append(groups[index])
+    return names_groups
+
+
 def graph_translation(chains, source, dest):
     # We have a list of chains---the table in the web view. These chains
     # may contain many different forms of a name, and it's important to
@@ -159,28 +202,25 @@ def graph_translation(chains, source, dest):
     source = ADSName.parse(source)
     dest = ADSName.parse(dest)
     
-    nads = []
+    mappings = []
     for i in range(len(chains[0])):
-        # This dict will map names to canonical forms
-        nad = NameAwareDict()
-        nads.append(nad)
+        names = []
         if i == 0:
-            nad[source] = source
+            names.append(source)
         if i == len(chains[0]) - 1:
-            nad[dest] = dest
+            names.append(dest)
+        # The distinct name forms in the column, in order
+        keys = {}
         for chain in chains:
-            name = ADSName.parse(chain[i])
-            if name in nad:
-                if name.level_of_detail < nad[name].level_of_detail:
-                    nad[name] = name
-            else:
-                nad[name] = name
-    
-    mappings = []
-    for i, nad in enumerate(nads):
-        mapping = {}
-        mappings.append(mapping)
-        for chain in chains:
-            name = chain[i].lower()
-            mapping[name] = nad[name].original_name
+            key = chain[i].lower()
+            if key not in keys:
+                keys[key] = None
+                names.append(ADSName.parse(chain[i]))
+        groups = _group_equal_names(names)[-len(keys):]
+        
+        # Each name is shown as the first of the least-detailed forms in its
+        # group, which it's equal to
+        mappings.append({
+            key: min(group, key=lambda n: n.level_of_detail).original_name
+            for key, group in zip(keys, groups)})
     return mappings
@@ -4,10 +4,12 @@ import string
 from collections import defaultdict
 
 from log_buddy import lb
-from names.ads_name import ADSName
+from names.ads_name import ADSName, NameArray
 from path_finder import PathFinder
 from path_node import PathNode
 from repository import Repository
+import search_context
+import tracing
 
 
 def process_pathfinder(path_finder: PathFinder):
@@ -18,11 +20,14 @@ def process_pathfinder(path_finder: PathFinder):
     doc_data = {}
     lb.set_n_docs_relevant(len(all_bibcodes))
     repo.notify_of_upcoming_document_request(*all_bibcodes)
-    _insert_document_data(pairings, doc_data, repo, path_finder.excluded_names)
-    lb.update_progress_cache(force=True)
+    with tracing.span("load_documents", n_documents=len(all_bibcodes)):
+        _insert_document_data(
+            pairings, doc_data, repo, path_finder.excluded_names)
+    lb.publish_progress()
     
     chains = _build_author_chains(path_finder.src)
-    scored_chains = _rank_author_chains(chains, repo, pairings)
+    with tracing.span("score_chains", n_chains=len(chains)):
+        scored_chains = _rank_author_chains(chains, repo, pairings)
     
     if scored_chains is None:
         # TODO: do better
@@ -99,9 +104,20 @@ def _insert_document_data(pairings, doc_data, repo, excluded_names):
 
 
 # We can't use functools.lru_cache here because of the doc_record and
-# excluded_names arguments, which aren't hashable
-indices_cache = {}
+# excluded_names arguments, which aren't hashable. The results depend on the
+# search's excluded names, so the cache belongs to the search context.
+def _indices_cache():
+    return search_context.current().get('route_ranker_indices', dict)
+
+
+# Each document's author list is parsed once, for all the author pairs
+# which share the document
+def _name_array_cache():
+    return search_context.current().get('route_ranker_name_arrays', dict)
+
+
 def _find_indices(authors, bibcode, author1, author2, excluded_names):
+    indices_cache = _indices_cache()
     key1 = (bibcode, author1.original_name)
     key2 = (bibcode, author2.original_name)
     try:
@@ -113,22 +129,29 @@ def _find_indices(authors, bibcode, author1, author2, excluded_names):
     except KeyError:
         auth_2_idx = None
     
-    for i, author in enumerate(authors):
-        if auth_1_idx is not None and auth_2_idx is not None:
-            break
-        author = ADSName.parse(author)
-        if author in excluded_names:
-            continue
-        if auth_1_idx is None and author1 == author:
-            auth_1_idx = i
-        if auth_2_idx is None and author2 == author:
-            auth_2_idx = i
+    if auth_1_idx is None or auth_2_idx is None:
+        name_array_cache = _name_array_cache()
+        try:
+            name_array = name_array_cache[bibcode]
+        except KeyError:
+            name_array = NameArray(authors)
+            name_array_cache[bibcode] = name_array
+        if auth_1_idx is None:
+            auth_1_idx = _first_or_none(
+                name_array.find_matching_indices(author1, excluded_names))
+        if auth_2_idx is None:
+            auth_2_idx = _first_or_none(
+                name_array.find_matching_indices(author2, excluded_names))
     
     indices_cache[key1] = auth_1_idx
     indices_cache[key2] = auth_2_idx
     return auth_1_idx, auth_2_idx
 
 
+def _first_or_none(indices):
+    return indices[0] if len(indices) else None
+
+
 def _build_author_chains(src: PathNode):
     starter = []
     list_of_chains = []
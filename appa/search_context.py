@@ -0,0 +1,55 @@
+"""
+Per-search state, so that one process can run several searches at once
+
+State which belongs to a single search (its stats counters and progress key,
+its ADS prefetch queue, its pending Firestore batch, etc.) is kept in the
+current SearchContext rather than in module globals. Each module stores its
+own entries, created on first use, e.g.
+`search_context.current().get('ads_buddy', ADS_Buddy)`.
+
+A search runs inside `with SearchContext():`. The context is tracked with a
+ContextVar, so it follows the search into asyncio tasks, and code running
+outside any search (background threads, command-line tools) gets a default
+context of its own thread.
+"""
+import contextvars
+import threading
+
+_current = contextvars.ContextVar('search_context', default=None)
+_thread_defaults = threading.local()
+
+
+class SearchContext:
+    def __init__(self):
+        self._state = {}
+        self._tokens = []
+    
+    def get(self, name, factory):
+        """Returns this context's entry `name`, creating it with `factory()`
+        if it doesn't exist"""
+        try:
+            return self._state[name]
+        except KeyError:
+            return self._state.setdefault(name, factory())
+    
+    def set(self, name, value):
+        self._state[name] = value
+    
+    def __enter__(self):
+        self._tokens.append(_current.set(self))
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current.reset(self._tokens.pop())
+        return False
+
+
+def current() -> SearchContext:
+    context = _current.get()
+    if context is None:
+        try:
+            context = _thread_defaults.context
+        except AttributeError:
+            context = SearchContext()
+            _thread_defaults.context = context
+    return context
@@ -0,0 +1,80 @@
+"""
+Coalesces concurrent identical fetches
+
+When several threads ask a SingleFlight for the same key at once, only the
+first runs the fetch. The rest wait for it to finish and share its result
+(or its exception), so e.g. two searches that both miss the cache for a
+popular author don't both query ADS for it.
+
+Some exceptions belong to the thread which raised them rather than to the
+fetch, e.g. SearchCancelled when the leading thread's search is cancelled.
+Waiters which receive one of a SingleFlight's `retry_on` exceptions try the
+call again, and one of them takes over the fetch.
+"""
+import threading
+
+_instances = []
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name, retry_on=()):
+        self.name = name
+        self.retry_on = retry_on
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.n_calls = 0
+        self.n_coalesced = 0
+        _instances.append(self)
+    
+    def do(self, key, fn, *args, **kwargs):
+        """Returns fn(*args, **kwargs), or the result of an identically-keyed
+        call already in progress on another thread"""
+        with self._lock:
+            self.n_calls += 1
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = _Call()
+                    self._calls[key] = call
+                    is_leader = True
+                else:
+                    self.n_coalesced += 1
+                    is_leader = False
+            if is_leader:
+                break
+            
+            call.done.wait()
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+        
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    def stats(self):
+        with self._lock:
+            return {'n_calls': self.n_calls,
+                    'n_coalesced': self.n_coalesced,
+                    'n_in_flight': len(self._calls)}
+
+
+def coalescing_stats():
+    """Returns each SingleFlight's stats, keyed by its name"""
+    return {instance.name: instance.stats() for instance in _instances}
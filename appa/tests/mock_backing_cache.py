@@ -209,6 +209,9 @@ store_document = MagicMock()
 store_documents = store_document
 
 
+touch_document = MagicMock()
+
+
 def delete_document(*args, **kwargs):
     raise RuntimeError("Should not delete from mock cache")
 
@@ -285,6 +288,7 @@ def load_author(key):
             'coauthors': dict(**coauthors),
             'appears_as': dict(**appears_as),
             'timestamp': TIME,
+            'n_delta_refreshes': 0,
             'version': AUTHOR_VERSION_NUMBER,
         }
     else:
@@ -306,6 +310,13 @@ def load_progress_data(*args, **kwargs):
     raise RuntimeError("Should not load progress from mock cache")
 
 
+store_snapshot = MagicMock()
+
+
+def load_snapshot(key):
+    raise CacheMiss(key)
+
+
 def clear_stale_data(*args, **kwargs):
     pass
 
@@ -1,7 +1,13 @@
+import os
+import tempfile
+import threading
 from unittest import TestCase
+from unittest.mock import patch
 
+import local_config
 import names.ads_name as ads_name
 from names.ads_name import ADSName, InvalidName
+from names.name_aware import NameAwareDict
 
 namesA = [
     "murray",
@@ -214,6 +220,139 @@ class TestADSName(TestCase):
         with self.assertRaises(TypeError):
             ADSName.parse("murray", None)
     
+    def test_parse_many(self):
+        strings = ["murray, stephen s. q.", "Áùthor, ñäme", "murray",
+                   "murray, stephen s. q."]
+        names = ADSName.parse_many(strings)
+        self.assertEqual(len(names), len(strings))
+        for name, string in zip(names, strings):
+            self.assertIs(name, ADSName.parse(string))
+        self.assertIs(names[0], names[-1])
+        
+        name = ADSName.parse("murray")
+        self.assertIs(ADSName.parse_many([name])[0], name)
+        
+        with self.assertRaises(InvalidName):
+            ADSName.parse_many(["murray", ",last"])
+    
+    def test_synonym_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            list_path = os.path.join(directory, "synonyms")
+            index_path = os.path.join(directory, "synonyms.index.json")
+            with open(list_path, 'w') as f:
+                f.write("# comment\n"
+                        "test_synIA, a; test_synIB, a b\n"
+                        "test_synJA, q; test_synJB, q\n")
+            
+            with patch.object(local_config, "name_synonym_lists",
+                              [list_path]), \
+                    patch.object(local_config, "name_synonym_index",
+                                 index_path, create=True):
+                try:
+                    ads_name._name_cache.clear()
+                    ads_name._previous_name_cache.clear()
+                    ads_name._load_synonyms()
+                    self.assertTrue(os.path.exists(index_path))
+                    self.assertEqual(
+                        sorted(ads_name._synonym_entries.keys()),
+                        ["testsynia", "testsynja"])
+                    # Nothing is parsed until a name with that last name is
+                    self.assertEqual(len(ads_name._name_synonyms), 0)
+                    self.assertEqual(ADSName.parse("test_synIA, a"),
+                                     ADSName.parse("test_synIB, a b"))
+                    self.assertEqual(list(ads_name._name_synonyms.keys()),
+                                     ["testsynia"])
+                    
+                    # A current index is loaded rather than recompiled
+                    with patch.object(ads_name, "compile_synonym_index") as c:
+                        ads_name._load_synonyms()
+                        c.assert_not_called()
+                    
+                    # A stale index is rebuilt
+                    with open(list_path, 'a') as f:
+                        f.write("test_synKA, z; test_synKB, z\n")
+                    ads_name._load_synonyms()
+                    self.assertIn("testsynka", ads_name._synonym_entries)
+                    with open(index_path) as f:
+                        self.assertIn("testsynka", f.read())
+                finally:
+                    ads_name._name_cache.clear()
+                    ads_name._previous_name_cache.clear()
+            ads_name._load_synonyms()
+    
+    def test_cache_generations(self):
+        name = ADSName.parse("test_generation, a.")
+        other = ADSName.parse("test_generation, b.")
+        self.assertNotEqual(name, other)
+        
+        stats = ads_name.name_cache_stats(include_names_bytes=True)
+        self.assertGreater(stats['names_bytes'], 0)
+        self.assertGreater(stats['n_equality_entries'], 0)
+        
+        with patch.object(ads_name, "MAXIMUM_INTERNED_NAMES", 0):
+            # Names parsed in the last generation are kept around...
+            ads_name.new_generation()
+            self.assertEqual(ads_name.name_cache_stats()['generation'],
+                             stats['generation'] + 1)
+            self.assertIs(ADSName.parse("test_generation, a."), name)
+            
+            # ...but are dropped if they go unused for a full generation
+            ads_name.new_generation()
+            self.assertIs(ADSName.parse("test_generation, a."), name)
+            self.assertIsNot(ADSName.parse("test_generation, b."), other)
+        
+        # Without crossing the size limit, the generation doesn't advance
+        generation = ads_name.name_cache_stats()['generation']
+        ads_name.new_generation()
+        self.assertEqual(ads_name.name_cache_stats()['generation'], generation)
+    
+    def test_match_key(self):
+        self.assertEqual(ADSName.parse("Murray, Stephen S.").match_key,
+                         ("murray", "s"))
+        self.assertEqual(ADSName.parse(">=Murray, S.").match_key,
+                         ("murray", "s"))
+        self.assertEqual(ADSName.parse("Murray").match_key, ("murray", ""))
+        
+        # Equal names must share a match key, or have no given names
+        for name1 in namesA:
+            name1 = ADSName.parse(name1)
+            for name2 in namesA:
+                name2 = ADSName.parse(name2)
+                if (name1 == name2 and name1.given_names
+                        and name2.given_names):
+                    self.assertEqual(name1.match_key, name2.match_key)
+    
+    def test_find_matching_indices(self):
+        authors = ["Burray, Eva", "Murray, Eric", "Murray", "Murray, S.",
+                   "Murray, Stephen S"]
+        name_array = ads_name.NameArray(authors)
+        
+        def find(name, excluded_names=None):
+            return name_array.find_matching_indices(ADSName.parse(name),
+                                                    excluded_names)
+        
+        self.assertEqual(find("Murray, Eva"), [2])
+        self.assertEqual(find("Murray, E."), [1, 2])
+        self.assertEqual(find("Murray"), [1, 2, 3, 4])
+        self.assertEqual(find("=Murray, S."), [3])
+        self.assertEqual(find(">Murray, S."), [4])
+        self.assertEqual(find("Burray"), [0])
+        self.assertEqual(find("Burray, Q."), [])
+        self.assertEqual(find("Smith"), [])
+        self.assertEqual(find("Murray", ["=Murray", "Murray, Eric"]), [3, 4])
+        
+        # The results must agree with a linear scan
+        for query in namesA:
+            query = ADSName.parse(query)
+            expected = [i for i, name in enumerate(namesA) if query == name]
+            self.assertEqual(ads_name.find_matching_indices(query, namesA),
+                             expected)
+    
+    def test_hash(self):
+        name = ADSName.parse("Murray, Stephen S.")
+        self.assertEqual(hash(name), hash(repr(name)))
+        self.assertEqual(hash(name), hash(name))
+    
     def test_add(self):
         name = ADSName.parse(namesA[-1])
         name_str = str(name)
@@ -311,6 +450,12 @@ class TestADSName(TestCase):
         # Diacritics should be stripped
         self.assertEqual(ADSName.parse("Áùthor, ñäme").full_name,
                          "author, name")
+        self.assertEqual(ADSName.parse("Author, ñäme").full_name,
+                         "author, name")
+        self.assertEqual(ADSName.parse("Áùthor, name").full_name,
+                         "author, name")
+        self.assertEqual(ADSName.parse("Áùthor", "Ñame").full_name,
+                         "author, name")
         
         # Additional commas should be ignored
         self.assertEqual(ADSName.parse("author, first m., jr.").full_name,
@@ -362,6 +507,7 @@ class TestADSName(TestCase):
         ]
         # Hack: inject test synonyms
         ads_name._name_cache.clear()
+        ads_name._previous_name_cache.clear()
         ads_name._parse_name_synonyms(synonyms)
         
         for syn in synonyms:
@@ -421,7 +567,55 @@ class TestADSName(TestCase):
             ADSName.parse("test_synEA, abc d.", preserve=True),
             ADSName.parse("test_synEB, b", preserve=True))
         
+        for syn in synonyms:
+            names = syn.split(';')
+            self.assertEqual(
+                ads_name.find_matching_indices(names[0], ["x", *names]),
+                [1, 2])
+            self.assertEqual(
+                ads_name.find_matching_indices(names[1], ["x", *names]),
+                [1, 2])
+        
         # Remove our test synonyms
         ads_name._name_cache.clear()
+        ads_name._previous_name_cache.clear()
         ads_name._name_synonyms.clear()
         ads_name._load_synonyms()
+    
+    def test_concurrent_synonym_resolution(self):
+        synonyms = [
+            "test_synRA, a; test_synRB, a b",
+            "test_synRA, c; test_synRC, c d",
+        ]
+        ads_name._name_cache.clear()
+        ads_name._previous_name_cache.clear()
+        ads_name._parse_name_synonyms(synonyms)
+        
+        other_thread_results = []
+        other_thread = threading.Thread(
+            target=lambda: other_thread_results.append(
+                ADSName.parse("test_synRA, c").synonym))
+        setitem = NameAwareDict.__setitem__
+        
+        def start_other_thread(nad, key, value):
+            # While the first variant is being filed, another thread parses
+            # the second. It must not see a partly-built set of variants.
+            if not other_thread.is_alive() and not other_thread_results:
+                other_thread.start()
+                other_thread.join(.1)
+            setitem(nad, key, value)
+        
+        try:
+            with patch.object(NameAwareDict, "__setitem__",
+                              start_other_thread):
+                self.assertEqual(ADSName.parse("test_synRA, a").synonym,
+                                 "test_synRB, a b")
+            other_thread.join()
+            self.assertEqual(len(other_thread_results), 1)
+            self.assertIsNotNone(other_thread_results[0])
+            self.assertEqual(other_thread_results[0], "test_synRC, c d")
+        finally:
+            ads_name._name_cache.clear()
+            ads_name._previous_name_cache.clear()
+            ads_name._name_synonyms.clear()
+            ads_name._load_synonyms()
@@ -0,0 +1,47 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+import appa_asgi_backend
+import backend_common
+
+
+def _call(path, query_string=b'', body=b''):
+    scope = {'type': 'http', 'path': path, 'query_string': query_string}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+    
+    async def receive():
+        if len(messages):
+            return messages.pop(0)
+        # The client stays connected
+        await asyncio.Event().wait()
+    
+    async def send(message):
+        sent.append(message)
+    
+    asyncio.run(appa_asgi_backend.app(scope, receive, send))
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+class TestASGIBackend(TestCase):
+    def test_find_route(self):
+        find_route = MagicMock(
+            return_value=('{"a": 1}', 200, backend_common.HEADERS, 'key'))
+        with patch.object(backend_common, "find_route", find_route):
+            status, headers, body = _call(
+                '/find_route', b'src=Author%2C+A.&dest=Author%2C+B.',
+                b'progress_key')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'{"a": 1}')
+        self.assertEqual(headers[b'access-control-allow-origin'], b'*')
+        
+        request = find_route.call_args[0][0]
+        self.assertEqual(request.args.get('src'), 'Author, A.')
+        self.assertEqual(request.args.get('dest'), 'Author, B.')
+        self.assertIsNone(request.args.get('exclusions'))
+        self.assertEqual(request.data.decode(), 'progress_key')
+    
+    def test_unknown_path(self):
+        status, _, _ = _call('/nothing_here')
+        self.assertEqual(status, 404)
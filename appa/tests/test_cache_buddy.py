@@ -0,0 +1,332 @@
+import contextlib
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from cache import cache_buddy
+
+import ads_buddy
+from log_buddy import lb
+from records.author_record import AuthorRecord
+from tests import mock_backing_cache
+
+
+@patch.object(ads_buddy, "requests", MagicMock)
+class TestCacheBuddy(TestCase):
+    def setUp(self):
+        self.real_backing_cache = cache_buddy.backing_cache
+        cache_buddy.backing_cache = mock_backing_cache
+        cache_buddy.flush_writes()
+        mock_backing_cache.store_author.reset_mock()
+        mock_backing_cache.store_document.reset_mock()
+    
+    def tearDown(self):
+        cache_buddy.flush_writes()
+        cache_buddy.backing_cache = self.real_backing_cache
+        cache_buddy._loaded_authors = {}
+        cache_buddy._derived_authors = {}
+        cache_buddy._loaded_documents = {}
+        cache_buddy._author_hits.clear()
+        cache_buddy._saved_author_hits.clear()
+        cache_buddy._document_hits.clear()
+        mock_backing_cache.store_author.reset_mock()
+        mock_backing_cache.store_document.reset_mock()
+    
+    @patch.object(cache_buddy, "WRITE_BEHIND", True)
+    def test_write_behind(self):
+        # Holding this lock keeps the background thread from flushing
+        with cache_buddy._backing_cache_lock:
+            record = AuthorRecord(name='author, q.', documents=['paperAB'])
+            cache_buddy.cache_author(record)
+            
+            mock_backing_cache.store_author.assert_not_called()
+            self.assertIs(cache_buddy.load_author('author, q.'), record)
+            
+            # A second write under the same key replaces the pending write
+            record = AuthorRecord(name='author, q.',
+                                  documents=['paperAB', 'paperAE'])
+            cache_buddy.cache_author(record)
+            self.assertEqual(cache_buddy.pending_write_count(), 1)
+            self.assertEqual(cache_buddy.write_behind_stats()['queue_depth'],
+                             1)
+            
+            n_flushes = cache_buddy.write_behind_stats()['n_flushes']
+            cache_buddy.flush_writes()
+        
+        mock_backing_cache.store_author.assert_called_once()
+        data, key = mock_backing_cache.store_author.call_args[0]
+        self.assertEqual(key, 'author, q.')
+        self.assertEqual(data['documents'], ['paperAB', 'paperAE'])
+        self.assertEqual(data['version'], cache_buddy.AUTHOR_VERSION_NUMBER)
+        
+        stats = cache_buddy.write_behind_stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['n_flushes'], n_flushes + 1)
+    
+    @patch.object(cache_buddy, "WRITE_BEHIND", True)
+    def test_failed_flush_is_retried(self):
+        with cache_buddy._backing_cache_lock:
+            record = AuthorRecord(name='author, q.', documents=['paperAB'])
+            cache_buddy.cache_author(record)
+            mock_backing_cache.store_author.side_effect = RuntimeError
+            try:
+                with self.assertRaises(RuntimeError):
+                    cache_buddy.flush_writes()
+            finally:
+                mock_backing_cache.store_author.side_effect = None
+            self.assertEqual(cache_buddy.pending_write_count(), 1)
+            
+            cache_buddy.flush_writes()
+        self.assertEqual(mock_backing_cache.store_author.call_count, 2)
+        self.assertEqual(cache_buddy.pending_write_count(), 0)
+        
+        # A write that keeps failing is eventually dropped
+        with cache_buddy._backing_cache_lock:
+            cache_buddy.cache_author(record)
+            mock_backing_cache.store_author.side_effect = RuntimeError
+            try:
+                for _ in range(cache_buddy.WRITE_BEHIND_MAX_ATTEMPTS):
+                    with self.assertRaises(RuntimeError):
+                        cache_buddy.flush_writes()
+            finally:
+                mock_backing_cache.store_author.side_effect = None
+            self.assertEqual(cache_buddy.pending_write_count(), 0)
+    
+    def test_failed_document_flush_is_retried(self):
+        stats = cache_buddy.document_write_stats()
+        document = cache_buddy.load_document('paperAB').copy()
+        document.title = 'New title'
+        
+        @contextlib.contextmanager
+        def failing_batch():
+            yield True
+            raise RuntimeError("Commit failed")
+        
+        with cache_buddy._backing_cache_lock:
+            cache_buddy.cache_document(document)
+            # The write is sent, but the batch isn't committed
+            with patch.object(mock_backing_cache, "batch", failing_batch):
+                with self.assertRaises(RuntimeError):
+                    cache_buddy.flush_writes()
+            self.assertEqual(cache_buddy.pending_write_count(), 1)
+            
+            # The failed write isn't taken to have been stored
+            cache_buddy.flush_writes()
+        self.assertEqual(mock_backing_cache.store_document.call_count, 2)
+        new_stats = cache_buddy.document_write_stats()
+        self.assertEqual(new_stats['n_skipped'], stats['n_skipped'])
+        self.assertEqual(new_stats['n_stored'], stats['n_stored'] + 2)
+    
+    def test_flush_batches_by_backing_cache(self):
+        other_cache = MagicMock()
+        with cache_buddy._backing_cache_lock:
+            cache_buddy.cache_author(
+                AuthorRecord(name='author, q.', documents=['paperAB']))
+            with patch.object(cache_buddy, "backing_cache", other_cache):
+                cache_buddy.cache_author(
+                    AuthorRecord(name='author, r.', documents=['paperAB']))
+            cache_buddy.flush_writes()
+        
+        mock_backing_cache.store_author.assert_called_once()
+        self.assertEqual(mock_backing_cache.store_author.call_args[0][1],
+                         'author, q.')
+        # The other cache's write is sent in that cache's own batch
+        other_cache.batch.assert_called_once()
+        other_cache.batch.return_value.__exit__.assert_called_once()
+        other_cache.store_author.assert_called_once()
+        self.assertEqual(other_cache.store_author.call_args[0][1],
+                         'author, r.')
+    
+    @patch.object(cache_buddy, "WRITE_BEHIND", False)
+    def test_write_through(self):
+        document = cache_buddy.load_document('paperAB').copy()
+        document.title = 'New title'
+        cache_buddy.cache_document(document)
+        mock_backing_cache.store_document.assert_called_once()
+        self.assertEqual(cache_buddy.pending_write_count(), 0)
+    
+    @patch.object(cache_buddy, "WRITE_BEHIND", False)
+    def test_document_write_deduplication(self):
+        mock_backing_cache.touch_document.reset_mock()
+        stats = cache_buddy.document_write_stats()
+        
+        # Unchanged content, and the stored copy is fresh
+        document = cache_buddy.load_document('paperAB').copy()
+        cache_buddy.cache_document(document)
+        mock_backing_cache.store_document.assert_not_called()
+        mock_backing_cache.touch_document.assert_not_called()
+        
+        # Unchanged content, and the stored copy still outlives any author
+        # record cached with this document
+        original_timestamp = document.timestamp
+        document = document.copy()
+        document.timestamp += cache_buddy.DOCUMENT_REWRITE_MARGIN
+        cache_buddy.cache_document(document)
+        mock_backing_cache.touch_document.assert_not_called()
+        
+        # Unchanged content, but the stored copy would expire before an
+        # author record cached with this document
+        document = document.copy()
+        document.timestamp = (original_timestamp + 1
+                              + cache_buddy.document_max_age_for('paperAB')
+                              - cache_buddy.MAXIMUM_AUTHOR_LIFETIME)
+        cache_buddy.cache_document(document)
+        mock_backing_cache.store_document.assert_not_called()
+        mock_backing_cache.touch_document.assert_called_once()
+        data, key = mock_backing_cache.touch_document.call_args[0]
+        self.assertEqual(key, 'paperAB')
+        self.assertEqual(data['timestamp'], document.timestamp)
+        self.assertEqual(data['title'], document.title)
+        
+        # Changed counts
+        document = document.copy()
+        document.citation_count += 1
+        cache_buddy.cache_document(document)
+        mock_backing_cache.store_document.assert_called_once()
+        
+        # Changed content
+        document = document.copy()
+        document.title = 'New title'
+        cache_buddy.cache_document(document)
+        self.assertEqual(mock_backing_cache.store_document.call_count, 2)
+        
+        new_stats = cache_buddy.document_write_stats()
+        self.assertEqual(new_stats['n_skipped'], stats['n_skipped'] + 2)
+        self.assertEqual(new_stats['n_timestamps_refreshed'],
+                         stats['n_timestamps_refreshed'] + 1)
+        self.assertEqual(new_stats['n_stored'], stats['n_stored'] + 2)
+    
+    def test_snapshot(self):
+        cache_buddy._document_hits.clear()
+        author = cache_buddy.load_author('author, a.')
+        document = cache_buddy.load_document('paperAB')
+        cache_buddy.load_document('paperAB')
+        self.assertEqual(cache_buddy._document_hits['paperAB'], 2)
+        
+        data = cache_buddy.build_snapshot()
+        cache_buddy._loaded_authors = {}
+        cache_buddy._loaded_documents = {}
+        
+        with patch.object(mock_backing_cache, "load_snapshot",
+                          MagicMock(return_value=data)):
+            n_authors, n_documents, n_names = cache_buddy.load_snapshot()
+        self.assertEqual(n_authors, 1)
+        self.assertEqual(n_documents, 1)
+        self.assertGreater(n_names, 0)
+        
+        self.assertEqual(cache_buddy._loaded_authors['author, a.'], author)
+        self.assertEqual(cache_buddy._loaded_documents['paperAB'], document)
+        
+        # Without a saved snapshot, nothing is loaded
+        self.assertEqual(cache_buddy.load_snapshot(), (0, 0, 0))
+    
+    def test_save_snapshot_if_due(self):
+        mock_backing_cache.store_snapshot.reset_mock()
+        with patch.object(cache_buddy, "_last_snapshot_time", time.time()):
+            cache_buddy.save_snapshot_if_due()
+            mock_backing_cache.store_snapshot.assert_not_called()
+        with patch.object(cache_buddy, "_last_snapshot_time", 0):
+            thread = cache_buddy.save_snapshot_if_due()
+            thread.join()
+            mock_backing_cache.store_snapshot.assert_called_once()
+            self.assertEqual(mock_backing_cache.store_snapshot.call_args[0][1],
+                             cache_buddy.SNAPSHOT_KEY)
+    
+    def test_snapshot_merges_author_hits(self):
+        # Another instance's counts are in the saved snapshot
+        data = cache_buddy.build_snapshot({'author, a.': 5, 'author, b.': 1})
+        cache_buddy._author_hits.update({'author, a.': 2, 'author, c.': 3})
+        with patch.object(mock_backing_cache, "load_snapshot",
+                          MagicMock(return_value=data)):
+            cache_buddy.save_snapshot()
+            data = mock_backing_cache.store_snapshot.call_args[0][0]
+        with patch.object(mock_backing_cache, "load_snapshot",
+                          MagicMock(return_value=data)):
+            self.assertEqual(cache_buddy.popular_authors(),
+                             {'author, a.': 7, 'author, b.': 1,
+                              'author, c.': 3})
+            
+            # Only requests since the last save are added again
+            cache_buddy._author_hits['author, c.'] += 1
+            cache_buddy.save_snapshot()
+            data = mock_backing_cache.store_snapshot.call_args[0][0]
+        with patch.object(mock_backing_cache, "load_snapshot",
+                          MagicMock(return_value=data)):
+            self.assertEqual(cache_buddy.popular_authors(),
+                             {'author, a.': 7, 'author, b.': 1,
+                              'author, c.': 4})
+    
+    def test_max_age_for(self):
+        max_ages = [cache_buddy.max_age_for(f'author{i}, a.')
+                    for i in range(100)]
+        for max_age in max_ages:
+            self.assertLessEqual(max_age, cache_buddy.MAXIMUM_AGE)
+            self.assertGreaterEqual(
+                max_age,
+                cache_buddy.MAXIMUM_AGE - cache_buddy.MAXIMUM_AGE_JITTER)
+        # Expiry times are spread out, but fixed for each key
+        self.assertGreater(len(set(max_ages)), 90)
+        self.assertEqual(max_ages[0], cache_buddy.max_age_for('author0, a.'))
+        
+        # Documents outlive the author records cached along with them
+        for i in range(100):
+            self.assertGreaterEqual(
+                cache_buddy.document_max_age_for(f'paper{i}'),
+                cache_buddy.MAXIMUM_AUTHOR_LIFETIME
+                + cache_buddy.DOCUMENT_REWRITE_MARGIN)
+    
+    @patch.object(cache_buddy, "EARLY_REFRESH", True)
+    def test_early_refresh(self):
+        refreshed = threading.Event()
+        handler = MagicMock(side_effect=lambda *args: refreshed.set())
+        previous_handler = cache_buddy._early_refresh_handler
+        cache_buddy.set_early_refresh_handler(handler)
+        max_age = cache_buddy.max_age_for('author, a.')
+        record = cache_buddy.load_author('author, a.')
+        try:
+            # A fresh record is never refreshed early
+            with patch.object(cache_buddy.random, "random",
+                              MagicMock(return_value=0)):
+                cache_buddy.load_author('author, a.')
+            handler.assert_not_called()
+            
+            record.timestamp = time.time() - max_age + 60
+            # Near expiry, a refresh becomes likely, but isn't certain
+            with patch.object(cache_buddy.random, "random",
+                              MagicMock(return_value=1)):
+                self.assertIs(cache_buddy.load_author('author, a.'), record)
+            handler.assert_not_called()
+            with patch.object(cache_buddy.random, "random",
+                              MagicMock(return_value=0.99)):
+                self.assertIs(cache_buddy.load_author('author, a.'), record)
+            self.assertTrue(refreshed.wait(5))
+            handler.assert_called_once_with('author, a.', record)
+        finally:
+            cache_buddy.set_early_refresh_handler(previous_handler)
+        
+        first_bin = cache_buddy.EXPIRY_HISTOGRAM_BINS[0]
+        self.assertEqual(cache_buddy.expiry_histogram()[first_bin], 1)
+    
+    @patch.object(cache_buddy, "STALE_GRACE_PERIOD", 24 * 60 * 60)
+    def test_serve_stale(self):
+        refreshed = threading.Event()
+        handler = MagicMock(side_effect=lambda *args: refreshed.set())
+        previous_handler = cache_buddy._early_refresh_handler
+        cache_buddy.set_early_refresh_handler(handler)
+        max_age = cache_buddy.max_age_for('author, a.')
+        record = cache_buddy.load_author('author, a.')
+        record.timestamp = time.time() - max_age - 60
+        n_served = lb.n_stale_authors_served
+        try:
+            self.assertIs(cache_buddy.load_author('author, a.'), record)
+            self.assertTrue(refreshed.wait(5))
+            handler.assert_called_once_with('author, a.', record)
+            self.assertEqual(lb.n_stale_authors_served, n_served + 1)
+            
+            # Past the grace period, the record must be refreshed first
+            record.timestamp -= cache_buddy.STALE_GRACE_PERIOD
+            with self.assertRaises(cache_buddy.StaleCacheData):
+                cache_buddy.load_author('author, a.')
+        finally:
+            cache_buddy.set_early_refresh_handler(previous_handler)
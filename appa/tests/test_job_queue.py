@@ -0,0 +1,74 @@
+import json
+import threading
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from cache import cache_buddy
+
+import backend_common
+import job_queue
+from job_queue import JobQueue
+
+
+class _Request:
+    def __init__(self, args, data=b''):
+        self.args = args
+        self.data = data
+
+
+class TestJobQueue(TestCase):
+    def test_deduplication(self):
+        jobs = JobQueue(n_workers=2)
+        release = threading.Event()
+        fn = MagicMock(side_effect=lambda x: release.wait(5) and x * 2)
+        
+        job = jobs.submit('a', fn, 2)
+        self.assertIs(jobs.submit('a', fn, 2), job)
+        other_job = jobs.submit('b', fn, 3)
+        self.assertIsNot(other_job, job)
+        release.set()
+        self.assertTrue(job.done.wait(5))
+        self.assertTrue(other_job.done.wait(5))
+        
+        self.assertEqual(job.status, job_queue.DONE)
+        self.assertEqual(job.result, 4)
+        self.assertEqual(other_job.result, 6)
+        self.assertEqual(fn.call_count, 2)
+        self.assertEqual(jobs.stats()['n_deduplicated'], 1)
+        
+        # A finished job is run again if resubmitted
+        self.assertIsNot(jobs.submit('a', fn, 2), job)
+    
+    def test_failure(self):
+        jobs = JobQueue(n_workers=1)
+        job = jobs.submit('a', MagicMock(side_effect=ValueError))
+        self.assertTrue(job.done.wait(5))
+        self.assertEqual(job.status, job_queue.FAILED)
+    
+    def test_submit_and_poll(self):
+        jobs = JobQueue(n_workers=1)
+        release = threading.Event()
+        
+        def find_route(request):
+            release.wait(5)
+            return ('{"result": 1}', 200, backend_common.HEADERS,
+                    request.args['src'])
+        
+        request = _Request({'src': 'Author, A.', 'dest': 'Author, B.'})
+        with patch.object(backend_common, "find_route", find_route), \
+                patch.object(cache_buddy, "result_is_in_cache",
+                             MagicMock(return_value=False)), \
+                patch.object(cache_buddy, "generate_result_cache_key",
+                             MagicMock(return_value='key')):
+            data, _, _ = backend_common.submit_route(request, jobs)
+            self.assertEqual(json.loads(data), {"job_key": "key"})
+            
+            data, _, _ = backend_common.poll_route(
+                _Request({'key': 'key'}), jobs)
+            self.assertEqual(json.loads(data)['job_key'], 'key')
+            
+            release.set()
+            self.assertTrue(jobs.get('key').done.wait(5))
+            data, _, _ = backend_common.poll_route(
+                _Request({'key': 'key'}), jobs)
+            self.assertEqual(data, '{"result": 1}')
@@ -0,0 +1,97 @@
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from cache import cache_buddy
+
+import log_buddy
+from log_buddy import LogBuddy, ProgressPublisher
+from records.progress_record import ProgressRecord
+
+
+class TestProgressPublisher(TestCase):
+    def test_publishing(self):
+        store = MagicMock()
+        publisher = ProgressPublisher(interval=.01)
+        with patch.object(log_buddy, "_progress_publisher", publisher), \
+                patch.object(cache_buddy, "cache_progress_data", store):
+            buddy = LogBuddy()
+            buddy.set_progress_key('key')
+            for _ in range(100):
+                if store.call_count:
+                    break
+                time.sleep(.01)
+            self.assertEqual(store.call_count, 1)
+            
+            # Counting progress doesn't store anything itself. (Holding this
+            # lock keeps the publisher from sampling the counters.)
+            with publisher._lock:
+                buddy.on_author_queried(3)
+                buddy.on_doc_queried(10)
+                n_stores = store.call_count
+                time.sleep(.05)
+                self.assertEqual(store.call_count, n_stores)
+            
+            for _ in range(100):
+                record, key = store.call_args[0]
+                if record.n_docs_queried == 10:
+                    break
+                time.sleep(.01)
+            self.assertEqual(key, 'key')
+            self.assertEqual(record.n_authors_queried, 3)
+            self.assertEqual(record.n_docs_queried, 10)
+            
+            # Unchanged progress isn't stored again
+            n_stores = store.call_count
+            time.sleep(.05)
+            self.assertEqual(store.call_count, n_stores)
+            
+            buddy.on_stop_path_finding()
+            for _ in range(100):
+                if store.call_args[0][0].path_finding_complete:
+                    break
+                time.sleep(.01)
+            self.assertTrue(store.call_args[0][0].path_finding_complete)
+            
+            # Once the key is cleared, the LogBuddy is no longer watched
+            buddy.reset_stats()
+            time.sleep(.05)
+            self.assertEqual(len(publisher._watched), 0)
+    
+    def test_sampling_continues_during_explicit_publishes(self):
+        store = MagicMock()
+        publisher = ProgressPublisher(interval=.05)
+        stop = threading.Event()
+        
+        def publish_explicitly():
+            n = 0
+            while not stop.is_set():
+                n += 1
+                publisher.publish(
+                    'other', ProgressRecord(n, 0, 0, 0, 0, False))
+                time.sleep(.005)
+        
+        thread = threading.Thread(target=publish_explicitly)
+        with patch.object(log_buddy, "_progress_publisher", publisher), \
+                patch.object(cache_buddy, "cache_progress_data", store):
+            try:
+                buddy = LogBuddy()
+                buddy.set_progress_key('key')
+                thread.start()
+                buddy.on_doc_queried(10)
+                # Explicit publishes arrive more often than the sampling
+                # interval, but the watched LogBuddy is still sampled
+                deadline = time.monotonic() + 5
+                sampled = False
+                while not sampled and time.monotonic() < deadline:
+                    sampled = any(
+                        call[0][1] == 'key' and call[0][0].n_docs_queried
+                        for call in store.call_args_list)
+                    time.sleep(.01)
+                self.assertTrue(sampled)
+            finally:
+                stop.set()
+                if thread.is_alive():
+                    thread.join()
+                buddy.reset_stats()
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import metrics
+from log_buddy import LogBuddy
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.log_buddy = LogBuddy()
+        self.log_buddy.on_network_complete(.3)
+        self.log_buddy.on_network_complete(1.5)
+        self.log_buddy.on_author_load_timed(.02)
+        self.log_buddy.on_author_queried(4)
+        self.log_buddy.on_frontier_expanded(1)
+        self.log_buddy.on_frontier_expanded(30)
+    
+    def test_search_metrics(self):
+        search_metrics = metrics.SearchMetrics.from_log_buddy(self.log_buddy)
+        self.assertEqual(search_metrics.counters['ads_queries'], 2)
+        self.assertEqual(search_metrics.counters['authors_queried'], 4)
+        self.assertEqual(search_metrics.observations['frontier_size'],
+                         [1, 30])
+        # The search never finished
+        self.assertEqual(search_metrics.observations['search_seconds'], [])
+    
+    def test_prometheus(self):
+        exporter = metrics.PrometheusExporter()
+        for _ in range(2):
+            exporter.export(
+                metrics.SearchMetrics.from_log_buddy(self.log_buddy))
+        text = exporter.render()
+        self.assertIn("appa_searches_total 2\n", text)
+        self.assertIn("appa_ads_queries_total 4\n", text)
+        self.assertIn('appa_network_latency_seconds_bucket{le="0.5"} 2\n',
+                      text)
+        self.assertIn('appa_network_latency_seconds_bucket{le="+Inf"} 4\n',
+                      text)
+        self.assertIn("appa_frontier_size_count 4\n", text)
+        
+        histogram = exporter.histograms['network_latency_seconds']
+        self.assertEqual(histogram.quantile(.5), .5)
+        self.assertEqual(histogram.quantile(.99), 2.5)
+    
+    def test_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "metrics.jsonl")
+            exporter = metrics.JSONLinesExporter(path)
+            metrics.add_exporter(exporter)
+            try:
+                metrics.export_search(self.log_buddy)
+                metrics.export_search(self.log_buddy)
+            finally:
+                metrics.remove_exporter(exporter)
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['observations']['network_latency_seconds'],
+                         [.3, 1.5])
@@ -195,6 +195,7 @@ class TestNameAwareDict(TestCase):
         ]
         # Hack: inject test synonyms
         ads_name._name_cache.clear()
+        ads_name._previous_name_cache.clear()
         ads_name._parse_name_synonyms(synonyms)
         
         for synonym in synonyms:
@@ -310,6 +311,7 @@ class TestNameAwareDict(TestCase):
         
         # Remove our test synonyms
         ads_name._name_cache.clear()
+        ads_name._previous_name_cache.clear()
         ads_name._name_synonyms.clear()
         ads_name._load_synonyms()
 
@@ -381,6 +383,7 @@ class TestNameAwareSet(TestCase):
         ]
         # Hack: inject test synonyms
         ads_name._name_cache.clear()
+        ads_name._previous_name_cache.clear()
         ads_name._parse_name_synonyms(synonyms)
 
         nas = NameAwareSet()
@@ -392,5 +395,6 @@ class TestNameAwareSet(TestCase):
     
         # Remove our test synonyms
         ads_name._name_cache.clear()
+        ads_name._previous_name_cache.clear()
         ads_name._name_synonyms.clear()
         ads_name._load_synonyms()
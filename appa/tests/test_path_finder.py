@@ -1,11 +1,15 @@
+import time
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 from cache import cache_buddy
 
 import ads_buddy
+import cancellation
 import path_finder
+import search_context
 import tests.mock_backing_cache as mock_backing_cache
+from cancellation import CancellationToken, SearchCancelled
 from log_buddy import lb
 
 
@@ -18,6 +22,7 @@ class TestPathFinder(TestCase):
     def tearDown(self):
         cache_buddy.backing_cache = self.real_backing_cache
         cache_buddy._loaded_authors = {}
+        cache_buddy._derived_authors = {}
         cache_buddy._loaded_documents = {}
         lb.reset_stats()
 
@@ -673,6 +678,35 @@ class TestPathFinder(TestCase):
         with self.assertRaises(path_finder.PathFinderError) as cm:
             path_finder.PathFinder("author, b.", "author, bbb")
         self.assertEqual(cm.exception.key, "src_is_dest")
+    
+    def test_cancellation(self):
+        with search_context.SearchContext():
+            pf = path_finder.PathFinder("Author, K", "Author, H", [])
+            token = CancellationToken()
+            token.cancel()
+            with self.assertRaises(SearchCancelled) as cm:
+                pf.find_path(token)
+            self.assertEqual(cm.exception.key, "search_cancelled")
+            self.assertEqual(pf.n_iterations, 0)
+        
+        with search_context.SearchContext():
+            pf = path_finder.PathFinder("Author, K", "Author, H", [])
+            with self.assertRaises(SearchCancelled) as cm:
+                pf.find_path(CancellationToken(timeout=-1))
+            self.assertEqual(cm.exception.key, "search_timeout")
+        
+        with search_context.SearchContext():
+            pf = path_finder.PathFinder("Author, K", "Author, H", [])
+            token = CancellationToken(timeout=60)
+            pf.find_path(token)
+            # Once a path is found, the deadline passing doesn't stop the
+            # search from finishing, but cancelling it still does
+            token.deadline = time.time() - 1
+            cancellation.check()
+            token.cancel()
+            with self.assertRaises(SearchCancelled) as cm:
+                cancellation.check()
+            self.assertEqual(cm.exception.key, "search_cancelled")
 
 
 def set_of_nodes_to_names(set):
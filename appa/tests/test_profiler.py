@@ -0,0 +1,40 @@
+import json
+import time
+from unittest import TestCase
+
+import profiler
+
+
+def _busy_loop(seconds):
+    t_stop = time.perf_counter() + seconds
+    while time.perf_counter() < t_stop:
+        pass
+
+
+class TestProfiler(TestCase):
+    def test_profile_busy_loop(self):
+        with profiler.SamplingProfiler(interval=.001) as prof:
+            _busy_loop(.1)
+        
+        self.assertGreater(prof.n_samples, 0)
+        lines = prof.folded_stacks().splitlines()
+        self.assertEqual(sum(int(line.rsplit(" ", 1)[1]) for line in lines),
+                         prof.n_samples)
+        # The busy loop is the innermost frame of most samples
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertTrue(stack.endswith("tests/test_profiler.py:_busy_loop"))
+        self.assertGreater(int(count), prof.n_samples / 2)
+        
+        # Samples are attributed to the innermost APPA frame
+        times = prof.component_times()
+        self.assertEqual(next(iter(times)), "tests")
+        self.assertAlmostEqual(sum(times.values()),
+                               prof.n_samples * prof.interval)
+        self.assertIn("tests", prof.summary())
+    
+    def test_components(self):
+        self.assertEqual(profiler._component(_busy_loop.__code__), "tests")
+        self.assertEqual(
+            profiler._component(profiler.SamplingProfiler.stop.__code__),
+            "profiler")
+        self.assertIsNone(profiler._component(json.dumps.__code__))
@@ -25,6 +25,7 @@ class TestRecordCompression(TestCase):
         cache_buddy.backing_cache = self.real_backing_cache
         self.real_backing_cache = None
         cache_buddy._loaded_authors = {}
+        cache_buddy._derived_authors = {}
         cache_buddy._loaded_documents = {}
     
     def test_author_record_compression(self):
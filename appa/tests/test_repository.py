@@ -1,10 +1,17 @@
+import threading
+import time
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 from cache import cache_buddy
 
 import ads_buddy
-from repository import Repository
+import repository
+import search_context
+from cancellation import CancellationToken, SearchCancelled
+from records.author_record import AuthorRecord
+from records.document_record import DocumentRecord
+from repository import MAXIMUM_DELTA_REFRESHES, Repository
 from tests import mock_backing_cache
 
 
@@ -14,11 +21,13 @@ class TestRepository(TestCase):
         self.real_backing_cache = cache_buddy.backing_cache
         cache_buddy.backing_cache = mock_backing_cache
         self.repository = Repository()
+        cache_buddy.flush_writes()
         mock_backing_cache.store_author.reset_mock()
     
     def tearDown(self):
         cache_buddy.backing_cache = self.real_backing_cache
         cache_buddy._loaded_authors = {}
+        cache_buddy._derived_authors = {}
         cache_buddy._loaded_documents = {}
         mock_backing_cache.store_author.reset_mock()
     
@@ -39,36 +48,250 @@ class TestRepository(TestCase):
                          mock_backing_cache.documents['paperAB'])
     
     def test_author_record_generation(self):
-        record = self.repository.get_author_record('>author, a.')
+        # The base record is loaded first, so that we can check that
+        # generating records doesn't require loading any documents
+        self.repository.get_author_record('author, a.')
+        
+        with patch.object(cache_buddy, "load_documents") as load_documents:
+            record = self.repository.get_author_record('>author, a.')
+        load_documents.assert_not_called()
         self.assertEqual(len(record.documents), 3)
         self.assertEqual(record.documents[0], 'paperAB2')
         self.assertEqual(record.documents[1], 'paperAE')
         self.assertEqual(record.documents[2], 'paperAK')
-        
-        mock_backing_cache.store_author.assert_called_once()
-        cached_record = mock_backing_cache.store_author.call_args[0][0]
-        self.assertEqual(cached_record['name'], '>author, a.')
-        self.assertEqual(cached_record['documents'], record.documents)
-        mock_backing_cache.store_author.reset_mock()
+        self._check_generated_record(record)
         
         record = self.repository.get_author_record('=author, a.')
         
         self.assertEqual(len(record.documents), 1)
         self.assertEqual(sorted(record.documents)[0], 'paperAB')
-        
-        mock_backing_cache.store_author.assert_called_once()
-        cached_record = mock_backing_cache.store_author.call_args[0][0]
-        self.assertEqual(cached_record['name'], '=author, a.')
-        self.assertEqual(cached_record['documents'], record.documents)
-        mock_backing_cache.store_author.reset_mock()
+        self._check_generated_record(record)
         
         record = self.repository.get_author_record('<author, aa')
         
         self.assertEqual(len(record.documents), 1)
         self.assertEqual(sorted(record.documents)[0], 'paperAB')
+        self._check_generated_record(record)
+    
+    def _check_generated_record(self, record):
+        # Generated records are held in memory only
+        cache_buddy.flush_writes()
+        mock_backing_cache.store_author.assert_not_called()
+        self.assertIs(
+            cache_buddy.load_author(record.name.qualified_full_name),
+            record)
         
-        mock_backing_cache.store_author.assert_called_once()
-        cached_record = mock_backing_cache.store_author.call_args[0][0]
-        self.assertEqual(cached_record['name'], '<author, aa')
-        self.assertEqual(cached_record['documents'], record.documents)
-        mock_backing_cache.store_author.reset_mock()
+        # The coauthor lists should match those built from the documents
+        expected = AuthorRecord(name=record.name,
+                                documents=list(record.documents))
+        self.repository._fill_in_coauthors(expected)
+        self.assertEqual(record.coauthors, expected.coauthors)
+        self.assertEqual(record.appears_as, expected.appears_as)
+    
+    def test_derived_record_expires_with_base(self):
+        base_record = self.repository.get_author_record('author, a.')
+        record = self.repository.get_author_record('=author, a.')
+        self.assertIs(self.repository.get_author_record('=author, a.'),
+                      record)
+        
+        # Once the base record expires, the modified name's record is
+        # derived again from the refreshed base record, without querying ADS
+        # for the modified name
+        base_record.timestamp -= (cache_buddy.MAXIMUM_AGE
+                                  + cache_buddy.STALE_GRACE_PERIOD + 10)
+        with patch.object(self.repository.ads_buddy,
+                          "get_papers_for_author") as get_papers:
+            rederived = self.repository.get_author_record('=author, a.')
+        get_papers.assert_not_called()
+        self.assertIsNot(rederived, record)
+        self.assertEqual(rederived.documents, record.documents)
+        self.assertEqual(rederived.timestamp,
+                         cache_buddy.load_author('author, a.').timestamp)
+        self.assertGreater(rederived.timestamp, base_record.timestamp)
+        cache_buddy.flush_writes()
+        mock_backing_cache.store_author.assert_not_called()
+    
+    def test_delta_refresh(self):
+        record = self.repository.get_author_record('author, a.')
+        record.timestamp -= cache_buddy.MAXIMUM_AGE + 10
+        
+        new_document = DocumentRecord(
+            bibcode='paperAZ', title='Paper Linking A & Z',
+            authors=['Author, Aaa', 'Author, Z.'], affils=['', ''],
+            doctype='article', keywords=[], publication='mock',
+            pubdate='never', citation_count=0, read_count=0,
+            orcid_ids=['', ''], orcid_id_src=[0, 0])
+        get_papers = MagicMock(return_value=(
+            AuthorRecord(name='author, a.', documents=['paperAZ']),
+            [new_document]))
+        with patch.object(self.repository.ads_buddy,
+                          "get_papers_for_author", get_papers):
+            refreshed = self.repository.get_author_record('author, a.')
+        
+        self.assertEqual(get_papers.call_args[1]['entered_since'],
+                         record.timestamp)
+        self.assertEqual(refreshed.documents,
+                         sorted(record.documents + ['paperAZ']))
+        self.assertEqual(refreshed.coauthors['Author, Z.'], ['paperAZ'])
+        self.assertEqual(refreshed.coauthors['Author, Bbb'],
+                         record.coauthors['Author, Bbb'])
+        self.assertEqual(refreshed.appears_as['Author, Aaa'],
+                         sorted(record.appears_as['Author, Aaa']
+                                + ['paperAZ']))
+        self.assertEqual(refreshed.n_delta_refreshes, 1)
+        self.assertIs(cache_buddy.load_author('author, a.'), refreshed)
+        
+        # After enough delta refreshes, a full query is done
+        refreshed.timestamp -= cache_buddy.MAXIMUM_AGE + 10
+        refreshed.n_delta_refreshes = MAXIMUM_DELTA_REFRESHES
+        with patch.object(self.repository, "_query_author_record",
+                          MagicMock(return_value=record)) as query:
+            self.assertIs(self.repository.get_author_record('author, a.'),
+                          record)
+        query.assert_called_once()
+    
+    def test_delta_refresh_with_expired_documents(self):
+        record = self.repository.get_author_record('author, a.')
+        record.timestamp -= cache_buddy.MAXIMUM_AGE + 10
+        # The record's documents expired along with it
+        cache_buddy._loaded_documents = {}
+        documents = dict(mock_backing_cache.documents)
+        documents['paperAB'] = {**documents['paperAB'], 'timestamp': 0}
+        
+        get_papers = MagicMock()
+        with patch.object(mock_backing_cache, "documents", documents), \
+                patch.object(mock_backing_cache, "delete_document"), \
+                patch.object(self.repository.ads_buddy,
+                             "get_papers_for_author", get_papers), \
+                patch.object(self.repository, "_query_author_record",
+                             MagicMock(return_value=record)) as query:
+            self.repository.get_author_record('author, a.')
+        # Rather than loading each document separately, a full query is done
+        get_papers.assert_not_called()
+        query.assert_called_once()
+    
+    def test_delta_refresh_revalidates_documents(self):
+        record = self.repository.get_author_record('author, a.')
+        record.timestamp -= cache_buddy.MAXIMUM_AGE + 10
+        # The documents are still cached, and will outlive the refreshed
+        # record's maximum age, but not its stale grace period
+        lifetime = (cache_buddy.max_age_for('author, a.')
+                    + cache_buddy.STALE_GRACE_PERIOD)
+        for bibcode in record.documents:
+            document = cache_buddy.load_document(bibcode)
+            document.timestamp = int(
+                time.time() + lifetime - 60
+                - cache_buddy.document_max_age_for(bibcode))
+        
+        get_papers = MagicMock(return_value=(
+            AuthorRecord(name='author, a.', documents=[]), []))
+        mock_backing_cache.touch_document.reset_mock()
+        with patch.object(self.repository.ads_buddy,
+                          "get_papers_for_author", get_papers):
+            refreshed = self.repository.get_author_record('author, a.')
+        cache_buddy.flush_writes()
+        get_papers.assert_called_once()
+        self.assertEqual(
+            sorted(call[0][1] for call in
+                   mock_backing_cache.touch_document.call_args_list),
+            sorted(record.documents))
+        for bibcode in record.documents:
+            document = cache_buddy.load_document(bibcode)
+            self.assertGreater(
+                document.timestamp
+                + cache_buddy.document_max_age_for(bibcode),
+                refreshed.timestamp + lifetime)
+    
+    def test_prewarm_author_records(self):
+        record_a = self.repository.get_author_record('author, a.')
+        record_b = self.repository.get_author_record('author, b.')
+        fresh = self.repository.get_author_record('author, c.')
+        # One record will expire soon, and one has already expired
+        record_a.timestamp -= cache_buddy.MAXIMUM_AGE - 60
+        record_b.timestamp -= cache_buddy.MAXIMUM_AGE + 60
+        
+        get_papers = MagicMock(wraps=lambda names, entered_since: (
+            {name: AuthorRecord(name=name, documents=[]) for name in names},
+            []))
+        with patch.object(self.repository.ads_buddy,
+                          "get_papers_for_authors", get_papers), \
+                patch.object(self.repository, "_query_author_record") as q:
+            n_refreshed = self.repository.prewarm_author_records(
+                ['author, a.', 'author, b.', 'author, c.'], 3600)
+        
+        self.assertEqual(n_refreshed, 2)
+        # Both refreshes are done in a single query
+        get_papers.assert_called_once()
+        self.assertEqual(get_papers.call_args[0][0],
+                         ['author, a.', 'author, b.'])
+        self.assertEqual(get_papers.call_args[1]['entered_since'],
+                         record_b.timestamp)
+        q.assert_not_called()
+        
+        refreshed = cache_buddy.load_author('author, a.')
+        self.assertEqual(refreshed.documents, record_a.documents)
+        self.assertEqual(refreshed.n_delta_refreshes, 1)
+        self.assertIs(cache_buddy.load_author('author, c.'), fresh)
+    
+    def test_fill_in_coauthors_batch(self):
+        names = ['author, a.', 'author, b.', 'author, c.']
+        expected = [self.repository.get_author_record(name) for name in names]
+        
+        records = [AuthorRecord(name=name, documents=list(rec.documents))
+                   for name, rec in zip(names, expected)]
+        self.repository._fill_in_coauthors(*records)
+        for record, expected_record in zip(records, expected):
+            self.assertEqual(record.coauthors, expected_record.coauthors)
+            self.assertEqual(record.appears_as, expected_record.appears_as)
+    
+    def test_cancelled_fetch_is_taken_over(self):
+        # The first search to miss the cache leads the fetch, and is
+        # cancelled while the second search waits for it
+        leader_started = threading.Event()
+        release_leader = threading.Event()
+        
+        def try_generating(author):
+            leader_started.set()
+            release_leader.wait(5)
+            return None
+        
+        leader_token = CancellationToken()
+        results = {}
+        
+        def search(name, token):
+            with search_context.SearchContext() as context:
+                context.set('cancellation', token)
+                try:
+                    results[name] = self.repository.get_author_record(
+                        '=author, a.')
+                except SearchCancelled as e:
+                    results[name] = e
+        
+        fetches = repository._author_fetches
+        n_coalesced = fetches.stats()['n_coalesced']
+        with patch.object(self.repository, "_try_generating_author_record",
+                          try_generating), \
+                patch.object(ads_buddy.ADS_Buddy, "_do_query_for_author",
+                             MagicMock(return_value=[])) as query:
+            leader = threading.Thread(target=search,
+                                      args=('leader', leader_token))
+            leader.start()
+            self.assertTrue(leader_started.wait(5))
+            waiter = threading.Thread(target=search,
+                                      args=('waiter', CancellationToken()))
+            waiter.start()
+            # Wait until the waiter has joined the leader's fetch
+            deadline = time.monotonic() + 5
+            while (fetches.stats()['n_coalesced'] < n_coalesced + 1
+                   and time.monotonic() < deadline):
+                time.sleep(.001)
+            self.assertEqual(fetches.stats()['n_coalesced'], n_coalesced + 1)
+            leader_token.cancel()
+            release_leader.set()
+            leader.join(5)
+            waiter.join(5)
+        
+        self.assertIsInstance(results['leader'], SearchCancelled)
+        self.assertIsInstance(results['waiter'], AuthorRecord)
+        self.assertEqual(results['waiter'].name, '=author, a.')
+        query.assert_called_once()
@@ -0,0 +1,40 @@
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from cache import cache_buddy
+
+import ads_buddy
+from route_jsonifyer import graph_translation
+from tests import mock_backing_cache
+
+
+@patch.object(ads_buddy, "requests", MagicMock)
+class TestRouteJsonifyer(TestCase):
+    def setUp(self):
+        self.real_backing_cache = cache_buddy.backing_cache
+        cache_buddy.backing_cache = mock_backing_cache
+    
+    def tearDown(self):
+        cache_buddy.backing_cache = self.real_backing_cache
+        cache_buddy._loaded_authors = {}
+        cache_buddy._derived_authors = {}
+        cache_buddy._loaded_documents = {}
+    
+    def test_graph_translation(self):
+        chains = [
+            ["Author, A.", "Wang, Rahul S. J.", "Author, B."],
+            ["Author, A.", "Wang, Rahul", "Author, B."],
+            ["Author, A.", "Wang, R. J. E.", "Author, B."],
+            ["Author, Alice", "Other, Q.", "Author, B."],
+        ]
+        mappings = graph_translation(chains, "author, a.", "author, b.")
+        self.assertEqual(len(mappings), 3)
+        self.assertEqual(mappings[0], {"author, a.": "Author, A.",
+                                       "author, alice": "Author, A."})
+        # "Wang, R. J. E." is equal to "Wang, Rahul", but not to
+        # "Wang, Rahul S. J.", so it can't share their node
+        self.assertEqual(mappings[1], {"wang, rahul s. j.": "Wang, Rahul",
+                                       "wang, rahul": "Wang, Rahul",
+                                       "wang, r. j. e.": "Wang, R. J. E.",
+                                       "other, q.": "Other, Q."})
+        self.assertEqual(set(mappings[2].values()), {"Author, B."})
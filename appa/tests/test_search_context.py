@@ -0,0 +1,45 @@
+import threading
+from unittest import TestCase
+
+import search_context
+from log_buddy import lb
+from repository import Repository
+
+
+class TestSearchContext(TestCase):
+    def test_isolation(self):
+        repository = Repository(can_skip_refresh=True)
+        lb.reset_stats()
+        outer_ads_buddy = repository.ads_buddy
+        
+        with search_context.SearchContext() as context:
+            self.assertIs(search_context.current(), context)
+            lb.on_author_queried_from_ADS(3)
+            self.assertEqual(lb.n_authors_from_ADS, 3)
+            self.assertIsNot(repository.ads_buddy, outer_ads_buddy)
+            self.assertIs(repository.ads_buddy, repository.ads_buddy)
+        
+        self.assertIsNot(search_context.current(), context)
+        self.assertEqual(lb.n_authors_from_ADS, 0)
+        self.assertIs(repository.ads_buddy, outer_ads_buddy)
+    
+    def test_concurrent_searches(self):
+        barrier = threading.Barrier(4)
+        counts = []
+        
+        def search(n):
+            with search_context.SearchContext():
+                # Every thread holds its context open at the same time
+                barrier.wait(5)
+                for _ in range(n):
+                    lb.on_author_queried_from_ADS()
+                barrier.wait(5)
+                counts.append((n, lb.n_authors_from_ADS))
+        
+        threads = [threading.Thread(target=search, args=(n,))
+                   for n in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(counts), [(n, n) for n in range(1, 5)])
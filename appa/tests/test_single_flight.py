@@ -0,0 +1,102 @@
+import threading
+import time
+from unittest import TestCase
+
+from single_flight import SingleFlight
+
+
+class TestSingleFlight(TestCase):
+    def test_coalescing(self):
+        flight = SingleFlight("test")
+        started = threading.Event()
+        release = threading.Event()
+        n_fetches = 0
+        
+        def fetch(key):
+            nonlocal n_fetches
+            n_fetches += 1
+            started.set()
+            release.wait(5)
+            return key.upper()
+        
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do('a', fetch, 'a')))
+        leader.start()
+        self.assertTrue(started.wait(5))
+        followers = [threading.Thread(
+            target=lambda: results.append(flight.do('a', fetch, 'a')))
+            for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        # Wait until every follower has joined the in-flight call
+        deadline = time.monotonic() + 5
+        while (flight.stats()['n_coalesced'] < 3
+               and time.monotonic() < deadline):
+            time.sleep(.001)
+        self.assertEqual(flight.stats()['n_coalesced'], 3)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        
+        self.assertEqual(results, ['A'] * 4)
+        self.assertEqual(n_fetches, 1)
+        self.assertEqual(flight.stats(),
+                         {'n_calls': 4, 'n_coalesced': 3, 'n_in_flight': 0})
+        
+        # Once complete, the next call fetches again
+        self.assertEqual(flight.do('a', fetch, 'a'), 'A')
+        self.assertEqual(n_fetches, 2)
+    
+    def test_exception(self):
+        flight = SingleFlight("test")
+        
+        def fetch():
+            raise KeyError("missing")
+        
+        with self.assertRaises(KeyError):
+            flight.do('a', fetch)
+        self.assertEqual(flight.stats()['n_in_flight'], 0)
+    
+    def test_retry_on(self):
+        flight = SingleFlight("test", retry_on=(KeyError,))
+        started = threading.Event()
+        release = threading.Event()
+        n_fetches = 0
+        
+        def fetch():
+            nonlocal n_fetches
+            n_fetches += 1
+            if n_fetches == 1:
+                started.set()
+                release.wait(5)
+                raise KeyError("leader only")
+            return 'A'
+        
+        results = []
+        
+        def call():
+            try:
+                results.append(flight.do('a', fetch))
+            except KeyError as e:
+                results.append(e)
+        
+        leader = threading.Thread(target=call)
+        leader.start()
+        self.assertTrue(started.wait(5))
+        follower = threading.Thread(target=call)
+        follower.start()
+        deadline = time.monotonic() + 5
+        while (flight.stats()['n_coalesced'] < 1
+               and time.monotonic() < deadline):
+            time.sleep(.001)
+        self.assertEqual(flight.stats()['n_coalesced'], 1)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        
+        # The leader's error isn't shared, and the follower fetches again
+        self.assertIsInstance(results[0], KeyError)
+        self.assertEqual(results[1], 'A')
+        self.assertEqual(n_fetches, 2)
+        self.assertEqual(flight.stats()['n_in_flight'], 0)
@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+import search_context
+from benchmarks import bench_search
+from benchmarks.synthetic_corpus import SyntheticCorpus, use_corpus
+from cache import cache_buddy
+from names.ads_name import ADSName
+from path_finder import PathFinder
+from route_jsonifyer import to_json
+
+
+class TestSyntheticCorpus(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = SyntheticCorpus(
+            n_people=1_000, n_documents=1_000, collaboration_size=100,
+            papers_per_collaboration=2)
+    
+    def test_records(self):
+        n_authors = [len(doc['authors'])
+                     for doc in self.corpus.documents.values()]
+        self.assertGreater(max(n_authors), 90)
+        
+        with use_corpus(self.corpus) as backing_cache:
+            bibcode, document = next(iter(self.corpus.documents.items()))
+            author = document['authors'][0]
+            record = backing_cache.load_author(author)
+            self.assertEqual(record['name'],
+                             ADSName.parse(author).qualified_full_name)
+            self.assertIn(bibcode, record['documents'])
+            for coauthor in document['authors'][1:]:
+                if ADSName.parse(coauthor) != ADSName.parse(author):
+                    self.assertIn(coauthor, record['coauthors'])
+            
+            orcid_id = next(orcid_id for doc in self.corpus.documents.values()
+                            for orcid_id in doc['orcid_ids'] if orcid_id)
+            record = cache_buddy.load_author(orcid_id)
+            self.assertGreater(len(record.documents), 0)
+            
+            with self.assertRaises(cache_buddy.CacheMiss):
+                backing_cache.load_author("Nobody, N.")
+        self.assertEqual(len(cache_buddy._loaded_authors), 0)
+    
+    def test_search(self):
+        with use_corpus(self.corpus):
+            src, dest = bench_search.choose_searches(self.corpus, 1)[0]
+            with search_context.SearchContext():
+                pf = PathFinder(src, dest, [])
+                pf.find_path()
+                result = to_json(pf)
+        self.assertIn('"chains"', result)
+    
+    def test_find_regressions(self):
+        self.assertEqual(
+            bench_search.find_regressions({'a': 1, 'b': 3, 'c': 5},
+                                          {'a': 2, 'b': 2}),
+            ['b'])
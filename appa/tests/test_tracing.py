@@ -0,0 +1,52 @@
+import json
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from cache import cache_buddy
+
+import ads_buddy
+import path_finder
+import search_context
+import tracing
+from tests import mock_backing_cache
+
+
+@patch.object(ads_buddy, "requests", MagicMock)
+class TestTracing(TestCase):
+    def setUp(self):
+        self.real_backing_cache = cache_buddy.backing_cache
+        cache_buddy.backing_cache = mock_backing_cache
+    
+    def tearDown(self):
+        cache_buddy.backing_cache = self.real_backing_cache
+        cache_buddy._loaded_authors = {}
+        cache_buddy._derived_authors = {}
+        cache_buddy._loaded_documents = {}
+    
+    def test_untraced(self):
+        with search_context.SearchContext():
+            self.assertIsNone(tracing.current_tracer())
+            self.assertIs(tracing.span("anything"), tracing._null_span)
+    
+    def test_trace(self):
+        with search_context.SearchContext():
+            tracer = tracing.start_trace()
+            pf = path_finder.PathFinder("Author, K", "Author, H", [])
+            pf.find_path()
+        
+        trace = json.loads(tracing.export_chrome_trace(tracer))
+        events = trace['traceEvents']
+        names = [event['name'] for event in events]
+        self.assertEqual(names.count("search"), 1)
+        self.assertEqual(names.count("level"), pf.n_iterations)
+        self.assertIn("expand_author", names)
+        self.assertIn("cache_load_author", names)
+        
+        # Each span lies within the search's span
+        search = events[names.index("search")]
+        self.assertEqual(search['args']['src'], str(pf.orig_src))
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertGreaterEqual(event['ts'], search['ts'])
+            self.assertLessEqual(event['ts'] + event['dur'],
+                                 search['ts'] + search['dur'])
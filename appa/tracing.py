@@ -0,0 +1,88 @@
+"""
+Lightweight tracing of the phases of a single search
+
+Code marks out phases with `with tracing.span("name", arg=value):`. Spans
+are only recorded once start_trace() has been called in the current search
+context (backend_common does this when a search is requested with the
+`trace` flag); otherwise span() returns a shared do-nothing context manager,
+so the instrumentation costs little. A recorded trace is exported in the
+Chrome trace event format, which can be opened in chrome://tracing or
+https://ui.perfetto.dev.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+import search_context
+
+_null_span = contextlib.nullcontext()
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self._t_start = time.perf_counter()
+    
+    def add_span(self, name, t_start, t_stop, args):
+        # list.append is atomic, so spans can come from several threads
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': (t_start - self._t_start) * 1e6,
+            'dur': (t_stop - t_start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+    
+    def chrome_trace(self):
+        return {'traceEvents': list(self.events),
+                'displayTimeUnit': 'ms'}
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+    
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add_span(
+            self.name, self.t_start, time.perf_counter(), self.args)
+        return False
+
+
+def _no_tracer():
+    return None
+
+
+def current_tracer():
+    """Returns the current search's Tracer, or None if it isn't traced"""
+    return search_context.current().get('tracer', _no_tracer)
+
+
+def start_trace() -> Tracer:
+    tracer = Tracer()
+    search_context.current().set('tracer', tracer)
+    return tracer
+
+
+def span(name, **args):
+    """Returns a context manager recording a span, if tracing is on"""
+    tracer = current_tracer()
+    if tracer is None:
+        return _null_span
+    return _Span(tracer, name, args)
+
+
+def export_chrome_trace(tracer: Tracer):
+    # Span arguments such as ADSNames are written as strings
+    return json.dumps(tracer.chrome_trace(), default=str)